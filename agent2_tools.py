@@ -1,6 +1,25 @@
 from langchain.tools import tool
 from tavily import TavilyClient
 import os
+import threading
+
+import search_index
+
+_tavily_lock = threading.Lock()
+_tavily_client = None
+
+def get_tavily_client() -> TavilyClient:
+    """
+    Returns the process-wide Tavily client, created on first use. The SDK
+    sends each search with a plain requests call and takes no session, so
+    connections are not reused between searches; search_index keeps most
+    searches off the network instead.
+    """
+    global _tavily_client
+    with _tavily_lock:
+        if _tavily_client is None:
+            _tavily_client = TavilyClient(api_key=os.environ["TAVILY_API_KEY"])
+        return _tavily_client
 
 @tool
 def code_search(query: str) -> str:
@@ -9,9 +28,11 @@ def code_search(query: str) -> str:
     Use this tool to find examples of how to implement a specific automation task.
     """
     try:
-        tavily = TavilyClient(api_key=os.environ["TAVILY_API_KEY"])
-        response = tavily.search(query=query, search_depth="advanced")
-        return "\n".join([f"Source: {r['url']}\n{r['content']}" for r in response['results']])
+        results = search_index.search(
+            query, "advanced",
+            lambda: get_tavily_client().search(query=query, search_depth="advanced")['results'],
+        )
+        return "\n".join([f"Source: {r['url']}\n{r['content']}" for r in results])
     except Exception as e:
         return f"Error searching for code: {e}"
 
@@ -22,9 +43,12 @@ def dependency_suggester(task_description: str) -> str:
     Use this to find the right libraries for the job.
     """
     try:
-        tavily = TavilyClient(api_key=os.environ["TAVILY_API_KEY"])
-        response = tavily.search(query=f"python libraries for {task_description}", search_depth="basic")
-        return "\n".join([f"Source: {r['url']}\n{r['content']}" for r in response['results']])
+        query = f"python libraries for {task_description}"
+        results = search_index.search(
+            query, "basic",
+            lambda: get_tavily_client().search(query=query, search_depth="basic")['results'],
+        )
+        return "\n".join([f"Source: {r['url']}\n{r['content']}" for r in results])
     except Exception as e:
         return f"Error suggesting dependencies: {e}"
 
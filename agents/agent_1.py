@@ -1,67 +1,315 @@
 from pathlib import Path
 import json
-import fitz  # PyMuPDF
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import HTTPException
 
-from llm_utils import get_llm_response, extract_json_from_response
+from config import (
+    INGEST_CACHE_ENABLED, PDF_IO_WORKERS, IMAGE_PHASH_ENABLED,
+    AGENT1_TOKEN_BUDGET, AGENT1_CHUNK_TOKENS, AGENT1_CHUNK_CONCURRENCY, LLM_HEDGING_ENABLED,
+)
+from llm_utils import get_llm_json_streaming, get_llm_response_async, run_async, extract_json_from_response
+import ingest_cache
+import pdf_extraction
+import prompt_builder
+import state_manager
+import telemetry
 
-def run_agent1(seq_no: str, task_dir: Path, pdf_path: Path, instructions: str, platform: str) -> dict:
+SYSTEM_PROMPT = (
+    "You are a master test automation planner. Your task is to create a detailed JSON blueprint for an automation script. "
+    "The JSON output MUST be a single object with two top-level keys: 'summary' and 'steps'.\n"
+    "1. The 'summary' object must contain: 'goal' (a concise summary of the overall objective from user instructions), "
+    "'target_application' (the application name or package ID, inferred from the context, e.g., 'com.microsoft.office.outlook' or 'Outlook Web'), and 'platform'.\n"
+    "2. The 'steps' array must contain a list of sequential actions. Each step must include: 'step_id', 'screen_name', "
+    "'description', 'action' (e.g., 'click', 'type_text'), 'target_element_description', "
+    "'value_to_enter' (or null), and 'associated_image' (or null).\n"
+    "Respond with ONLY the JSON content."
+)
+
+def _write_image(image_bytes: bytes, image_ext: str, image_filepath: Path, phash: str):
+    """Writes one extracted image (via the blob store when the ingest cache is on)."""
+    if not INGEST_CACHE_ENABLED:
+        image_filepath.write_bytes(image_bytes)
+        return None
+    digest = ingest_cache.store_blob(image_bytes, image_ext)
+    ingest_cache.link_blob(ingest_cache.blob_path(digest, image_ext), image_filepath)
+    if phash:
+        ingest_cache.register_image_hash(phash, digest, image_ext)
+    return {"name": image_filepath.name, "blob": digest, "ext": image_ext}
+
+def _link_known_image(known: dict, image_filepath: Path) -> dict:
+    """Points a new image at an identical-looking one already in the blob store, without writing it again."""
+    ingest_cache.link_blob(ingest_cache.blob_path(known["blob"], known["ext"]), image_filepath)
+    return {"name": image_filepath.name, "blob": known["blob"], "ext": known["ext"]}
+
+def _extract_pdf(pdf_path: Path, out_dir: Path) -> tuple:
     """
-    Agent 1: Parses a PDF for text and images, then uses an LLM to generate
-    a detailed JSON blueprint for the automation task.
+    Streams pages from the parallel extractor in page order, collecting page
+    texts into a list and handing image writes to an I/O thread pool.
+
+    Images are deduplicated: repeats of an xref within the document become
+    aliases of the first copy, and (with the ingest cache on) images whose
+    perceptual hash exactly matches one stored for another document reuse
+    that blob instead of being written again.
+    Returns (page_texts, image_paths, image_blobs, aliases).
     """
-    print(f"[{seq_no}] Running Agent 1: Blueprint Generation")
-    out_dir = task_dir / "agent1"
-    out_dir.mkdir(parents=True, exist_ok=True)
-    
-    # 1. Extract text and images from the PDF
-    pdf_text_content, image_paths = "", []
-    try:
-        doc = fitz.open(pdf_path)
-        for page_num, page in enumerate(doc):
-            pdf_text_content += f"\n--- PDF Page {page_num + 1} Text ---\n{page.get_text()}"
-            for img_index, img in enumerate(page.get_images(full=True)):
-                xref = img[0]
-                base_image = doc.extract_image(xref)
-                image_bytes, image_ext = base_image["image"], base_image["ext"]
-                image_filename = f"page{page_num+1}_img{img_index}.{image_ext}"
+    page_texts, image_paths, pending_writes = [], [], []
+    name_by_xref, aliases = {}, {}
+    hash_images = INGEST_CACHE_ENABLED and IMAGE_PHASH_ENABLED
+    with ThreadPoolExecutor(max_workers=PDF_IO_WORKERS, thread_name_prefix="aisa-image-io") as io_pool:
+        for page in pdf_extraction.iter_pages(pdf_path, hash_images):
+            page_no = page["page_num"] + 1
+            page_texts.append(page["text"])
+            for img in page["images"]:
+                if "bytes" not in img:
+                    canonical = name_by_xref[img["xref"]]
+                    aliases[f"page{page_no}_img{img['index']}.{canonical.rsplit('.', 1)[1]}"] = canonical
+                    continue
+
+                image_filename = f"page{page_no}_img{img['index']}.{img['ext']}"
+                name_by_xref[img["xref"]] = image_filename
+                phash = img["phash"]
                 image_filepath = out_dir / image_filename
-                image_filepath.write_bytes(image_bytes)
+                known = ingest_cache.find_image(phash) if phash else None
+                if known:
+                    pending_writes.append(io_pool.submit(_link_known_image, known, image_filepath))
+                else:
+                    pending_writes.append(io_pool.submit(_write_image, img["bytes"], img["ext"], image_filepath, phash))
                 image_paths.append(str(image_filepath))
-        print(f"[{seq_no}] Extracted {len(image_paths)} images and text from PDF.")
-    except Exception as e:
-        print(f"[{seq_no}] Warning: PDF processing failed: {e}")
-        pdf_text_content = "Could not read PDF. Relying on user instructions only."
+        image_blobs = [write.result() for write in pending_writes]
+    return page_texts, image_paths, image_blobs, aliases
+
+def _apply_image_aliases(blueprint, aliases: dict):
+    """Rewrites each step's 'associated_image' to the canonical copy of a deduplicated image."""
+    steps = blueprint.get("steps", []) if isinstance(blueprint, dict) else blueprint
+    for step in steps if isinstance(steps, list) else []:
+        if isinstance(step, dict) and step.get("associated_image") in aliases:
+            step["associated_image"] = aliases[step["associated_image"]]
+    return blueprint
+
+# Keys every streamed step must carry; anything less aborts the generation early.
+REQUIRED_STEP_KEYS = ("action", "description")
 
-    # 2. Define prompts and call LLM for the blueprint
-    system_prompt = (
-        "You are a master test automation planner. Your task is to create a detailed JSON blueprint for an automation script. "
-        "The JSON output MUST be a single object with two top-level keys: 'summary' and 'steps'.\n"
-        "1. The 'summary' object must contain: 'goal' (a concise summary of the overall objective from user instructions), "
-        "'target_application' (the application name or package ID, inferred from the context, e.g., 'com.microsoft.office.outlook' or 'Outlook Web'), and 'platform'.\n"
-        "2. The 'steps' array must contain a list of sequential actions. Each step must include: 'step_id', 'screen_name', "
-        "'description', 'action' (e.g., 'click', 'type_text'), 'target_element_description', "
-        "'value_to_enter' (or null), and 'associated_image' (or null).\n"
-        "Respond with ONLY the JSON content."
-    )
-    user_prompt = f"""
+def _check_blueprint_field(key: str, value) -> None:
+    if key == "summary" and not isinstance(value, dict):
+        raise ValueError("Blueprint 'summary' must be a JSON object.")
+    if key == "steps" and not isinstance(value, list):
+        raise ValueError("Blueprint 'steps' must be a JSON array.")
+
+def _check_step(key: str, index: int, step) -> None:
+    if key != "steps":
+        return
+    if not isinstance(step, dict) or any(k not in step for k in REQUIRED_STEP_KEYS):
+        raise ValueError(f"Blueprint step {index + 1} is malformed: {json.dumps(step)[:200]}")
+
+def _generate_blueprint(user_prompt: str, on_step=None) -> tuple:
+    """
+    Streams one blueprint completion, validating the summary and each step as
+    it arrives. Returns (blueprint, response_text).
+    """
+    def on_item(key, index, step):
+        _check_step(key, index, step)
+        if on_step and key == "steps":
+            on_step(index)
+
+    return get_llm_json_streaming(user_prompt, SYSTEM_PROMPT, on_field=_check_blueprint_field, on_item=on_item)
+
+def _parse_blueprint(response_text: str):
+    """Parses a complete blueprint reply and applies the same checks as the streaming path."""
+    blueprint = extract_json_from_response(response_text)
+    for key in ("summary", "steps"):
+        if key in blueprint:
+            _check_blueprint_field(key, blueprint[key])
+    for index, step in enumerate(blueprint.get("steps", [])):
+        _check_step("steps", index, step)
+    return blueprint
+
+async def _generate_blueprint_async(user_prompt: str) -> tuple:
+    """
+    Gets one blueprint through the async LLM layer (hedged across providers
+    when enabled); a reply that fails the checks counts as that provider
+    failing. Returns (blueprint, response_text).
+    """
+    response_text = await get_llm_response_async(user_prompt, SYSTEM_PROMPT, validate=_parse_blueprint)
+    return _parse_blueprint(response_text), response_text
+
+def _build_user_prompt(platform: str, instructions: str, pdf_text: str, image_names: list, part: str = "") -> str:
+    return f"""
     Platform: {platform}
-    User Instructions: --- {instructions} ---
-    Extracted PDF Text: --- {pdf_text_content} ---
-    Available Image Files for Context: --- {', '.join([Path(p).name for p in image_paths])} ---
+    User Instructions: --- {instructions} ---{part}
+    Extracted PDF Text: --- {pdf_text} ---
+    Available Image Files for Context: --- {', '.join(image_names)} ---
     Generate the detailed JSON blueprint.
     """
+
+def _generate_chunked_blueprint(seq_no: str, platform: str, instructions: str, page_texts: list,
+                                image_names: list, token_usage: dict) -> dict:
+    """
+    Splits an oversized document into page chunks, asks the LLM for the steps
+    covered by each chunk concurrently (at most AGENT1_CHUNK_CONCURRENCY at a
+    time, on the shared LLM event loop), and merges the partial blueprints in
+    document order.
+    """
+    chunks = prompt_builder.chunk_pages(page_texts, AGENT1_CHUNK_TOKENS)
+    chunk_starts = [first_page for first_page, _ in chunks] + [len(page_texts) + 1]
+    print(f"[{seq_no}] Document exceeds the token budget; splitting into {len(chunks)} chunks.")
+
+    async def run_chunk(index: int, semaphore: asyncio.Semaphore) -> dict:
+        first_page, chunk_text = chunks[index]
+        last_page = chunk_starts[index + 1] - 1
+        chunk_pages = {f"page{page_no}_" for page_no in range(first_page, last_page + 1)}
+        chunk_images = [name for name in image_names if name.split("img")[0] in chunk_pages]
+        part = (
+            f"\n    Document Part: {index + 1} of {len(chunks)} (pages {first_page}-{last_page}). "
+            "Only produce the summary and the steps covered by this part; "
+            "the parts will be merged in order."
+        )
+        user_prompt = _build_user_prompt(platform, instructions, chunk_text, chunk_images, part)
+        async with semaphore:
+            blueprint, response_text = await _generate_blueprint_async(user_prompt)
+        return {
+            "blueprint": blueprint,
+            "prompt_tokens": prompt_builder.estimate_tokens(SYSTEM_PROMPT + user_prompt),
+            "response_tokens": prompt_builder.estimate_tokens(response_text),
+        }
+
+    async def run_chunks() -> list:
+        semaphore = asyncio.Semaphore(AGENT1_CHUNK_CONCURRENCY)
+        tasks = [asyncio.ensure_future(run_chunk(index, semaphore)) for index in range(len(chunks))]
+        try:
+            return await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()  # The other chunks are useless once one has failed.
+
+    results = run_async(run_chunks())
+
+    token_usage["chunks"] = [
+        {"prompt_tokens": r["prompt_tokens"], "response_tokens": r["response_tokens"]} for r in results
+    ]
+    token_usage["prompt_tokens"] = sum(r["prompt_tokens"] for r in results)
+    token_usage["response_tokens"] = sum(r["response_tokens"] for r in results)
+    return prompt_builder.merge_blueprints([r["blueprint"] for r in results])
+
+def extract_pdf_content(seq_no: str, pdf_path: Path, out_dir: Path, pdf_hash: str = None) -> dict:
+    """
+    Extracts the text and images of a PDF into `out_dir`, reusing an earlier
+    extraction of the same file. `pdf_hash` is the file's sha256 if already
+    known (e.g. computed during upload). Returns {"pdf_hash", "page_texts",
+    "image_paths", "aliases"}; "page_texts" is None if the PDF could not be read.
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    with telemetry.span("pdf.extract", seq_no=seq_no) as span:
+        pdf_hash = pdf_hash or ingest_cache.hash_file(pdf_path)
+        cached_extraction = ingest_cache.load_extraction(pdf_hash) if INGEST_CACHE_ENABLED else None
+        if INGEST_CACHE_ENABLED:
+            ingest_cache.dedupe_file(pdf_path, pdf_hash, "pdf")
+        span["cached"] = bool(cached_extraction)
+
+        if cached_extraction:
+            page_texts, image_aliases = cached_extraction["pages"], cached_extraction["aliases"]
+            image_paths = ingest_cache.materialize_images(cached_extraction["images"], out_dir)
+            print(f"[{seq_no}] Reused cached extraction ({len(image_paths)} images) for PDF {pdf_hash[:12]}.")
+        else:
+            try:
+                page_texts, image_paths, image_blobs, image_aliases = _extract_pdf(pdf_path, out_dir)
+                print(f"[{seq_no}] Extracted {len(image_paths)} unique images ({len(image_aliases)} duplicates skipped) and text from PDF.")
+                if INGEST_CACHE_ENABLED:
+                    ingest_cache.save_extraction(pdf_hash, page_texts, image_blobs, image_aliases)
+            except Exception as e:
+                print(f"[{seq_no}] Warning: PDF processing failed: {e}")
+                page_texts, image_paths, image_aliases = None, [], {}
+                span["failed"] = True
+        span.update({"pages": len(page_texts or []), "images": len(image_paths)})
+
+    return {"pdf_hash": pdf_hash, "page_texts": page_texts, "image_paths": image_paths, "aliases": image_aliases}
+
+def share_extraction(extraction: dict, out_dir: Path) -> dict:
+    """Hardlinks the images of an extraction done elsewhere into `out_dir` and returns the extraction for it."""
+    out_dir.mkdir(parents=True, exist_ok=True)
+    image_paths = []
+    for image_path in extraction["image_paths"]:
+        dest = out_dir / Path(image_path).name
+        ingest_cache.link_blob(Path(image_path), dest)
+        image_paths.append(str(dest))
+    return {**extraction, "image_paths": image_paths}
+
+def generate_blueprint(seq_no: str, out_dir: Path, extraction: dict, instructions: str, platform: str) -> dict:
+    """Generates (or reuses) the blueprint for one task from an extracted PDF."""
+    page_texts, image_paths, image_aliases = extraction["page_texts"], extraction["image_paths"], extraction["aliases"]
+
+    # Reuse the blueprint if this exact PDF, instructions and platform were seen before
+    cache_key = ingest_cache.blueprint_key(extraction["pdf_hash"], instructions, platform)
+    cached_blueprint = ingest_cache.load_blueprint(cache_key) if INGEST_CACHE_ENABLED else None
+    if cached_blueprint is not None:
+        blueprint_path = out_dir / "blueprint.json"
+        blueprint_path.write_text(json.dumps(cached_blueprint, indent=2), encoding="utf-8")
+        print(f"[{seq_no}] Agent 1 reused a cached blueprint. Blueprint written to {blueprint_path}")
+        return cached_blueprint
+
+    # 2. Build the prompt within the token budget and call the LLM for the blueprint
+    image_names = [Path(p).name for p in image_paths]
+    token_usage = {"budget": AGENT1_TOKEN_BUDGET}
+    if page_texts is None:
+        pdf_text_content = "Could not read PDF. Relying on user instructions only."
+    else:
+        token_usage["pdf_text_raw"] = prompt_builder.estimate_tokens("".join(page_texts))
+        pdf_text_content = prompt_builder.format_pages(page_texts)
+    user_prompt = _build_user_prompt(platform, instructions, pdf_text_content, image_names)
+    if page_texts and prompt_builder.estimate_tokens(SYSTEM_PROMPT + user_prompt) > AGENT1_TOKEN_BUDGET:
+        # Headers, footers and page numbers are only dropped when the full text does not fit.
+        page_texts = prompt_builder.strip_boilerplate(page_texts)
+        pdf_text_content = prompt_builder.format_pages(page_texts)
+        user_prompt = _build_user_prompt(platform, instructions, pdf_text_content, image_names)
+        token_usage["boilerplate_stripped"] = True
+    if page_texts is not None:
+        token_usage["pdf_text"] = prompt_builder.estimate_tokens(pdf_text_content)
     
     try:
-        response_text = get_llm_response(user_prompt, system_prompt)
-        blueprint = extract_json_from_response(response_text)
+        if page_texts and prompt_builder.estimate_tokens(SYSTEM_PROMPT + user_prompt) > AGENT1_TOKEN_BUDGET:
+            blueprint = _generate_chunked_blueprint(seq_no, platform, instructions, page_texts, image_names, token_usage)
+        elif LLM_HEDGING_ENABLED:
+            # A hedged call cannot stream: the reply is checked once it is complete.
+            blueprint, response_text = run_async(_generate_blueprint_async(user_prompt))
+            state_manager.report_progress(seq_no, "agent1", force=True, steps_received=len(blueprint.get("steps", [])))
+        else:
+            def on_step(index: int) -> None:
+                state_manager.report_progress(seq_no, "agent1", steps_received=index + 1)
+            blueprint, response_text = _generate_blueprint(user_prompt, on_step)
+            token_usage["prompt_tokens"] = prompt_builder.estimate_tokens(SYSTEM_PROMPT + user_prompt)
+            token_usage["response_tokens"] = prompt_builder.estimate_tokens(response_text)
+        blueprint = _apply_image_aliases(blueprint, image_aliases)
+        state_manager.update_task_state(seq_no, {"token_usage": {"agent1": token_usage}})
         
         # Save the blueprint to a file
         blueprint_path = out_dir / "blueprint.json"
         blueprint_path.write_text(json.dumps(blueprint, indent=2), encoding="utf-8")
+        if INGEST_CACHE_ENABLED:
+            ingest_cache.save_blueprint(cache_key, blueprint)
         
         print(f"[{seq_no}] Agent 1 finished successfully. Blueprint created at {blueprint_path}")
         return blueprint
     except (ValueError, Exception) as e:
         print(f"[{seq_no}] Agent 1 failed: {e}")
         raise HTTPException(status_code=500, detail=f"Agent 1 (Blueprint) failed: {e}")
+
+def run_agent1(seq_no: str, task_dir: Path, pdf_path: Path, instructions: str, platform: str,
+               extraction: dict = None, pdf_hash: str = None) -> dict:
+    """
+    Agent 1: Parses a PDF for text and images, then uses an LLM to generate
+    a detailed JSON blueprint for the automation task. A batch passes the
+    `extraction` it already made of the shared PDF; `pdf_hash` is the
+    sha256 recorded at upload, if any.
+    """
+    print(f"[{seq_no}] Running Agent 1: Blueprint Generation")
+    out_dir = task_dir / "agent1"
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    # 1. Extract text and images from the PDF (once per batch)
+    if extraction is None:
+        extraction = extract_pdf_content(seq_no, pdf_path, out_dir, pdf_hash)
+    else:
+        extraction = share_extraction(extraction, out_dir)
+
+    # 2. Generate the blueprint for this task's instructions
+    return generate_blueprint(seq_no, out_dir, extraction, instructions, platform)
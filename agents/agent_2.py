@@ -1,38 +1,205 @@
 from pathlib import Path
 import json
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+import httpx
 from fastapi import HTTPException
 from langchain.agents import AgentExecutor, create_react_agent
+from langchain_core.caches import BaseCache
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.load import dumps, loads
 from langchain_core.prompts import PromptTemplate
 from langchain_groq import ChatGroq
 from langchain_anthropic import ChatAnthropic
 
 from agent2_tools import code_search, dependency_suggester, create_todo_list
+from config import LLM_MAX_CONNECTIONS, SCRIPT_POSTPROCESS_ENABLED
+from json_stream import IncrementalJSONParser
+import events
+import llm_cache
+import script_postprocess
+import state_manager
+import telemetry
 
-# --- Agent 2's Core Logic (Now with LangChain) ---
+class SharedLLMCache(BaseCache):
+    """
+    LangChain cache backed by llm_cache, so Agent 2's ReAct steps share the
+    same on-disk store, TTL/LRU eviction and hit/miss counters as Agent 1.
+    LangChain's llm_string already encodes the provider, model and params.
 
-def run_agent2(seq_no: str, task_dir: Path, blueprint: dict) -> dict:
+    Inside run(), the steps of one agent run are only written once the run's
+    final answer has been validated; see run().
     """
-    Agent 2: Generates a runnable automation script using a LangChain agent
-    with powerful tools.
+
+    _run = contextvars.ContextVar("agent2_cache_run", default=None)
+
+    def lookup(self, prompt: str, llm_string: str):
+        cached = llm_cache.get("langchain", llm_string, "", prompt)
+        run = self._run.get()
+        if cached is not None and run is not None:
+            run["hits"].append((prompt, llm_string))
+        return loads(cached) if cached is not None else None
+
+    def update(self, prompt: str, llm_string: str, return_val) -> None:
+        run = self._run.get()
+        if run is not None:
+            run["writes"].append((prompt, llm_string, dumps(return_val)))
+            return
+        llm_cache.put("langchain", llm_string, "", prompt, dumps(return_val))
+
+    @contextmanager
+    def run(self):
+        """
+        Holds back the cache writes of the ReAct steps made in the block and
+        stores them only if it completes. If it raises (the final answer did
+        not parse or its script did not compile), the writes are dropped and
+        the cached steps it replayed are invalidated, so a re-run of the same
+        task asks the model again instead of replaying the same bad answer.
+        """
+        run = {"hits": [], "writes": []}
+        token = self._run.set(run)
+        try:
+            yield
+        except BaseException:
+            for prompt, llm_string in run["hits"]:
+                llm_cache.delete("langchain", llm_string, "", prompt)
+            raise
+        else:
+            for prompt, llm_string, value in run["writes"]:
+                llm_cache.put("langchain", llm_string, "", prompt, value)
+        finally:
+            self._run.reset(token)
+
+    def clear(self, **kwargs) -> None:
+        llm_cache.clear()
+
+shared_llm_cache = SharedLLMCache()
+
+class FinalAnswerStreamHandler(BaseCallbackHandler):
+    """
+    Watches the streamed tokens of each ReAct step. Once the model starts its
+    "Final Answer:", the tokens are fed to an IncrementalJSONParser so the
+    script is syntax-checked as soon as its field is complete (aborting the
+    run on a broken script) and progress reaches status.json while the
+    answer is still being generated.
     """
-    print(f"[{seq_no}] Running Agent 2: LangChain-Powered Code Generation")
-    out_dir = task_dir / "agent2"
-    out_dir.mkdir(parents=True, exist_ok=True)
 
-    platform = blueprint.get("summary", {}).get("platform", "web")
-    framework = "Appium" if platform == "mobile" else "Playwright"
+    raise_error = True
+    FINAL_ANSWER_MARKER = "Final Answer:"
 
-    # 1. Initialize the LLM (Groq with Anthropic fallback)
-    try:
-        llm = ChatGroq(temperature=0, model_name="llama3-70b-8192")
-    except Exception:
-        llm = ChatAnthropic(model="claude-3-haiku-20240307")
+    def __init__(self, seq_no: str):
+        self.seq_no = seq_no
+        self._reset()
+
+    def _reset(self) -> None:
+        self._text = ""
+        self._parser = None
+        self._answer_chars = 0
+
+    def _on_field(self, key: str, value) -> None:
+        if key == "script":
+            if not isinstance(value, str) or not value.strip():
+                raise ValueError("Final answer has an empty or non-string 'script'.")
+            compile(value, "automation_script.py", "exec")
+        state_manager.report_progress(self.seq_no, "agent2", force=True, field_received=key)
+
+    def on_llm_new_token(self, token: str, **kwargs) -> None:
+        if self._parser is None:
+            self._text += token
+            marker_at = self._text.find(self.FINAL_ANSWER_MARKER)
+            if marker_at == -1:
+                return
+            self._parser = IncrementalJSONParser(on_field=self._on_field)
+            token = self._text[marker_at + len(self.FINAL_ANSWER_MARKER):]
+        self._parser.feed(token)
+        self._answer_chars += len(token)
+        state_manager.report_progress(self.seq_no, "agent2", final_answer_chars=self._answer_chars)
+
+    def on_llm_end(self, response, **kwargs) -> None:
+        self._reset()
+
+class ToolStepEventHandler(BaseCallbackHandler):
+    """Publishes each ReAct tool call (name, input, truncated output) to the task's event stream."""
+
+    MAX_OUTPUT_CHARS = 2000
+
+    def __init__(self, seq_no: str):
+        self.seq_no = seq_no
+        self._tools = {}
+
+    def on_tool_start(self, serialized: dict, input_str: str, *, run_id, **kwargs) -> None:
+        name = (serialized or {}).get("name") or kwargs.get("name", "tool")
+        self._tools[run_id] = name
+        events.publish(self.seq_no, "tool", {"phase": "start", "tool": name, "input": input_str})
+
+    def on_tool_end(self, output, *, run_id, **kwargs) -> None:
+        name = self._tools.pop(run_id, kwargs.get("name", "tool"))
+        events.publish(self.seq_no, "tool", {
+            "phase": "end", "tool": name, "output": str(output)[:self.MAX_OUTPUT_CHARS],
+        })
+
+    def on_tool_error(self, error: BaseException, *, run_id, **kwargs) -> None:
+        name = self._tools.pop(run_id, kwargs.get("name", "tool"))
+        events.publish(self.seq_no, "tool", {"phase": "error", "tool": name, "error": str(error)})
+
+class TracingHandler(BaseCallbackHandler):
+    """Records each ReAct LLM call (provider, model, tokens) and tool call as a telemetry span."""
+
+    MAX_INPUT_CHARS = 200
 
-    # 2. Define the tools for the agent
-    tools = [code_search, dependency_suggester, create_todo_list]
+    def __init__(self, seq_no: str):
+        self.seq_no = seq_no
+        self._started = {}  # run_id -> (perf_counter at start, span attributes)
 
-    # 3. Create the prompt template
-    prompt_template = """
+    def _start_llm(self, serialized: dict, run_id, invocation_params: dict) -> None:
+        class_name = ((serialized or {}).get("id") or ["unknown"])[-1].lower()
+        provider = next((p for p in ("groq", "anthropic") if p in class_name), class_name)
+        params = invocation_params or {}
+        model = params.get("model_name") or params.get("model") or "unknown"
+        self._started[run_id] = (time.perf_counter(), {"provider": provider, "model": model})
+
+    def on_chat_model_start(self, serialized: dict, messages, *, run_id, **kwargs) -> None:
+        self._start_llm(serialized, run_id, kwargs.get("invocation_params"))
+
+    def on_llm_start(self, serialized: dict, prompts, *, run_id, **kwargs) -> None:
+        self._start_llm(serialized, run_id, kwargs.get("invocation_params"))
+
+    def _finish(self, name: str, run_id, status: str, **attributes) -> None:
+        started, base = self._started.pop(run_id, (None, {}))
+        if started is not None:
+            telemetry.record(name, time.perf_counter() - started, status, self.seq_no, **base, **attributes)
+
+    def on_llm_end(self, response, *, run_id, **kwargs) -> None:
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        tokens = {"prompt_tokens": usage.get("prompt_tokens"), "completion_tokens": usage.get("completion_tokens")}
+        if not usage:
+            # Streaming chat models report usage on the message instead.
+            for generations in response.generations:
+                for generation in generations:
+                    metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                    if metadata:
+                        tokens = {"prompt_tokens": metadata.get("input_tokens"),
+                                  "completion_tokens": metadata.get("output_tokens")}
+        self._finish("llm.call", run_id, "ok", **{k: v for k, v in tokens.items() if v is not None})
+
+    def on_llm_error(self, error: BaseException, *, run_id, **kwargs) -> None:
+        self._finish("llm.call", run_id, "error", error=str(error)[:500])
+
+    def on_tool_start(self, serialized: dict, input_str: str, *, run_id, **kwargs) -> None:
+        name = (serialized or {}).get("name") or kwargs.get("name", "tool")
+        self._started[run_id] = (time.perf_counter(), {"tool": name, "input": input_str[:self.MAX_INPUT_CHARS]})
+
+    def on_tool_end(self, output, *, run_id, **kwargs) -> None:
+        self._finish("agent2.tool", run_id, "ok")
+
+    def on_tool_error(self, error: BaseException, *, run_id, **kwargs) -> None:
+        self._finish("agent2.tool", run_id, "error", error=str(error)[:500])
+
+# --- Agent 2's Core Logic (Now with LangChain) ---
+
+PROMPT_TEMPLATE = """
     You are a world-class automation script developer. Your goal is to write a high-quality, runnable Python script based on a blueprint.
 
     **Framework:** {framework}
@@ -45,34 +212,92 @@ def run_agent2(seq_no: str, task_dir: Path, blueprint: dict) -> dict:
     2.  If you are unsure about how to implement a specific step, use the `code_search` tool to find examples.
     3.  If you need to identify the correct libraries for the task, use the `dependency_suggester` tool.
     4.  Once you have a clear plan, write the complete Python script and the corresponding `requirements.txt` content.
-    5.  Your final answer MUST be a JSON object with two keys: "script" and "requirements".
+    5.  For Appium, connect to the server URL in the `AISA_APPIUM_URL` environment variable (default "http://127.0.0.1:4723"), and set the `udid` and `systemPort` capabilities from `AISA_DEVICE_UDID` and `AISA_SYSTEM_PORT` when they are set.
+    6.  For Playwright, do not launch a browser yourself. Use `import aisa_runtime` and run the steps inside `with aisa_runtime.browser_page() as page:` (it accepts `browser.new_context()` options such as `user_agent`); it connects to a shared headless browser and gives the script its own isolated context. Perform every step with the runtime's wrappers, which wait for the element to be actionable and time each step: `aisa_runtime.goto(page, url)`, `click(page, selector)`, `fill(page, selector, value)`, `press(page, selector, key)`, `select(page, selector, value)`, `expect_visible(page, selector)`, `expect_text(page, selector, text)` and `expect_url(page, url)`. Never call `time.sleep`, never wait for "networkidle" and do not raise the default timeout: wait for a concrete condition instead (`expect_*`, or `aisa_runtime.wait_until(condition, timeout, description=...)`, which also works for Appium). Use `aisa_runtime.pause(seconds, reason)` only for deliberate holds such as press-and-hold. `aisa_runtime` is always available and must not be listed in the requirements.
+    7.  Your final answer MUST be a JSON object with two keys: "script" and "requirements".
 
     **Begin!**
 
     {agent_scratchpad}
     """
-    prompt = PromptTemplate.from_template(prompt_template)
 
-    # 4. Create the agent and agent executor
-    agent = create_react_agent(llm, tools, prompt)
-    agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=True)
+# The LLM client, tools, prompt and AgentExecutor are built once per process
+# and shared by every task; a task only supplies its framework and blueprint
+# (plus its own callbacks) at invoke time.
+_executor_lock = threading.Lock()
+_agent_executor = None
 
-    # 5. Run the agent
+def _build_llm():
+    """
+    Groq over an explicitly sized, pooled httpx client, or Anthropic if Groq
+    cannot be set up. ChatAnthropic takes no HTTP client of ours; its
+    Anthropic SDK client keeps its own keep-alive pool, which is reused
+    because the model is built once per process.
+    """
     try:
-        response = agent_executor.invoke({
-            "framework": framework,
-            "blueprint": json.dumps(blueprint, indent=2),
-        })
+        http_client = httpx.Client(limits=httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_CONNECTIONS,
+        ))
+        return ChatGroq(
+            temperature=0, model_name="llama3-70b-8192",
+            cache=shared_llm_cache, streaming=True, http_client=http_client,
+        )
+    except Exception:
+        return ChatAnthropic(model="claude-3-haiku-20240307", cache=shared_llm_cache, streaming=True)
+
+def get_agent_executor() -> AgentExecutor:
+    """Returns the process-wide Agent 2 executor, building it on first use."""
+    global _agent_executor
+    with _executor_lock:
+        if _agent_executor is None:
+            tools = [code_search, dependency_suggester, create_todo_list]
+            prompt = PromptTemplate.from_template(PROMPT_TEMPLATE)
+            agent = create_react_agent(_build_llm(), tools, prompt)
+            _agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=True)
+        return _agent_executor
+
+def run_agent2(seq_no: str, task_dir: Path, blueprint: dict) -> dict:
+    """
+    Agent 2: Generates a runnable automation script using a LangChain agent
+    with powerful tools.
+    """
+    print(f"[{seq_no}] Running Agent 2: LangChain-Powered Code Generation")
+    out_dir = task_dir / "agent2"
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    platform = blueprint.get("summary", {}).get("platform", "web")
+    framework = "Appium" if platform == "mobile" else "Playwright"
+
+    # Run the shared agent for this task's framework and blueprint
+    try:
+        # The ReAct steps are only cached if the final answer passes these checks.
+        with shared_llm_cache.run():
+            response = get_agent_executor().invoke(
+                {
+                    "framework": framework,
+                    "blueprint": json.dumps(blueprint, indent=2),
+                },
+                config={"callbacks": [
+                    FinalAnswerStreamHandler(seq_no), ToolStepEventHandler(seq_no), TracingHandler(seq_no),
+                ]},
+            )
+
+            # The response from the agent should be a JSON string.
+            # We need to parse it to get the script and requirements.
+            response_json = json.loads(response["output"])
+
+            script_code = response_json.get("script")
+            requirements = response_json.get("requirements")
 
-        # The response from the agent should be a JSON string.
-        # We need to parse it to get the script and requirements.
-        response_json = json.loads(response["output"])
-        
-        script_code = response_json.get("script")
-        requirements = response_json.get("requirements")
+            if not script_code or not requirements:
+                raise ValueError("LLM response did not contain 'script' or 'requirements' keys.")
+            compile(script_code, "automation_script.py", "exec")
 
-        if not script_code or not requirements:
-            raise ValueError("LLM response did not contain 'script' or 'requirements' keys.")
+        if SCRIPT_POSTPROCESS_ENABLED:
+            script_code, changes = script_postprocess.postprocess(script_code, framework)
+            for change in changes:
+                print(f"[{seq_no}] Script post-pass: {change}")
 
         script_path = out_dir / "automation_script.py"
         reqs_path = out_dir / "requirements.txt"
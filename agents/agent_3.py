@@ -4,11 +4,25 @@ import os
 import subprocess
 from fastapi import HTTPException
 
-def run_agent3(seq_no: str, task_dir: Path, platform: str) -> dict:
+from config import AGENT3_MODE
+import appium_pool
+import env_manager
+import scheduler
+import supervisor
+import telemetry
+
+# The Appium server a terminal-mode run starts in its own window.
+TERMINAL_APPIUM_URL = "http://127.0.0.1:4723"
+
+def run_agent3(seq_no: str, task_dir: Path, platform: str, priority: int = 0, submitter: str = "default") -> dict:
     """
-    Agent 3: Creates an isolated venv and executes the generated script.
+    Agent 3: Runs the generated script in a pooled virtualenv matching its
+    requirements.txt (built on first use, then shared between tasks).
+    In "supervisor" mode the script is queued with the run scheduler (by
+    `priority`, fair between submitters) and runs headless under the
+    supervisor, which records the outcome in status.json. In "terminal" mode:
     - For mobile, it starts the Appium server and the script in separate terminals.
-    - For web, it ensures Playwright is installed and runs the script.
+    - For web, it ensures the Playwright browsers are installed and runs the script.
     """
     print(f"[{seq_no}] Running Agent 3 for '{platform}' platform.")
     agent2_dir = task_dir / "agent2"
@@ -20,12 +34,34 @@ def run_agent3(seq_no: str, task_dir: Path, platform: str) -> dict:
     if not script_path.exists():
         raise HTTPException(status_code=404, detail=f"Automation script not found for task {seq_no}.")
 
-    venv_dir = agent3_dir / "env"
-    python_executable = sys.executable
+    requirements = reqs_path.read_text(encoding="utf-8") if reqs_path.exists() else ""
+    try:
+        with telemetry.task(seq_no), telemetry.span("env.provision", platform=platform):
+            python_executable = env_manager.get_env(requirements, browsers=(platform == "web"))
+    except env_manager.EnvBuildError as e:
+        raise HTTPException(status_code=500, detail=f"Failed to prepare the Python environment: {e}")
+    print(f"[{seq_no}] Using virtualenv {python_executable.parent.parent.name}.")
+
+    if AGENT3_MODE == "supervisor":
+        try:
+            state = supervisor.submit(
+                seq_no, python_executable, script_path, agent3_dir, platform,
+                priority=priority, submitter=submitter,
+            )
+        except scheduler.QueueFull as e:
+            raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
+        except scheduler.NoCapacity as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        except RuntimeError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        print(f"[{seq_no}] Agent 3 queued the script with the scheduler.")
+        return {"status": state["status"], "state": state}
 
     # --- Platform-specific execution logic ---
     if platform == "mobile":
         # --- Mobile Flow: Two terminals (Appium Server + Script Executor) ---
+        # The runner polls the server's /status endpoint instead of sleeping.
+        wait_for_appium = f'"{sys.executable}" "{appium_pool.__file__}" {TERMINAL_APPIUM_URL}'
         if sys.platform == "win32":
             # Script 1: Start Appium Server
             appium_script_commands = f"""
@@ -43,7 +79,6 @@ def run_agent3(seq_no: str, task_dir: Path, platform: str) -> dict:
             subprocess.Popen(f'start "Appium Server ({seq_no})" cmd /c "{appium_script_path}"', shell=True)
 
             # Script 2: Run Automation
-            activate_script = venv_dir / "Scripts" / "activate.bat"
             run_script_commands = f"""
             @echo off
             title Automation Runner ({seq_no})
@@ -51,25 +86,20 @@ def run_agent3(seq_no: str, task_dir: Path, platform: str) -> dict:
             echo   AISA Mobile Automation Task: {seq_no}
             echo --------------------------------------------------
             cd /d "{agent3_dir}"
-            echo [1/4] Creating virtual environment...
-            "{python_executable}" -m venv env
-            echo [2/4] Activating & installing dependencies...
-            call "{activate_script}" & pip install --upgrade pip > nul & pip install -r "{reqs_path}"
+            echo [1/2] Waiting for Appium server to become ready...
+            {wait_for_appium}
             if %errorlevel% neq 0 (
                 echo.
-                echo ########## DEPENDENCY INSTALLATION FAILED ##########
+                echo ########## APPIUM SERVER DID NOT START ##########
                 pause
-                exit /b %errorlevel%
+                exit /b 1
             )
-            echo.
-            echo Waiting 10s for Appium server to start...
-            timeout /t 10 /nobreak > nul
-            echo [3/4] Running automation script...
+            echo Running automation script...
             echo --------------------------------------------------
-            python "{script_path}"
+            "{python_executable}" "{script_path}"
             if %errorlevel% equ 0 (echo succeeded > result.txt) else (echo failed > result.txt)
             echo --------------------------------------------------
-            echo [4/4] Script finished. This window can be closed.
+            echo [2/2] Script finished. This window can be closed.
             pause
             """
             run_script_path = agent3_dir / "run_automation.bat"
@@ -92,31 +122,25 @@ def run_agent3(seq_no: str, task_dir: Path, platform: str) -> dict:
             subprocess.Popen(['gnome-terminal', '--title', f'Appium Server ({seq_no})', '--', str(appium_script_path)])
 
             # Script 2: Run Automation
-            activate_script = venv_dir / "bin" / "activate"
             run_script_commands = f"""#!/bin/bash
             echo "--------------------------------------------------"
             echo "  AISA Mobile Automation Task: {seq_no}"
             echo "--------------------------------------------------"
             cd "{agent3_dir}"
-            echo "[1/4] Creating virtual environment..."
-            "{python_executable}" -m venv env
-            echo "[2/4] Activating & installing dependencies..."
-            source "{activate_script}" && pip install --upgrade pip > /dev/null && pip install -r "{reqs_path}"
+            echo "[1/2] Waiting for Appium server to become ready..."
+            {wait_for_appium}
             if [ $? -ne 0 ]; then
                 echo ""
-                echo "########## DEPENDENCY INSTALLATION FAILED ##########"
+                echo "########## APPIUM SERVER DID NOT START ##########"
                 read -p "Press Enter to close..."
                 exit 1
             fi
-            echo ""
-            echo "Waiting 10s for Appium server to start..."
-            sleep 10
-            echo "[3/4] Running automation script..."
+            echo "Running automation script..."
             echo "--------------------------------------------------"
-            python "{script_path}"
+            "{python_executable}" "{script_path}"
             if [ $? -eq 0 ]; then echo "succeeded" > result.txt; else echo "failed" > result.txt; fi
             echo "--------------------------------------------------"
-            echo "[4/4] Script finished. Press Enter to close."
+            echo "[2/2] Script finished. Press Enter to close."
             read
             """
             run_script_path = agent3_dir / "run_automation.sh"
@@ -127,7 +151,6 @@ def run_agent3(seq_no: str, task_dir: Path, platform: str) -> dict:
     else:  # platform == "web"
         # --- Web Flow: Single terminal ---
         if sys.platform == "win32":
-            activate_script = venv_dir / "Scripts" / "activate.bat"
             commands = f"""
             @echo off
             title Web Automation ({seq_no})
@@ -135,66 +158,29 @@ def run_agent3(seq_no: str, task_dir: Path, platform: str) -> dict:
             echo   AISA Web Automation Task: {seq_no}
             echo --------------------------------------------------
             cd /d "{agent3_dir}"
-            echo [1/5] Creating virtual environment...
-            "{python_executable}" -m venv env
-            echo [2/5] Activating & installing dependencies...
-            call "{activate_script}" & pip install --upgrade pip > nul & pip install -r "{reqs_path}"
-            if %errorlevel% neq 0 (
-                echo.
-                echo ########## DEPENDENCY INSTALLATION FAILED ##########
-                pause
-                exit /b %errorlevel%
-            )
-            echo [3/5] Installing Playwright browsers...
-            playwright install
-            if %errorlevel% neq 0 (
-                echo.
-                echo ########## PLAYWRIGHT BROWSER INSTALLATION FAILED ##########
-                pause
-                exit /b %errorlevel%
-            )
-            echo [4/5] Running automation script...
+            echo [1/2] Running automation script...
             echo --------------------------------------------------
-            python "{script_path}"
+            "{python_executable}" "{script_path}"
             if %errorlevel% equ 0 (echo succeeded > result.txt) else (echo failed > result.txt)
             echo --------------------------------------------------
-            echo [5/5] Script finished. This window can be closed.
+            echo [2/2] Script finished. This window can be closed.
             pause
             """
             run_script_path = agent3_dir / "run.bat"
             run_script_path.write_text(commands, encoding="utf-8")
             subprocess.Popen(f'start "Web Automation ({seq_no})" cmd /k "{run_script_path}"', shell=True)
         else:  # macOS / Linux
-            activate_script = venv_dir / "bin" / "activate"
             commands = f"""#!/bin/bash
             echo "--------------------------------------------------"
             echo "  AISA Web Automation Task: {seq_no}"
             echo "--------------------------------------------------"
             cd "{agent3_dir}"
-            echo "[1/5] Creating virtual environment..."
-            "{python_executable}" -m venv env
-            echo "[2/5] Activating & installing dependencies..."
-            source "{activate_script}" && pip install --upgrade pip > /dev/null && pip install -r "{reqs_path}"
-            if [ $? -ne 0 ]; then
-                echo ""
-                echo "########## DEPENDENCY INSTALLATION FAILED ##########"
-                read -p "Press Enter to close..."
-                exit 1
-            fi
-            echo "[3/5] Installing Playwright browsers..."
-            playwright install
-            if [ $? -ne 0 ]; then
-                echo ""
-                echo "########## PLAYWRIGHT BROWSER INSTALLATION FAILED ##########"
-                read -p "Press Enter to close..."
-                exit 1
-            fi
-            echo "[4/5] Running automation script..."
+            echo "[1/2] Running automation script..."
             echo "--------------------------------------------------"
-            python "{script_path}"
+            "{python_executable}" "{script_path}"
             if [ $? -eq 0 ]; then echo "succeeded" > result.txt; else echo "failed" > result.txt; fi
             echo "--------------------------------------------------"
-            echo "[5/5] Script finished. Press Enter to close."
+            echo "[2/2] Script finished. Press Enter to close."
             read
             """
             run_script_path = agent3_dir / "run.sh"
@@ -1,81 +1,330 @@
 import uuid
-import shutil
-import subprocess
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+import json
+import threading
+from typing import List, Optional
+from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, Response, Request, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, StreamingResponse
 
 # Structured imports from our new modular architecture
-from config import ARTIFACTS_DIR
-from agents import agent_1, agent_2, agent_3
+from config import (
+    ARTIFACTS_DIR, JOB_QUEUE_ENABLED, AGENT3_MODE, EVENTS_HEARTBEAT_SECONDS, BATCH_MAX_TASKS,
+    STARTUP_PRELOAD_ENABLED, RETENTION_ENABLED,
+)
+from agents import agent_3
 
+import batches
+import job_queue
+import appium_pool
+import browser_pool
+import env_manager
+import events
+import llm_cache
+import provider_guard
+import retention
+import scheduler
+import search_index
+import supervisor
 import state_manager
+import telemetry
+import uploads
+from state_store import StateConflict
 
 app = FastAPI(title="AISA v2 - Robust Foundation")
 
+# Statuses after which a task's event stream is closed.
+FINAL_STATUSES = {"succeeded", "failed"}
+
 @app.on_event("startup")
 def on_startup():
     print("--- AISA Server Starting Up ---")
     ARTIFACTS_DIR.mkdir(exist_ok=True)
     print(f"Artifacts will be stored in: {ARTIFACTS_DIR}")
     
-    print("Checking for ADB devices...")
-    try:
-        # Use shell=True for Windows compatibility
-        result = subprocess.run(
-            ["adb", "devices"], capture_output=True, text=True, check=True, shell=True
-        )
-        print("ADB check successful:\n", result.stdout)
-    except FileNotFoundError:
-        print("ADB command not found. Please ensure it's in your system's PATH.")
-    except Exception as e:
-        print(f"ADB check failed: {e}")
+    # ADB discovery (and starting the Appium servers) happens in the background.
+    if AGENT3_MODE == "supervisor":
+        appium_pool.start()
+    else:
+        threading.Thread(target=appium_pool.report_devices, name="adb-discovery", daemon=True).start()
+
+    # Tasks the previous run left queued or mid-pipeline (batch tasks too).
+    # Without the job queue, queued tasks are failed rather than re-enqueued,
+    # so the worker pool is not started for them.
+    if JOB_QUEUE_ENABLED:
+        job_queue.start()
+        job_queue.recover()
+    else:
+        job_queue.recover(requeue=False)
+    if STARTUP_PRELOAD_ENABLED:
+        job_queue.start_preload()
+    env_manager.start_prewarm()
+    if RETENTION_ENABLED:
+        retention.start()
         
     print("--- Startup complete. Waiting for tasks. ---")
 
-@app.post("/create_task", status_code=201)
-async def create_task(
-    instructions: str = Form(...),
-    platform: str = Form(..., enum=["mobile", "web"]),
-    pdf: UploadFile = File(...)
-):
+@app.on_event("shutdown")
+def on_shutdown():
+    retention.shutdown()
+    job_queue.shutdown()
+    batches.shutdown()
+    supervisor.shutdown()
+    browser_pool.shutdown()
+    appium_pool.shutdown()
+
+def _required_field(fields: dict, name: str, choices: tuple = None) -> str:
+    value = fields.get(name, "")
+    if not value.strip():
+        raise HTTPException(status_code=422, detail=f"Missing the '{name}' form field.")
+    if choices and value not in choices:
+        raise HTTPException(status_code=422, detail=f"'{name}' must be one of: {', '.join(choices)}.")
+    return value
+
+@app.post("/create_task", status_code=202, openapi_extra=uploads.openapi_form({
+    "instructions": {"type": "string"},
+    "platform": {"type": "string", "enum": ["mobile", "web"]},
+}))
+async def create_task(request: Request, response: Response):
+    # The PDF is streamed to a temp file (hashed and validated on the way)
+    # instead of being spooled by the form parser and copied afterwards.
+    fields, upload = await uploads.receive_pdf_form(request, ARTIFACTS_DIR)
+    try:
+        instructions = _required_field(fields, "instructions")
+        platform = _required_field(fields, "platform", ("mobile", "web"))
+    except HTTPException:
+        uploads.discard(upload)
+        raise
+
     seq_no = uuid.uuid4().hex[:10]
     task_dir = state_manager.get_task_dir(seq_no)
 
     # Create the initial state file
     state_manager.create_task_state(seq_no, platform, instructions)
-    
-    pdf_path = task_dir / "input.pdf"
-    with pdf_path.open("wb") as buffer:
-        shutil.copyfileobj(pdf.file, buffer)
+    pdf_path = uploads.commit(upload, task_dir / "input.pdf")
+    pdf_info = {key: upload[key] for key in ("filename", "sha256", "size", "pages")}
 
-    state_manager.update_task_state(seq_no, {"status": "processing"})
-    
     # --- Agent Pipeline ---
-    blueprint = agent_1.run_agent1(seq_no, task_dir, pdf_path, instructions, platform)
-    state_manager.update_task_state(seq_no, {"status": "blueprint_created"})
+    # In job-queue mode the pipeline runs on the worker pool and the client
+    # polls /task/{seq_no}; otherwise we wait for it off the event loop.
+    if JOB_QUEUE_ENABLED:
+        queued_state = state_manager.update_task_state(seq_no, {"status": "queued", "pdf": pdf_info})
+        job_queue.submit(seq_no, pdf_path, instructions, platform)
+        print(f"Task {seq_no} queued for processing.")
+        return queued_state
 
-    artifacts = agent_2.run_agent2(seq_no, task_dir, blueprint)
-    
-    final_state = state_manager.update_task_state(seq_no, {
-        "status": "ready",
-        "artifacts": artifacts
-    })
-    
+    state_manager.update_task_state(seq_no, {"pdf": pdf_info})
+    final_state = await run_in_threadpool(job_queue.run_pipeline, seq_no, pdf_path, instructions, platform)
+    response.status_code = 201
     print(f"Task {seq_no} created successfully and is ready for execution.")
     return final_state
 
-@app.post("/run/{seq_no}")
-async def run_task(seq_no: str):
-    task_info = state_manager.get_task_state(seq_no)
-    if not task_info:
-        raise HTTPException(status_code=404, detail="Task not found.")
-    if task_info["status"] != "ready":
-        raise HTTPException(status_code=400, detail=f"Task not ready. Status: {task_info['status']}")
+def _parse_batch_entries(raw: str) -> list:
+    try:
+        entries = json.loads(raw)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="'tasks' must be a JSON list of {instructions, platform} objects.")
+    if not isinstance(entries, list) or not entries:
+        raise HTTPException(status_code=400, detail="'tasks' must be a non-empty JSON list.")
+    if len(entries) > BATCH_MAX_TASKS:
+        raise HTTPException(status_code=400, detail=f"A batch may contain at most {BATCH_MAX_TASKS} tasks.")
+    for index, entry in enumerate(entries):
+        if (not isinstance(entry, dict) or not isinstance(entry.get("instructions"), str)
+                or not entry["instructions"].strip() or entry.get("platform") not in ("mobile", "web")):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Task {index + 1} needs non-empty 'instructions' and a 'platform' of 'mobile' or 'web'.",
+            )
+    return [{"instructions": e["instructions"], "platform": e["platform"]} for e in entries]
+
+@app.post("/create_tasks", status_code=202, openapi_extra=uploads.openapi_form({
+    "tasks": {"type": "string", "description": 'JSON list of {"instructions": ..., "platform": "mobile" | "web"}'},
+}))
+async def create_tasks(request: Request):
+    """Creates a batch of tasks sharing one PDF, which is parsed only once."""
+    fields, upload = await uploads.receive_pdf_form(request, ARTIFACTS_DIR)
+    try:
+        entries = _parse_batch_entries(_required_field(fields, "tasks"))
+        record = await run_in_threadpool(batches.create_batch, upload["path"], entries, upload["sha256"])
+    except Exception:
+        uploads.discard(upload)
+        raise
+    return {**record, "status": "in_progress"}
+
+@app.get("/batch/{batch_id}")
+async def get_batch_status(batch_id: str):
+    """A batch's tasks with their statuses, per-status counts and the aggregate status."""
+    batch = await run_in_threadpool(batches.get_batch, batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found.")
+    return batch
+
+@app.get("/jobs/stats")
+async def get_job_stats():
+    """Worker pool size, queue depth and per-stage latency of the agent pipeline."""
+    return job_queue.get_stats()
+
+@app.get("/llm/cache/stats")
+async def get_llm_cache_stats():
+    """Hit/miss counters and size of the on-disk LLM response cache."""
+    return llm_cache.get_stats()
+
+@app.get("/llm/providers")
+async def get_llm_provider_states():
+    """Circuit breaker state, rate limiter state and counters for each LLM provider."""
+    return provider_guard.get_all_states()
+
+@app.get("/search/stats")
+async def get_search_stats():
+    """Where Agent 2's search tool calls were answered from: cache, local index or Tavily."""
+    return search_index.get_stats()
+
+@app.get("/envs/stats")
+async def get_env_pool_stats():
+    """Hit/build counters and the pooled virtualenvs, most recently used first."""
+    return env_manager.get_stats()
+
+@app.get("/runs/stats")
+async def get_run_stats():
+    """Running/queued scripts and outcome counters of the Agent 3 supervisor."""
+    return supervisor.get_stats()
+
+@app.get("/browsers/stats")
+async def get_browser_pool_stats():
+    """Pooled headless browsers, their open contexts and lease/fallback counters."""
+    return browser_pool.get_stats()
+
+@app.get("/appium/servers")
+async def get_appium_servers():
+    """Pooled Appium servers, their devices, readiness and current leases."""
+    return appium_pool.get_stats()
+
+@app.get("/scheduler/stats")
+async def get_scheduler_stats():
+    """Queue depth per platform and submitter, slot utilization and queue wait percentiles."""
+    return scheduler.get_stats()
+
+@app.get("/storage/usage")
+async def get_storage_usage():
+    """Disk usage of the artifacts directory by artifact type, plus the retention policy and compactor counters."""
+    return await run_in_threadpool(retention.get_usage)
+
+@app.post("/storage/compact", status_code=202)
+async def compact_storage():
+    """Wakes the background compactor for an immediate retention pass."""
+    if not retention.trigger():
+        raise HTTPException(status_code=409, detail="The compactor is disabled (AISA_RETENTION_ENABLED).")
+    return {"triggered": True}
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics: per-stage, LLM and tool histograms and counters, plus queue and slot gauges."""
+    jobs, runs, schedule = job_queue.get_stats(), supervisor.get_stats(), scheduler.get_stats()
+    slots = schedule["slots"]
+    gauges = [
+        ("aisa_job_queue_running", "Agent pipelines running on the job queue.", [({}, jobs["running"])]),
+        ("aisa_job_queue_depth", "Agent pipelines waiting for a job queue worker.", [({}, jobs["queue_depth"])]),
+        ("aisa_scheduler_queue_depth", "Script runs waiting for a slot.",
+         [({"kind": kind}, depth) for kind, depth in schedule["queue_depth"].items()]),
+        ("aisa_scheduler_slots_busy", "Run slots currently running a script.",
+         [({"kind": kind}, sum(1 for s in slots if s["kind"] == kind and s["busy_with"])) for kind in ("web", "mobile")]),
+        ("aisa_scripts_running", "Automation scripts running under the supervisor.", [({}, runs["running"])]),
+    ]
+    return Response(telemetry.render(gauges), media_type="text/plain; version=0.0.4; charset=utf-8")
 
+async def _start_run(seq_no: str, task_info: dict, priority: int = 0, submitter: str = "default") -> dict:
+    """Runs Agent 3 for a task already claimed as "preparing"; puts it back to "ready" on failure."""
     task_dir = state_manager.get_task_dir(seq_no)
-    result = agent_3.run_agent3(seq_no, task_dir, task_info["platform"])
+    # May build a virtualenv on a pool miss, so keep it off the event loop.
+    try:
+        result = await run_in_threadpool(
+            agent_3.run_agent3, seq_no, task_dir, task_info["platform"], priority, submitter
+        )
+    except Exception:
+        state_manager.transition_task_state(seq_no, "preparing", {"status": "ready"})
+        raise
+    if "state" in result:
+        # The supervisor already recorded the run (and may even have finished it).
+        return result["state"]
 
     return state_manager.update_task_state(seq_no, {"status": result["status"]})
 
+@app.post("/run/{seq_no}")
+async def run_task(seq_no: str, priority: int = 0, submitter: str = "default"):
+    if not state_manager.get_task_state(seq_no):
+        raise HTTPException(status_code=404, detail="Task not found.")
+    # Claim the task atomically so concurrent /run calls cannot both start it.
+    try:
+        task_info = state_manager.transition_task_state(seq_no, "ready", {"status": "preparing"})
+    except StateConflict as e:
+        raise HTTPException(status_code=400, detail=f"Task not ready. Status: {e.status}")
+    return await _start_run(seq_no, task_info, priority, submitter)
+
+class RunBatchRequest(BaseModel):
+    seq_nos: Optional[List[str]] = None
+    batch_id: Optional[str] = None
+    priority: int = 0
+    submitter: str = "default"
+
+@app.post("/run_batch", status_code=202)
+async def run_batch(request: RunBatchRequest):
+    """
+    Queues every ready task of a batch (or of an explicit seq_no list) with
+    the run scheduler. Tasks that are not ready are skipped; if the queue
+    cannot take them all, nothing is queued and 429 is returned.
+    """
+    if AGENT3_MODE != "supervisor":
+        raise HTTPException(status_code=400, detail="Batch runs need AISA_AGENT3_MODE=supervisor.")
+    seq_nos = list(request.seq_nos or [])
+    if request.batch_id:
+        batch = await run_in_threadpool(batches.get_batch, request.batch_id)
+        if batch is None:
+            raise HTTPException(status_code=404, detail="Batch not found.")
+        seq_nos.extend(seq_no for seq_no in batch["seq_nos"] if seq_no not in seq_nos)
+    if not seq_nos:
+        raise HTTPException(status_code=400, detail="Provide 'seq_nos' and/or 'batch_id'.")
+    if not scheduler.has_room(len(seq_nos)):
+        raise HTTPException(
+            status_code=429, detail="The run queue cannot take this many runs now; retry later.",
+            headers={"Retry-After": "30"},
+        )
+
+    scheduled, skipped = [], []
+    for seq_no in seq_nos:
+        try:
+            task_info = state_manager.transition_task_state(seq_no, "ready", {"status": "preparing"})
+        except FileNotFoundError:
+            skipped.append({"seq_no": seq_no, "reason": "not found"})
+            continue
+        except StateConflict as e:
+            skipped.append({"seq_no": seq_no, "reason": f"status is '{e.status}'"})
+            continue
+        try:
+            state = await _start_run(seq_no, task_info, request.priority, request.submitter)
+        except HTTPException as e:
+            skipped.append({"seq_no": seq_no, "reason": e.detail})
+            continue
+        scheduled.append({"seq_no": seq_no, "status": state["status"]})
+    return {"scheduled": scheduled, "skipped": skipped, "queue": scheduler.get_stats()["queue_depth"]}
+
+def _check_terminal_result(seq_no: str, task_info: dict) -> dict:
+    """Picks up the result.txt a terminal-mode run writes when it finishes."""
+    result_file = state_manager.get_task_dir(seq_no) / "agent3" / "result.txt"
+    if result_file.exists() and task_info["status"] == "running":
+        new_status = result_file.read_text().strip()
+        try:
+            return state_manager.transition_task_state(seq_no, "running", {"status": new_status})
+        except StateConflict:
+            return state_manager.get_task_state(seq_no)
+    return task_info
+
+@app.get("/tasks")
+async def list_tasks(status: str = None, platform: str = None, limit: int = 100, offset: int = 0):
+    """Lists tasks, newest first, optionally filtered by status and/or platform."""
+    if not 1 <= limit <= 1000 or offset < 0:
+        raise HTTPException(status_code=400, detail="limit must be 1-1000 and offset non-negative.")
+    return state_manager.list_tasks(status=status, platform=platform, limit=limit, offset=offset)
+
 @app.get("/task/{seq_no}")
 async def get_task_status(seq_no: str):
     task_info = state_manager.get_task_state(seq_no)
@@ -83,9 +332,86 @@ async def get_task_status(seq_no: str):
         raise HTTPException(status_code=404, detail="Task not found.")
     
     # Check for the result file from Agent 3 to see if a running task has finished
-    result_file = state_manager.get_task_dir(seq_no) / "agent3" / "result.txt"
-    if result_file.exists() and task_info["status"] == "running":
-        new_status = result_file.read_text().strip()
-        return state_manager.update_task_state(seq_no, {"status": new_status})
-        
-    return task_info
\ No newline at end of file
+    return _check_terminal_result(seq_no, task_info)
+
+@app.get("/task/{seq_no}/files")
+async def list_task_files(seq_no: str):
+    """The task's files, including those packed into its artifacts.zip by the compactor."""
+    if not state_manager.get_task_state(seq_no):
+        raise HTTPException(status_code=404, detail="Task not found.")
+    return await run_in_threadpool(retention.list_artifacts, seq_no)
+
+@app.get("/task/{seq_no}/files/{path:path}")
+async def get_task_file(seq_no: str, path: str):
+    """One of the task's files, read from its directory or, once archived, from artifacts.zip."""
+    if not state_manager.get_task_state(seq_no):
+        raise HTTPException(status_code=404, detail="Task not found.")
+    content, media_type = await run_in_threadpool(retention.read_artifact, seq_no, path)
+    if isinstance(content, bytes):
+        return Response(content, media_type=media_type)
+    return FileResponse(content, media_type=media_type)
+
+async def _task_events(seq_no: str, last_event_id: int = None):
+    """
+    Yields a task's events: a "snapshot" of its current state (unless
+    resuming from `last_event_id`), then every published event until the task
+    reaches a final status. Yields None when a heartbeat is due.
+    """
+    subscription = events.subscribe(seq_no, last_event_id)
+    try:
+        if last_event_id is None:
+            state = state_manager.get_task_state(seq_no)
+            yield {"id": None, "type": "snapshot", "seq_no": seq_no, "data": state}
+            if state["status"] in FINAL_STATUSES:
+                return
+        while True:
+            event = await subscription.get(timeout=EVENTS_HEARTBEAT_SECONDS)
+            if event is None:
+                if AGENT3_MODE == "terminal":
+                    _check_terminal_result(seq_no, state_manager.get_task_state(seq_no))
+                yield None
+                continue
+            yield event
+            if event["type"] == "state" and event["data"].get("status") in FINAL_STATUSES:
+                return
+    finally:
+        events.unsubscribe(subscription)
+
+@app.get("/task/{seq_no}/events")
+async def stream_task_events(seq_no: str, request: Request):
+    """Server-sent events for a task: state transitions, Agent 2 tool steps and Agent 3 log lines."""
+    if not state_manager.get_task_state(seq_no):
+        raise HTTPException(status_code=404, detail="Task not found.")
+    last_event_id = request.headers.get("last-event-id")
+    last_event_id = int(last_event_id) if last_event_id and last_event_id.isdigit() else None
+
+    async def sse():
+        async for event in _task_events(seq_no, last_event_id):
+            if await request.is_disconnected():
+                break
+            if event is None:
+                yield ": keep-alive\n\n"
+                continue
+            id_line = f"id: {event['id']}\n" if event["id"] is not None else ""
+            yield f"{id_line}event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+    return StreamingResponse(sse(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.websocket("/task/{seq_no}/ws")
+async def task_events_websocket(websocket: WebSocket, seq_no: str, last_event_id: int = None):
+    """WebSocket equivalent of /task/{seq_no}/events; each message is one JSON event."""
+    await websocket.accept()
+    if not state_manager.get_task_state(seq_no):
+        await websocket.close(code=4404, reason="Task not found.")
+        return
+    try:
+        async for event in _task_events(seq_no, last_event_id):
+            await websocket.send_json(event if event is not None else {"type": "heartbeat"})
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+
+@app.get("/events/stats")
+async def get_event_stats():
+    """Current event stream subscribers and events dropped from their buffers."""
+    return events.get_stats()
\ No newline at end of file
@@ -0,0 +1,265 @@
+import sys
+import json
+import time
+import shutil
+import argparse
+import threading
+import subprocess
+import urllib.request
+from contextlib import contextmanager
+
+from config import (
+    ARTIFACTS_DIR, APPIUM_SERVER_URLS, APPIUM_BASE_PORT, APPIUM_SYSTEM_BASE_PORT,
+    APPIUM_STARTUP_TIMEOUT_SECONDS, APPIUM_LEASE_TIMEOUT_SECONDS, APPIUM_HEALTH_INTERVAL_SECONDS,
+)
+
+APPIUM_LOG_DIR = ARTIFACTS_DIR / "_appium"
+
+
+class AppiumServer:
+    """One Appium server (spawned by us, or external when `proc` is None) and the device bound to it."""
+
+    def __init__(self, url: str, udid: str = None, system_port: int = None, port: int = None):
+        self.url = url.rstrip("/")
+        self.udid = udid
+        self.system_port = system_port
+        self.port = port
+        self.proc = None
+        self.ready = False
+        self.leased_by = None
+        self.leases = 0
+        self.restarts = 0
+
+    @property
+    def managed(self) -> bool:
+        return self.port is not None
+
+    def env(self) -> dict:
+        """Environment variables that tell a generated script which server and device to use."""
+        env = {"AISA_APPIUM_URL": self.url}
+        if self.udid:
+            env["AISA_DEVICE_UDID"] = self.udid
+        if self.system_port:
+            env["AISA_SYSTEM_PORT"] = str(self.system_port)
+        return env
+
+    def snapshot(self) -> dict:
+        return {
+            "url": self.url,
+            "udid": self.udid,
+            "managed": self.managed,
+            "ready": self.ready,
+            "leased_by": self.leased_by,
+            "leases": self.leases,
+            "restarts": self.restarts,
+        }
+
+
+_cond = threading.Condition()
+_servers = []
+_started = False
+_stopping = threading.Event()
+
+
+def discover_devices() -> list:
+    """Serials of the devices `adb devices` reports as attached and authorized."""
+    try:
+        output = subprocess.run(
+            ["adb", "devices"], capture_output=True, text=True, check=True, timeout=15
+        ).stdout
+    except FileNotFoundError:
+        print("ADB command not found. Please ensure it's in your system's PATH.")
+        return []
+    except (subprocess.SubprocessError, OSError) as e:
+        print(f"ADB check failed: {e}")
+        return []
+    devices = []
+    for line in output.splitlines()[1:]:
+        parts = line.split()
+        if len(parts) >= 2 and parts[1] == "device":
+            devices.append(parts[0])
+    return devices
+
+
+def report_devices() -> list:
+    """Discovers and prints the attached devices."""
+    devices = discover_devices()
+    print(f"ADB devices: {', '.join(devices) if devices else 'none'}")
+    return devices
+
+
+def probe(url: str, timeout: float = 2) -> bool:
+    """Readiness probe: GET {url}/status answers 200 (and, for Appium 2, reports ready)."""
+    try:
+        with urllib.request.urlopen(f"{url.rstrip('/')}/status", timeout=timeout) as response:
+            if response.status != 200:
+                return False
+            try:
+                value = json.loads(response.read() or b"{}").get("value") or {}
+            except ValueError:
+                return True
+            return value.get("ready", True) is not False
+    except OSError:
+        return False
+
+
+def wait_ready(url: str, timeout: float, proc: subprocess.Popen = None) -> bool:
+    """Polls the readiness probe until it succeeds, `timeout` passes or `proc` exits."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc is not None and proc.poll() is not None:
+            return False
+        if probe(url):
+            return True
+        time.sleep(0.5)
+    return False
+
+
+def _launch(server: AppiumServer) -> None:
+    """Starts (or restarts) a managed server and waits for its readiness probe."""
+    appium = shutil.which("appium")
+    if appium is None:
+        print("Warning: 'appium' was not found on PATH; mobile tasks cannot run.")
+        return
+    APPIUM_LOG_DIR.mkdir(parents=True, exist_ok=True)
+    with (APPIUM_LOG_DIR / f"appium-{server.port}.log").open("a", encoding="utf-8") as log:
+        server.proc = subprocess.Popen(
+            [appium, "--port", str(server.port)], stdout=log, stderr=subprocess.STDOUT
+        )
+    ready = wait_ready(server.url, APPIUM_STARTUP_TIMEOUT_SECONDS, server.proc)
+    if not ready:
+        print(f"Warning: Appium server on port {server.port} was not ready after {APPIUM_STARTUP_TIMEOUT_SECONDS}s.")
+        _stop(server)
+    with _cond:
+        server.ready = ready
+        _cond.notify_all()
+    if ready:
+        print(f"Appium server ready at {server.url} (device {server.udid or 'any'}).")
+
+
+def _stop(server: AppiumServer) -> None:
+    if server.proc is not None and server.proc.poll() is None:
+        server.proc.terminate()
+        try:
+            server.proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.proc.kill()
+    server.proc = None
+
+
+def _health_loop() -> None:
+    """Re-probes idle servers and restarts managed ones that stopped answering."""
+    while not _stopping.wait(APPIUM_HEALTH_INTERVAL_SECONDS):
+        for server in list(_servers):
+            with _cond:
+                if server.leased_by is not None:
+                    continue
+            healthy = probe(server.url)
+            if healthy or not server.managed:
+                with _cond:
+                    server.ready = healthy
+                    _cond.notify_all()
+                continue
+            print(f"Appium server on port {server.port} failed its health check; restarting it.")
+            with _cond:
+                server.ready = False
+            _stop(server)
+            server.restarts += 1
+            _launch(server)
+
+
+def _start() -> None:
+    devices = report_devices()
+    if APPIUM_SERVER_URLS:
+        # Externally managed servers (or a stub standing in for Appium), paired with devices in order.
+        servers = [
+            AppiumServer(url, udid=devices[i] if i < len(devices) else None)
+            for i, url in enumerate(APPIUM_SERVER_URLS)
+        ]
+    else:
+        servers = [
+            AppiumServer(
+                f"http://127.0.0.1:{APPIUM_BASE_PORT + 2 * i}", udid=udid,
+                system_port=APPIUM_SYSTEM_BASE_PORT + i, port=APPIUM_BASE_PORT + 2 * i,
+            )
+            for i, udid in enumerate(devices)
+        ]
+    with _cond:
+        _servers.extend(servers)
+    for server in servers:
+        if server.managed:
+            _launch(server)
+        else:
+            ready = wait_ready(server.url, APPIUM_STARTUP_TIMEOUT_SECONDS)
+            with _cond:
+                server.ready = ready
+                _cond.notify_all()
+    with _cond:
+        _cond.notify_all()
+    threading.Thread(target=_health_loop, name="appium-health", daemon=True).start()
+
+
+def start() -> None:
+    """Discovers devices and brings up one Appium server per device, in the background."""
+    global _started
+    with _cond:
+        if _started:
+            return
+        _started = True
+    threading.Thread(target=_start, name="appium-pool", daemon=True).start()
+
+
+@contextmanager
+def lease(holder: str, timeout: float = None, url: str = None):
+    """
+    Leases a ready Appium server and its device for the duration of the
+    block, waiting up to `timeout` seconds (APPIUM_LEASE_TIMEOUT_SECONDS by
+    default) for one to become free. With `url`, only that server is leased.
+    Yields the AppiumServer.
+    """
+    timeout = APPIUM_LEASE_TIMEOUT_SECONDS if timeout is None else timeout
+    deadline = time.monotonic() + timeout
+    with _cond:
+        while True:
+            free = [s for s in _servers if s.ready and s.leased_by is None and url in (None, s.url)]
+            if free:
+                server = min(free, key=lambda s: s.leases)
+                server.leased_by, server.leases = holder, server.leases + 1
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                if not _servers:
+                    raise RuntimeError("No Appium server is available: no ADB devices were found.")
+                raise RuntimeError(f"No Appium server became free within {timeout:.0f}s.")
+            _cond.wait(remaining)
+    try:
+        yield server
+    finally:
+        with _cond:
+            server.leased_by = None
+            _cond.notify_all()
+
+
+def shutdown() -> None:
+    _stopping.set()
+    for server in list(_servers):
+        if server.managed:
+            _stop(server)
+
+
+def get_stats() -> dict:
+    with _cond:
+        return {
+            "servers": [server.snapshot() for server in _servers],
+            "ready": sum(1 for s in _servers if s.ready),
+            "leased": sum(1 for s in _servers if s.leased_by is not None),
+        }
+
+
+if __name__ == "__main__":
+    # Used by terminal-mode run scripts to wait for their Appium server.
+    parser = argparse.ArgumentParser(description="Wait until an Appium server answers its readiness probe.")
+    parser.add_argument("url")
+    parser.add_argument("--timeout", type=float, default=APPIUM_STARTUP_TIMEOUT_SECONDS)
+    args = parser.parse_args()
+    sys.exit(0 if wait_ready(args.url, args.timeout) else 1)
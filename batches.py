@@ -0,0 +1,157 @@
+import json
+import time
+import uuid
+import threading
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from config import ARTIFACTS_DIR, BATCH_FANOUT, INGEST_CACHE_ENABLED
+from agents import agent_1
+
+import ingest_cache
+import job_queue
+import state_manager
+import telemetry
+
+BATCHES_DIR = ARTIFACTS_DIR / "_batches"
+
+# A batch is "in_progress" while any of its tasks is in one of these statuses.
+ACTIVE_STATUSES = {"created", "queued", "processing", "blueprint_created", "preparing", "scheduled", "running"}
+
+# Threads for the one shared PDF extraction per batch; the per-task
+# pipelines run on the job queue.
+EXTRACTION_WORKERS = 2
+
+_lock = threading.Lock()
+_executor = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=EXTRACTION_WORKERS, thread_name_prefix="aisa-batch")
+        return _executor
+
+
+def _batch_file(batch_id: str) -> Path:
+    return BATCHES_DIR / batch_id / "batch.json"
+
+
+def _fan_out(batch_id: str, tasks: list, extraction: dict) -> None:
+    """
+    Submits a batch's task pipelines to the job queue, at most BATCH_FANOUT
+    in flight at a time: each finished task submits the next. Concurrent
+    batches (and single tasks) therefore share the queue instead of one
+    batch filling it. Tasks not submitted by shutdown stay "queued".
+    """
+    pending, pending_lock = deque(tasks), threading.Lock()
+
+    def submit_next(finished=None) -> None:
+        if finished is not None and finished.cancelled():
+            return
+        with pending_lock:
+            if not pending:
+                return
+            seq_no, task_pdf, entry = pending.popleft()
+        try:
+            job_queue.submit(seq_no, task_pdf, entry["instructions"], entry["platform"],
+                             extraction=extraction, on_done=submit_next)
+        except RuntimeError as e:
+            with pending_lock:
+                pending.clear()
+            print(f"[{batch_id}] Stopped submitting batch tasks: {e}")
+
+    for _ in range(min(BATCH_FANOUT, len(tasks))):
+        submit_next()
+
+
+def _run_batch(batch_id: str, pdf_path: Path, tasks: list, pdf_hash: str) -> None:
+    """Extracts the shared PDF once, then fans the per-task pipelines out through the job queue."""
+    started = time.perf_counter()
+    try:
+        extraction = agent_1.extract_pdf_content(batch_id, pdf_path, BATCHES_DIR / batch_id / "agent1", pdf_hash)
+    except Exception as e:
+        print(f"[{batch_id}] Batch extraction failed: {e}")
+        for seq_no, _, _ in tasks:
+            state_manager.update_task_state(seq_no, {"status": "failed", "error": f"PDF extraction failed: {e}"})
+        return
+    finally:
+        # The shared extraction is in the metrics; no task's status.json summarizes it.
+        telemetry.pop_task_spans(batch_id)
+    print(f"[{batch_id}] Extracted the shared PDF in {time.perf_counter() - started:.1f}s; "
+          f"starting {len(tasks)} task pipelines.")
+    _fan_out(batch_id, tasks, extraction)
+
+
+def create_batch(pdf_path: Path, entries: list, pdf_hash: str = None) -> dict:
+    """
+    Creates one task per {"instructions", "platform"} entry, all sharing the
+    PDF at `pdf_path` (hardlinked into each task dir), and schedules them.
+    `pdf_hash` is the PDF's sha256 if already known. Returns the batch record.
+    """
+    batch_id = f"b{uuid.uuid4().hex[:9]}"
+    batch_dir = BATCHES_DIR / batch_id
+    batch_dir.mkdir(parents=True)
+    batch_pdf = batch_dir / "input.pdf"
+    pdf_path.replace(batch_pdf)
+    pdf_hash = pdf_hash or ingest_cache.hash_file(batch_pdf)
+    if INGEST_CACHE_ENABLED:
+        # Store the PDF in the blob store first so every task dir links to that one copy.
+        ingest_cache.dedupe_file(batch_pdf, pdf_hash, "pdf")
+
+    tasks = []
+    for entry in entries:
+        seq_no = uuid.uuid4().hex[:10]
+        state_manager.create_task_state(seq_no, entry["platform"], entry["instructions"])
+        task_pdf = state_manager.get_task_dir(seq_no) / "input.pdf"
+        ingest_cache.link_blob(batch_pdf, task_pdf)
+        state_manager.update_task_state(seq_no, {"status": "queued", "batch_id": batch_id})
+        tasks.append((seq_no, task_pdf, entry))
+
+    record = {"batch_id": batch_id, "created_at": time.time(), "seq_nos": [seq_no for seq_no, _, _ in tasks]}
+    _batch_file(batch_id).write_text(json.dumps(record, indent=2), encoding="utf-8")
+    _get_executor().submit(_run_batch, batch_id, batch_pdf, tasks, pdf_hash)
+    print(f"Batch {batch_id} queued with {len(tasks)} tasks.")
+    return record
+
+
+def aggregate_status(statuses: list) -> str:
+    """'in_progress' while any task is active, the common status once all agree, otherwise 'mixed'."""
+    if any(status in ACTIVE_STATUSES for status in statuses):
+        return "in_progress"
+    distinct = set(statuses)
+    return distinct.pop() if len(distinct) == 1 else "mixed"
+
+
+def get_batch(batch_id: str):
+    """The batch record with its tasks' current statuses and the aggregate status, or None."""
+    path = _batch_file(batch_id)
+    if not path.exists():
+        return None
+    record = json.loads(path.read_text(encoding="utf-8"))
+    tasks = []
+    for seq_no in record["seq_nos"]:
+        state = state_manager.get_task_state(seq_no) or {"status": "missing"}
+        tasks.append({"seq_no": seq_no, "status": state["status"], "error": state.get("error")})
+    statuses = [task["status"] for task in tasks]
+    return {
+        **record,
+        "status": aggregate_status(statuses),
+        "counts": dict(Counter(statuses)),
+        "tasks": tasks,
+    }
+
+
+def shutdown() -> None:
+    """
+    Cancels the batch extractions that have not started. Their tasks (like
+    batch tasks still waiting for the job queue) stay "queued" and are
+    re-enqueued one by one by job_queue.recover() on the next start.
+    """
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,395 @@
+"""
+Offline end-to-end benchmark of /create_task -> /run.
+
+    python benchmarks/pipeline_bench.py --tasks 20 --concurrency 4
+    python benchmarks/pipeline_bench.py --tasks 40 --concurrency 8 --platform mobile --devices 2
+    python benchmarks/pipeline_bench.py --baseline benchmarks/results/pipeline-<commit>-web-c4.json
+
+The server runs as a real uvicorn process with a scratch home directory. It
+talks to local stand-ins (see standins.py) instead of Groq, Tavily and
+Appium:
+- A fake LLM replays the blueprints recorded under generated_code/ for
+  Agent 1. For Agent 2 it answers with a tool call and then a script.
+- Agent 2's search runs in offline mode against the curated local index.
+- Mobile runs go to fake Appium servers.
+Anthropic is disabled, so Groq's code path is the one measured.
+
+Each task is uploaded, polled until ready, run and polled until finished,
+with --concurrency tasks in flight. The report has p50/p95/p99 per stage,
+throughput, the server's peak RSS and the bytes it wrote. The full report is
+written as JSON to benchmarks/results/ so commits can be compared with
+--baseline.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from standins import FakeLLMServer, FakeAppiumServer
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+DEFAULT_PDF = REPO_DIR / "agent.pdf"
+INSTRUCTIONS = "Create a new account using the flow shown in the document."
+
+PIPELINE_DONE = {"ready", "failed"}
+RUN_DONE = {"succeeded", "failed"}
+
+# Client-observed stages, then the server-side stages read from status.json.
+STAGES = (
+    "upload", "pipeline", "run_submit", "execution", "end_to_end",
+    "pipeline_queue_wait", "agent1", "agent2", "run_queue_wait", "script",
+)
+
+
+# --- HTTP client ---
+
+def _request(method: str, url: str, body: bytes = None, headers: dict = None, timeout: float = 120):
+    request = urllib.request.Request(url, data=body, method=method, headers=headers or {})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, json.loads(response.read() or b"null")
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read() or b"null")
+
+
+def _multipart(fields: dict, file_field: str, file_path: Path) -> tuple:
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f"--{boundary}\r\nContent-Disposition: form-data; name=\"{name}\"\r\n\r\n{value}\r\n".encode("utf-8")
+        )
+    parts.append(
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"{file_field}\"; filename=\"{file_path.name}\"\r\n"
+        "Content-Type: application/pdf\r\n\r\n".encode("utf-8")
+    )
+    parts.append(file_path.read_bytes())
+    parts.append(f"\r\n--{boundary}--\r\n".encode("utf-8"))
+    return b"".join(parts), {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+
+
+def _poll(base_url: str, seq_no: str, done: set, timeout: float, interval: float = 0.05) -> dict:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status, state = _request("GET", f"{base_url}/task/{seq_no}")
+        if status == 200 and state.get("status") in done:
+            return state
+        time.sleep(interval)
+    raise TimeoutError(f"Task {seq_no} did not reach {sorted(done)} within {timeout}s.")
+
+
+# --- One task ---
+
+def run_task(base_url: str, pdf: Path, platform: str, timeout: float) -> dict:
+    """Drives one task through create -> ready -> run -> finished. Returns its stage timings."""
+    timings, started = {}, time.perf_counter()
+    body, headers = _multipart({"instructions": INSTRUCTIONS, "platform": platform}, "pdf", pdf)
+    status, state = _request("POST", f"{base_url}/create_task", body, headers)
+    timings["upload"] = time.perf_counter() - started
+    if status >= 400:
+        return {"ok": False, "error": f"create_task answered {status}: {state}", "timings": timings}
+    seq_no = state["seq_no"]
+
+    state = _poll(base_url, seq_no, PIPELINE_DONE, timeout)
+    timings["pipeline"] = time.perf_counter() - started - timings["upload"]
+    server_timings = state.get("timings") or {}
+    for stage, key in (("pipeline_queue_wait", "queue_wait"), ("agent1", "agent1"), ("agent2", "agent2")):
+        if key in server_timings:
+            timings[stage] = server_timings[key]
+    if state["status"] != "ready":
+        return {"ok": False, "seq_no": seq_no, "error": state.get("error"), "timings": timings}
+
+    run_started = time.perf_counter()
+    status, state = _request("POST", f"{base_url}/run/{seq_no}")
+    timings["run_submit"] = time.perf_counter() - run_started
+    if status >= 400:
+        return {"ok": False, "seq_no": seq_no, "error": f"run answered {status}: {state}", "timings": timings}
+    state = _poll(base_url, seq_no, RUN_DONE, timeout)
+    timings["execution"] = time.perf_counter() - run_started
+    timings["end_to_end"] = time.perf_counter() - started
+    run_info = state.get("run") or {}
+    if "queue_wait" in run_info:
+        timings["run_queue_wait"] = run_info["queue_wait"]
+    if "duration" in run_info:
+        timings["script"] = run_info["duration"]
+    return {"ok": state["status"] == "succeeded", "seq_no": seq_no, "error": state.get("error"), "timings": timings}
+
+
+# --- Server process and resource sampling ---
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _read_proc(pid: int, name: str) -> dict:
+    """Key/value pairs from /proc/<pid>/<name> (Linux only; empty elsewhere)."""
+    try:
+        text = Path(f"/proc/{pid}/{name}").read_text()
+    except OSError:
+        return {}
+    values = {}
+    for line in text.splitlines():
+        key, _, value = line.partition(":")
+        values[key.strip()] = value.strip()
+    return values
+
+
+def _rss_bytes(pid: int):
+    status = _read_proc(pid, "status")
+    if "VmRSS" in status:
+        return int(status["VmRSS"].split()[0]) * 1024
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss
+    except Exception:
+        return None
+
+
+def _write_bytes(pid: int):
+    io = _read_proc(pid, "io")
+    return int(io["write_bytes"]) if "write_bytes" in io else None
+
+
+def _tree_bytes(root: Path) -> int:
+    """Bytes under `root`, counting hardlinked files once."""
+    seen, total = set(), 0
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            try:
+                stat = os.lstat(os.path.join(dirpath, filename))
+            except OSError:
+                continue
+            if (stat.st_dev, stat.st_ino) not in seen:
+                seen.add((stat.st_dev, stat.st_ino))
+                total += stat.st_size
+    return total
+
+
+class RSSSampler:
+    def __init__(self, pid: int, interval: float = 0.2):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            rss = _rss_bytes(self.pid)
+            if rss is not None:
+                self.samples.append(rss)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+def start_server(env: dict, port: int, timeout: float = 60) -> subprocess.Popen:
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"],
+        cwd=REPO_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("The server exited during startup; run it by hand to see why.")
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/openapi.json", timeout=1):
+                return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f"The server did not answer within {timeout}s.")
+
+
+def server_env(args, home: str, llm: FakeLLMServer, appium: list) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "HOME": home,
+        "USERPROFILE": home,
+        # Groq SDK and langchain_groq both go to the fake LLM; Anthropic is off.
+        "GROQ_API_KEY": "offline-benchmark",
+        "GROQ_BASE_URL": llm.url,
+        "GROQ_API_BASE": llm.url,
+        "ANTHROPIC_API_KEY": "",
+        "TAVILY_API_KEY": "offline-benchmark",
+        "AISA_SEARCH_OFFLINE": "true",
+        "AISA_APPIUM_SERVER_URLS": ",".join(server.url for server in appium),
+        "AISA_APPIUM_STARTUP_TIMEOUT_SECONDS": "10",
+        "AISA_AGENT3_MODE": "supervisor",
+        "AISA_BROWSER_POOL_SIZE": "0",
+        "AISA_ENV_PREWARM_ENABLED": "false",
+        "AISA_ENV_UPGRADE_PIP": "false",
+        "AISA_STARTUP_PRELOAD_ENABLED": "true",
+        "AISA_LLM_CACHE_ENABLED": "true" if args.caches else "false",
+        "AISA_INGEST_CACHE_ENABLED": "true" if args.caches else "false",
+        # The stand-in has no rate limits; keep the client-side limiter out of the way.
+        "AISA_LLM_RATE_LIMIT_RPS": "1000",
+        "AISA_LLM_RATE_LIMIT_BURST": "1000",
+        "AISA_JOB_QUEUE_WORKERS": str(args.workers),
+        "AISA_SCHEDULER_WEB_SLOTS": str(args.web_slots),
+    })
+    return env
+
+
+# --- Reporting ---
+
+def percentiles(samples: list) -> dict:
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+    last = len(ordered) - 1
+
+    def pick(q: float) -> float:
+        return round(ordered[round(last * q)], 4)
+
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered), 4),
+        "p50": pick(0.50),
+        "p95": pick(0.95),
+        "p99": pick(0.99),
+        "max": round(ordered[-1], 4),
+    }
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_report(report: dict, baseline: dict = None) -> None:
+    print(f"Pipeline benchmark at {report['commit']}: {report['config']['tasks']} {report['config']['platform']} "
+          f"tasks, concurrency {report['config']['concurrency']}")
+    print(f"  succeeded {report['succeeded']}, failed {report['failed']}, "
+          f"throughput {report['throughput_tasks_per_second']:.2f} tasks/s over {report['wall_seconds']:.1f}s")
+    print(f"  {'stage':<20} {'p50':>8} {'p95':>8} {'p99':>8}   baseline p95")
+    for stage, summary in report["stages"].items():
+        if not summary.get("count"):
+            continue
+        before = ((baseline or {}).get("stages", {}).get(stage) or {}).get("p95")
+        delta = f"{before:8.3f}s ({(summary['p95'] - before) / before * 100:+.0f}%)" if before else ""
+        print(f"  {stage:<20} {summary['p50']:7.3f}s {summary['p95']:7.3f}s {summary['p99']:7.3f}s   {delta}")
+    rss = report["server"]["peak_rss_bytes"]
+    print(f"  server peak RSS: {rss / 2**20:.1f} MiB" if rss else "  server peak RSS: unavailable")
+    written = report["server"]["write_bytes"]
+    if written is not None:
+        print(f"  server bytes written: {written / 2**20:.1f} MiB")
+    print(f"  artifacts on disk: {report['artifacts_bytes'] / 2**20:.1f} MiB")
+    for error in report["errors"][:5]:
+        print(f"  error: {error}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark of the agent pipeline.")
+    parser.add_argument("--tasks", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--platform", choices=["web", "mobile"], default="web")
+    parser.add_argument("--pdf", type=Path, default=DEFAULT_PDF)
+    parser.add_argument("--devices", type=int, default=2, help="fake Appium servers (mobile slots)")
+    parser.add_argument("--workers", type=int, default=4, help="AISA_JOB_QUEUE_WORKERS for the server")
+    parser.add_argument("--web-slots", type=int, default=4, help="AISA_SCHEDULER_WEB_SLOTS for the server")
+    parser.add_argument("--llm-first-token", type=float, default=0.2, help="stand-in LLM latency (s)")
+    parser.add_argument("--llm-tokens-per-second", type=float, default=500)
+    parser.add_argument("--scripts", choices=["stub", "recorded"], default="stub",
+                        help="'recorded' replays generated_code/ scripts (needs network for packages)")
+    parser.add_argument("--caches", action="store_true", help="keep the LLM and ingest caches on")
+    parser.add_argument("--timeout", type=float, default=600, help="per-stage timeout (s)")
+    parser.add_argument("--output", type=Path)
+    parser.add_argument("--baseline", type=Path)
+    args = parser.parse_args()
+
+    llm = FakeLLMServer(first_token_seconds=args.llm_first_token, tokens_per_second=args.llm_tokens_per_second,
+                        scripts=args.scripts)
+    appium = [FakeAppiumServer() for _ in range(args.devices)]
+    results = []
+    with tempfile.TemporaryDirectory(prefix="aisa-bench-") as home:
+        port = _free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        server = start_server(server_env(args, home, llm, appium), port)
+        try:
+            # One warm-up task builds the pooled virtualenv and loads the
+            # pipeline modules, so the measured tasks see steady state.
+            warmup = run_task(base_url, args.pdf, args.platform, args.timeout)
+            if not warmup["ok"]:
+                raise SystemExit(f"Warm-up task failed: {warmup.get('error')}")
+            write_bytes_before = _write_bytes(server.pid)
+            artifacts_dir = Path(home) / "AISA_TASKS"
+            artifacts_before = _tree_bytes(artifacts_dir)
+
+            started = time.perf_counter()
+            with RSSSampler(server.pid) as sampler, ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                futures = [pool.submit(run_task, base_url, args.pdf, args.platform, args.timeout)
+                           for _ in range(args.tasks)]
+                for future in futures:
+                    try:
+                        results.append(future.result())
+                    except Exception as e:
+                        results.append({"ok": False, "error": str(e), "timings": {}})
+            wall = time.perf_counter() - started
+
+            write_bytes_after = _write_bytes(server.pid)
+            artifacts_after = _tree_bytes(artifacts_dir)
+        finally:
+            server.terminate()
+            try:
+                server.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                server.kill()
+            llm.close()
+            for stand_in in appium:
+                stand_in.close()
+
+    succeeded = sum(1 for r in results if r["ok"])
+    report = {
+        "commit": _commit(),
+        "created_at": time.time(),
+        "config": {key: str(value) if isinstance(value, Path) else value for key, value in vars(args).items()
+                   if key not in ("output", "baseline")},
+        "wall_seconds": round(wall, 3),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "throughput_tasks_per_second": round(succeeded / wall, 4) if wall else 0,
+        "stages": {stage: percentiles([r["timings"][stage] for r in results if stage in r["timings"]])
+                   for stage in STAGES},
+        "server": {
+            "peak_rss_bytes": max(sampler.samples) if sampler.samples else None,
+            "write_bytes": (write_bytes_after - write_bytes_before)
+            if write_bytes_before is not None and write_bytes_after is not None else None,
+        },
+        "artifacts_bytes": artifacts_after - artifacts_before,
+        "stand_in_requests": {"llm": llm.requests, "appium": sum(s.requests for s in appium)},
+        "errors": [r["error"] for r in results if not r["ok"] and r.get("error")],
+    }
+    baseline = json.loads(args.baseline.read_text(encoding="utf-8")) if args.baseline else None
+    print_report(report, baseline)
+
+    output = args.output or RESULTS_DIR / f"pipeline-{report['commit']}-{args.platform}-c{args.concurrency}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"Report written to {output}")
+
+
+if __name__ == "__main__":
+    main()
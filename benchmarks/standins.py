@@ -0,0 +1,304 @@
+"""
+Local stand-ins for the services the pipeline talks to, so it can be
+benchmarked offline and deterministically.
+
+- FakeLLMServer: an OpenAI/Groq-compatible chat completions endpoint
+  (streaming and non-streaming). It answers Agent 1 with a recorded
+  blueprint. It answers Agent 2's ReAct prompt with one search tool call and
+  then a Final Answer holding a script.
+- FakeAppiumServer: answers /status as a ready Appium server and accepts
+  sessions and element commands.
+
+Each runs on a background thread and exposes `url`. Latencies are
+configurable so the stand-ins can approximate real providers.
+"""
+import json
+import time
+import uuid
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+RECORDED_DIR = REPO_DIR / "generated_code"
+
+AGENT2_MARKER = "**Blueprint:**"
+REACT_TOOL_CALL = (
+    "Thought: I should check how to wait for elements before writing the script.\n"
+    "Action: code_search\n"
+    "Action Input: wait for element to be visible before clicking\n"
+)
+
+# Scripts used when real ones cannot run offline (no packages or browsers to
+# install). They exercise the runtime and, for mobile, the Appium server.
+STUB_WEB_SCRIPT = '''\
+import aisa_runtime
+
+STEPS = {steps}
+for index in range(STEPS):
+    aisa_runtime.pause({step_seconds}, f"simulated step {{index + 1}}")
+print("Stub web run finished.")
+'''
+
+STUB_MOBILE_SCRIPT = '''\
+import os
+import json
+import urllib.request
+
+import aisa_runtime
+
+BASE = os.getenv("AISA_APPIUM_URL", "http://127.0.0.1:4723")
+
+
+def call(method, path, body=None):
+    data = json.dumps(body).encode() if body is not None else None
+    request = urllib.request.Request(BASE + path, data=data, method=method,
+                                     headers={{"Content-Type": "application/json"}})
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return json.loads(response.read() or b"{{}}")
+
+
+with aisa_runtime.step("create session"):
+    capabilities = {{"platformName": "Android"}}
+    if os.getenv("AISA_DEVICE_UDID"):
+        capabilities["appium:udid"] = os.environ["AISA_DEVICE_UDID"]
+    session = call("POST", "/session", {{"capabilities": {{"alwaysMatch": capabilities}}}})["value"]["sessionId"]
+try:
+    for index in range({steps}):
+        with aisa_runtime.step(f"tap element {{index + 1}}"):
+            element = call("POST", f"/session/{{session}}/element", {{"using": "id", "value": f"step-{{index}}"}})
+            element_id = next(iter(element["value"].values()))
+            call("POST", f"/session/{{session}}/element/{{element_id}}/click", {{}})
+finally:
+    call("DELETE", f"/session/{{session}}")
+print("Stub mobile run finished.")
+'''
+
+
+def load_recorded_blueprints() -> list:
+    """Blueprints recorded under generated_code/, normalized to {"summary", "steps"}."""
+    blueprints = []
+    for path in sorted(RECORDED_DIR.glob("*/agent1/blueprint.json")):
+        data = json.loads(path.read_text(encoding="utf-8"))
+        steps = data if isinstance(data, list) else data.get("steps", [])
+        summary = data.get("summary", {}) if isinstance(data, dict) else {}
+        blueprints.append({"summary": summary, "steps": steps})
+    return blueprints
+
+
+def load_recorded_scripts() -> list:
+    """(script, requirements) pairs recorded under generated_code/."""
+    scripts = []
+    for path in sorted(RECORDED_DIR.glob("*/agent2/automation_script.py")):
+        requirements = path.with_name("requirements.txt")
+        scripts.append((
+            path.read_text(encoding="utf-8"),
+            requirements.read_text(encoding="utf-8") if requirements.exists() else "",
+        ))
+    return scripts
+
+
+class _Server:
+    """A ThreadingHTTPServer on a free local port, served from a daemon thread."""
+
+    handler = None
+
+    def __init__(self):
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), self.handler)
+        self._httpd.daemon_threads = True
+        self._httpd.standin = self
+        self.url = f"http://127.0.0.1:{self._httpd.server_address[1]}"
+        self.requests = 0
+        self._lock = threading.Lock()
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+
+    def count(self) -> None:
+        with self._lock:
+            self.requests += 1
+
+    def close(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+class _JSONHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def _body(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}") if length else {}
+
+    def _send_json(self, payload, status: int = 200, headers: dict = None) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _LLMHandler(_JSONHandler):
+    def do_POST(self) -> None:
+        server = self.server.standin
+        server.count()
+        if not self.path.endswith("/chat/completions"):
+            self._send_json({"error": {"message": f"unknown path {self.path}"}}, status=404)
+            return
+        request = self._body()
+        text = server.reply(request.get("messages", []))
+        for stop in request.get("stop") or []:
+            if stop in text:
+                text = text[:text.index(stop)]
+        time.sleep(server.first_token_seconds)
+        if request.get("stream"):
+            self._stream(request.get("model", "stub"), text, server.tokens_per_second)
+        else:
+            time.sleep(len(text) / 4 / server.tokens_per_second)
+            self._send_json(_completion(request.get("model", "stub"), text), headers=_rate_limit_headers())
+
+    def _stream(self, model: str, text: str, tokens_per_second: float) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        for name, value in _rate_limit_headers().items():
+            self.send_header(name, value)
+        self.end_headers()
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        chunk_chars = 16  # about four tokens per chunk
+        pieces = [text[i:i + chunk_chars] for i in range(0, len(text), chunk_chars)] or [""]
+        for index, piece in enumerate(pieces):
+            delta = {"content": piece}
+            if index == 0:
+                delta["role"] = "assistant"
+            self._write_event(_chunk(completion_id, model, delta, None))
+            time.sleep(chunk_chars / 4 / tokens_per_second)
+        final = _chunk(completion_id, model, {}, "stop")
+        final["x_groq"] = {"id": completion_id, "usage": _usage(text)}
+        self._write_event(final)
+        self._write_raw(b"data: [DONE]\n\n")
+        self._write_raw(b"")
+
+    def _write_event(self, payload: dict) -> None:
+        self._write_raw(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+
+    def _write_raw(self, data: bytes) -> None:
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+def _usage(text: str) -> dict:
+    completion_tokens = max(1, len(text) // 4)
+    return {"prompt_tokens": 1000, "completion_tokens": completion_tokens, "total_tokens": 1000 + completion_tokens}
+
+
+def _completion(model: str, text: str) -> dict:
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+        "usage": _usage(text),
+    }
+
+
+def _chunk(completion_id: str, model: str, delta: dict, finish_reason) -> dict:
+    return {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+
+def _rate_limit_headers() -> dict:
+    return {
+        "x-ratelimit-limit-requests": "100000",
+        "x-ratelimit-remaining-requests": "99999",
+        "x-ratelimit-reset-requests": "1s",
+    }
+
+
+class FakeLLMServer(_Server):
+    """
+    Replays recorded artifacts through an OpenAI/Groq-compatible API.
+    `scripts` is "stub" (stdlib-only scripts that run offline) or "recorded"
+    (the scripts under generated_code/, which need their packages and
+    browsers installed).
+    """
+
+    handler = _LLMHandler
+
+    def __init__(self, first_token_seconds: float = 0.2, tokens_per_second: float = 500,
+                 scripts: str = "stub", steps: int = 5, step_seconds: float = 0.05, seed: int = 0):
+        self.first_token_seconds = first_token_seconds
+        self.tokens_per_second = tokens_per_second
+        self.scripts = scripts
+        self.steps = steps
+        self.step_seconds = step_seconds
+        self.blueprints = load_recorded_blueprints() or [{"summary": {}, "steps": []}]
+        self.recorded_scripts = load_recorded_scripts()
+        self._random = random.Random(seed)
+        super().__init__()
+
+    def reply(self, messages: list) -> str:
+        prompt = "\n".join(str(m.get("content", "")) for m in messages)
+        if AGENT2_MARKER not in prompt:
+            return json.dumps(self._random.choice(self.blueprints))
+        if "Observation:" not in prompt:
+            return REACT_TOOL_CALL
+        mobile = "Framework:** Appium" in prompt
+        script, requirements = self._script(mobile)
+        answer = json.dumps({"script": script, "requirements": requirements})
+        return f"Thought: I now know the final answer.\nFinal Answer: {answer}"
+
+    def _script(self, mobile: bool) -> tuple:
+        if self.scripts == "recorded" and self.recorded_scripts:
+            return self._random.choice(self.recorded_scripts)
+        template = STUB_MOBILE_SCRIPT if mobile else STUB_WEB_SCRIPT
+        # A comment keeps requirements.txt non-empty while requiring no packages.
+        return template.format(steps=self.steps, step_seconds=self.step_seconds), "# no third-party packages\n"
+
+
+class _AppiumHandler(_JSONHandler):
+    def do_GET(self) -> None:
+        self.server.standin.count()
+        if self.path.rstrip("/").endswith("/status"):
+            self._send_json({"value": {"ready": True, "message": "Stand-in Appium server is ready"}})
+        else:
+            self._send_json({"value": None})
+
+    def do_POST(self) -> None:
+        server = self.server.standin
+        server.count()
+        self._body()
+        time.sleep(server.command_seconds)
+        path = self.path.rstrip("/")
+        if path.endswith("/session"):
+            session_id = uuid.uuid4().hex
+            self._send_json({"value": {"sessionId": session_id, "capabilities": {"platformName": "Android"}}})
+        elif path.endswith("/element"):
+            self._send_json({"value": {"element-6066-11e4-a52e-4f735466cecf": uuid.uuid4().hex}})
+        else:
+            self._send_json({"value": None})
+
+    def do_DELETE(self) -> None:
+        self.server.standin.count()
+        self._send_json({"value": None})
+
+
+class FakeAppiumServer(_Server):
+    """An always-ready Appium server whose commands take `command_seconds`."""
+
+    handler = _AppiumHandler
+
+    def __init__(self, command_seconds: float = 0.02):
+        self.command_seconds = command_seconds
+        super().__init__()
@@ -0,0 +1,205 @@
+"""
+Startup benchmark: how long the server takes to import and to boot, and
+which imports that time goes to.
+
+    python benchmarks/startup_bench.py                 # import profile of `app`
+    python benchmarks/startup_bench.py --serve         # also time uvicorn until it answers
+    python benchmarks/startup_bench.py --baseline benchmarks/results/startup-<commit>.json
+
+Each run is a fresh interpreter under `python -X importtime`; the report has
+the median import time, the slowest imports by cumulative time, and which of
+the heavy pipeline dependencies got imported at startup (ideally none). The
+result is written as JSON to benchmarks/results/startup-<commit>.json, so
+runs on different commits can be compared with --baseline.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import statistics
+import subprocess
+import urllib.request
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+# Packages that should only be imported once a task actually needs them.
+HEAVY_MODULES = ("langchain", "langchain_core", "langchain_groq", "langchain_anthropic",
+                 "anthropic", "groq", "tavily", "fitz")
+
+
+def _isolated_env(home: str) -> dict:
+    """The server's environment with its artifacts in a scratch home and no background builds."""
+    env = dict(os.environ)
+    env.update({
+        "HOME": home,
+        "USERPROFILE": home,
+        "AISA_ENV_PREWARM_ENABLED": "false",
+        "AISA_STARTUP_PRELOAD_ENABLED": "false",
+        "PYTHONDONTWRITEBYTECODE": "1",
+    })
+    return env
+
+
+def parse_importtime(stderr: str) -> list:
+    """[(module, self_us, cumulative_us, depth)] from `-X importtime` output."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        except ValueError:
+            continue
+        depth = (len(name) - len(name.lstrip(" "))) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+
+def profile_import(module: str, env: dict) -> tuple:
+    """Imports `module` in a fresh interpreter. Returns (wall seconds, importtime rows)."""
+    code = (
+        "import time; started = time.perf_counter(); "
+        f"import {module}; print(time.perf_counter() - started)"
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=REPO_DIR, env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+    return float(result.stdout.strip().splitlines()[-1]), parse_importtime(result.stderr)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def time_serve(env: dict, timeout: float = 60) -> float:
+    """Seconds from spawning uvicorn until the app answers (startup hooks included)."""
+    port = _free_port()
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"],
+        cwd=REPO_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            if proc.poll() is not None:
+                raise RuntimeError("uvicorn exited before the app answered.")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/openapi.json", timeout=1):
+                    return time.perf_counter() - started
+            except OSError:
+                time.sleep(0.05)
+        raise RuntimeError(f"The app did not answer within {timeout}s.")
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def _summary(samples: list) -> dict:
+    return {
+        "median": round(statistics.median(samples), 4),
+        "min": round(min(samples), 4),
+        "max": round(max(samples), 4),
+    }
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(module: str, runs: int, top: int, serve: bool) -> dict:
+    walls, per_module = [], {}
+    with tempfile.TemporaryDirectory(prefix="aisa-startup-") as home:
+        env = _isolated_env(home)
+        for _ in range(runs):
+            wall, rows = profile_import(module, env)
+            walls.append(wall)
+            for name, self_us, cumulative_us, depth in rows:
+                entry = per_module.setdefault(name, {"self": [], "cumulative": [], "depth": depth})
+                entry["self"].append(self_us)
+                entry["cumulative"].append(cumulative_us)
+        serve_times = [time_serve(env) for _ in range(runs)] if serve else []
+
+    modules = [
+        {
+            "module": name,
+            "depth": entry["depth"],
+            "self_ms": round(statistics.median(entry["self"]) / 1000, 2),
+            "cumulative_ms": round(statistics.median(entry["cumulative"]) / 1000, 2),
+        }
+        for name, entry in per_module.items()
+    ]
+    report = {
+        "commit": _commit(),
+        "python": sys.version.split()[0],
+        "module": module,
+        "runs": runs,
+        "import_seconds": _summary(walls),
+        "modules_imported": len(modules),
+        "heavy_modules_imported": sorted(name for name in per_module if name in HEAVY_MODULES),
+        "slowest_cumulative": sorted(modules, key=lambda m: m["cumulative_ms"], reverse=True)[:top],
+        "slowest_self": sorted(modules, key=lambda m: m["self_ms"], reverse=True)[:top],
+    }
+    if serve_times:
+        report["serve_seconds"] = _summary(serve_times)
+    return report
+
+
+def print_report(report: dict, baseline: dict = None) -> None:
+    def compare(key: str) -> str:
+        if not baseline or key not in baseline:
+            return ""
+        before, after = baseline[key]["median"], report[key]["median"]
+        return f"  (baseline {before:.3f}s, {(after - before) / before * 100:+.0f}%)" if before else ""
+
+    print(f"Startup of `{report['module']}` at {report['commit']} (Python {report['python']}, {report['runs']} runs)")
+    print(f"  import: median {report['import_seconds']['median']:.3f}s{compare('import_seconds')}")
+    if "serve_seconds" in report:
+        print(f"  serve:  median {report['serve_seconds']['median']:.3f}s{compare('serve_seconds')}")
+    print(f"  modules imported: {report['modules_imported']}")
+    heavy = report["heavy_modules_imported"]
+    print(f"  heavy dependencies imported at startup: {', '.join(heavy) if heavy else 'none'}")
+    print("  slowest imports (cumulative):")
+    for entry in report["slowest_cumulative"]:
+        print(f"    {entry['cumulative_ms']:9.1f} ms  {'  ' * entry['depth']}{entry['module']}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Profile the server's import and boot time.")
+    parser.add_argument("--module", default="app", help="module to import (default: app)")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=25, help="number of slowest imports to report")
+    parser.add_argument("--serve", action="store_true", help="also time uvicorn until the app answers")
+    parser.add_argument("--output", type=Path, help="where to write the JSON report")
+    parser.add_argument("--baseline", type=Path, help="an earlier JSON report to compare against")
+    args = parser.parse_args()
+
+    report = run(args.module, args.runs, args.top, args.serve)
+    baseline = json.loads(args.baseline.read_text(encoding="utf-8")) if args.baseline else None
+    print_report(report, baseline)
+
+    output = args.output or RESULTS_DIR / f"startup-{report['commit']}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"Report written to {output}")
+
+
+if __name__ == "__main__":
+    main()
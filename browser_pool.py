@@ -0,0 +1,213 @@
+import os
+import sys
+import json
+import time
+import shutil
+import threading
+import subprocess
+import urllib.request
+from contextlib import contextmanager
+from pathlib import Path
+
+from config import (
+    ARTIFACTS_DIR, BROWSER_POOL_SIZE, BROWSER_BASE_PORT, BROWSER_EXECUTABLE,
+    BROWSER_STARTUP_TIMEOUT_SECONDS, BROWSER_RECYCLE_AFTER_RUNS,
+)
+
+BROWSER_DIR = ARTIFACTS_DIR / "_browsers"
+
+# Where `playwright install` puts Chromium, relative to its browsers dir.
+CHROMIUM_BINARIES = {
+    "linux": ["chrome-linux/chrome", "chrome-linux64/chrome"],
+    "darwin": ["chrome-mac/Chromium.app/Contents/MacOS/Chromium"],
+    "win32": ["chrome-win/chrome.exe", "chrome-win64/chrome.exe"],
+}
+
+
+class Browser:
+    """One long-lived headless Chromium that scripts reach over the Chrome DevTools Protocol."""
+
+    def __init__(self, index: int, port: int):
+        self.index = index
+        self.port = port
+        self.proc = None
+        self.ws_endpoint = None
+        self.contexts = 0
+        self.runs = 0
+        self.runs_since_launch = 0
+        self.launches = 0
+
+    @property
+    def cdp_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+    def snapshot(self) -> dict:
+        return {
+            "cdp_url": self.cdp_url,
+            "alive": self.alive(),
+            "contexts": self.contexts,
+            "runs": self.runs,
+            "launches": self.launches,
+        }
+
+
+_cond = threading.Condition()
+_browsers = [Browser(i, BROWSER_BASE_PORT + i) for i in range(BROWSER_POOL_SIZE)]
+_launch_locks = [threading.Lock() for _ in _browsers]
+_stats = {"leases": 0, "fallbacks": 0, "launch_failures": 0, "recycled": 0}
+
+
+def _playwright_browsers_dir() -> Path:
+    configured = os.getenv("PLAYWRIGHT_BROWSERS_PATH")
+    if configured and configured != "0":
+        return Path(configured)
+    if sys.platform == "win32":
+        return Path(os.getenv("LOCALAPPDATA", str(Path.home()))) / "ms-playwright"
+    if sys.platform == "darwin":
+        return Path.home() / "Library" / "Caches" / "ms-playwright"
+    return Path.home() / ".cache" / "ms-playwright"
+
+
+def find_chromium():
+    """BROWSER_EXECUTABLE if set, else the newest Chromium installed by `playwright install`, else None."""
+    if BROWSER_EXECUTABLE:
+        return BROWSER_EXECUTABLE
+    candidates = CHROMIUM_BINARIES.get(sys.platform, CHROMIUM_BINARIES["linux"])
+    installs = sorted(
+        _playwright_browsers_dir().glob("chromium-*"),
+        key=lambda p: int(p.name.rsplit("-", 1)[-1]) if p.name.rsplit("-", 1)[-1].isdigit() else -1,
+        reverse=True,
+    )
+    for install in installs:
+        for relative in candidates:
+            if (install / relative).exists():
+                return str(install / relative)
+    return None
+
+
+def _version_info(browser: Browser, timeout: float = 2):
+    """The browser's /json/version document, or None if it is not answering."""
+    try:
+        with urllib.request.urlopen(f"{browser.cdp_url}/json/version", timeout=timeout) as response:
+            return json.loads(response.read())
+    except (OSError, ValueError):
+        return None
+
+
+def _stop(browser: Browser) -> None:
+    if browser.alive():
+        browser.proc.terminate()
+        try:
+            browser.proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            browser.proc.kill()
+    browser.proc, browser.ws_endpoint = None, None
+
+
+def _launch(browser: Browser, executable: str) -> bool:
+    """Starts the browser headless with remote debugging and waits until its CDP endpoint answers."""
+    profile_dir = BROWSER_DIR / f"profile-{browser.index}"
+    shutil.rmtree(profile_dir, ignore_errors=True)
+    profile_dir.mkdir(parents=True, exist_ok=True)
+    try:
+        with (BROWSER_DIR / f"browser-{browser.index}.log").open("a", encoding="utf-8") as log:
+            browser.proc = subprocess.Popen(
+                [
+                    executable, "--headless=new", f"--remote-debugging-port={browser.port}",
+                    "--remote-debugging-address=127.0.0.1", f"--user-data-dir={profile_dir}",
+                    "--no-first-run", "--no-default-browser-check", "--disable-dev-shm-usage",
+                    "about:blank",
+                ],
+                stdout=log, stderr=subprocess.STDOUT,
+            )
+    except OSError as e:
+        print(f"Warning: could not start headless browser {browser.index} ({executable}): {e}")
+        return False
+    browser.launches += 1
+    browser.runs_since_launch = 0
+    deadline = time.monotonic() + BROWSER_STARTUP_TIMEOUT_SECONDS
+    while time.monotonic() < deadline and browser.alive():
+        info = _version_info(browser)
+        if info is not None:
+            browser.ws_endpoint = info.get("webSocketDebuggerUrl")
+            print(f"Headless browser {browser.index} ready at {browser.cdp_url}.")
+            return True
+        time.sleep(0.2)
+    print(f"Warning: headless browser {browser.index} did not start within {BROWSER_STARTUP_TIMEOUT_SECONDS}s.")
+    _stop(browser)
+    return False
+
+
+def _ensure_running(browser: Browser) -> bool:
+    """(Re)launches the browser if it is not running. Called with the browser leased, outside _cond."""
+    if browser.alive():
+        return True
+    executable = find_chromium()
+    if executable is None:
+        return False
+    if _launch(browser, executable):
+        return True
+    with _cond:
+        _stats["launch_failures"] += 1
+    return False
+
+
+@contextmanager
+def lease(holder: str):
+    """
+    Assigns a run to the pooled browser with the fewest open contexts,
+    launching it on first use. Yields its CDP URL; the script opens its own
+    isolated context there and closes it when done. Yields None when no
+    Chromium is installed or it cannot start, in which case the script
+    launches a headless browser of its own (always, with BROWSER_POOL_SIZE 0).
+    """
+    if not _browsers:
+        yield None
+        return
+    with _cond:
+        browser = min(_browsers, key=lambda b: b.contexts)
+        browser.contexts += 1
+        _stats["leases"] += 1
+    try:
+        # Serialize launches of the same browser between concurrent leases.
+        with _launch_locks[browser.index]:
+            running = _ensure_running(browser)
+        if not running:
+            with _cond:
+                _stats["fallbacks"] += 1
+            print(f"[{holder}] No pooled browser available; the script will launch its own.")
+        yield browser.cdp_url if running else None
+    finally:
+        with _cond:
+            browser.contexts -= 1
+            browser.runs += 1
+            browser.runs_since_launch += 1
+            recycle = (BROWSER_RECYCLE_AFTER_RUNS > 0 and browser.contexts == 0
+                       and browser.runs_since_launch >= BROWSER_RECYCLE_AFTER_RUNS)
+        if recycle:
+            # Long-lived browsers accumulate memory; restart this one (on its next lease) while it is idle.
+            with _launch_locks[browser.index]:
+                with _cond:
+                    idle = browser.contexts == 0 and browser.alive()
+                    if idle:
+                        _stats["recycled"] += 1
+                if idle:
+                    _stop(browser)
+
+
+def shutdown() -> None:
+    for browser in _browsers:
+        _stop(browser)
+
+
+def get_stats() -> dict:
+    executable = find_chromium()
+    with _cond:
+        return {
+            "executable": executable,
+            "browsers": [browser.snapshot() for browser in _browsers],
+            **_stats,
+        }
@@ -1,4 +1,5 @@
 import os
+import threading
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -16,28 +17,313 @@ GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 # You can change this path to whatever you like (e.g., "D:/AISA_TASKS").
 ARTIFACTS_DIR = Path.home() / "AISA_TASKS"
 
+# --- Task State Store ---
+# "json" keeps one status.json per task directory (locked, atomically
+# replaced); "sqlite" keeps all task states in one WAL-mode database indexed
+# by status, platform and creation time. Recently used states are cached in
+# memory (write-through).
+STATE_BACKEND = os.getenv("AISA_STATE_BACKEND", "json")
+STATE_DB_PATH = Path(os.getenv("AISA_STATE_DB_PATH", str(ARTIFACTS_DIR / "_state.sqlite3")))
+STATE_CACHE_SIZE = int(os.getenv("AISA_STATE_CACHE_SIZE", "1024"))
+
+# --- Ingest Cache ---
+# Uploaded PDFs and extracted images are stored once in a content-addressed
+# blob store and hardlinked into task dirs. Extraction output is reused per
+# PDF hash, blueprints per (PDF hash, instructions, platform).
+INGEST_CACHE_ENABLED = os.getenv("AISA_INGEST_CACHE_ENABLED", "true").lower() == "true"
+BLOB_STORE_DIR = ARTIFACTS_DIR / "_blobs"
+INGEST_CACHE_DIR = ARTIFACTS_DIR / "_ingest_cache"
+
+# --- PDF Extraction ---
+# Large PDFs are split into page ranges that are parsed in a process pool;
+# extracted images are written to disk by a separate I/O thread pool.
+PDF_EXTRACT_WORKERS = int(os.getenv("AISA_PDF_EXTRACT_WORKERS", str(os.cpu_count() or 1)))
+PDF_PAGES_PER_RANGE = int(os.getenv("AISA_PDF_PAGES_PER_RANGE", "16"))
+PDF_IO_WORKERS = int(os.getenv("AISA_PDF_IO_WORKERS", "4"))
+# Within one PDF, images are deduplicated by xref only. With the ingest cache
+# on, each new image also gets a perceptual hash (from a small thumbnail), and
+# an image whose hash is identical to one stored for another document reuses
+# that blob. The hash index keeps the most recent
+# AISA_IMAGE_PHASH_INDEX_MAX_ENTRIES hashes.
+IMAGE_PHASH_ENABLED = os.getenv("AISA_IMAGE_PHASH_ENABLED", "true").lower() == "true"
+IMAGE_PHASH_INDEX_MAX_ENTRIES = int(os.getenv("AISA_IMAGE_PHASH_INDEX_MAX_ENTRIES", "50000"))
+
+# --- Agent 1 Prompt Budget ---
+# Estimated tokens above which Agent 1 splits the PDF into chunks that are
+# planned concurrently and merged into one blueprint.
+AGENT1_TOKEN_BUDGET = int(os.getenv("AISA_AGENT1_TOKEN_BUDGET", "24000"))
+AGENT1_CHUNK_TOKENS = int(os.getenv("AISA_AGENT1_CHUNK_TOKENS", "8000"))
+AGENT1_CHUNK_CONCURRENCY = int(os.getenv("AISA_AGENT1_CHUNK_CONCURRENCY", "4"))
+
+# --- LLM Response Cache ---
+# Completions are cached on disk (SQLite), keyed by provider, model and the
+# hashes of the system and user prompts.
+LLM_CACHE_ENABLED = os.getenv("AISA_LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_PATH = Path(os.getenv("AISA_LLM_CACHE_PATH", str(ARTIFACTS_DIR / "_llm_cache.sqlite3")))
+LLM_CACHE_TTL_SECONDS = int(os.getenv("AISA_LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("AISA_LLM_CACHE_MAX_ENTRIES", "5000"))
+
+# --- LLM Provider Timeouts & Hedging ---
+# Per-provider request timeouts apply to both the sync and async clients.
+# Agent 1's chunked blueprints always use the async clients; its single
+# blueprint call does too when hedging is on (and streams otherwise). With
+# hedging on, a request goes to the second provider as well when the first
+# has not answered within its recent p95 latency (or
+# AISA_LLM_HEDGE_DEFAULT_DELAY_SECONDS until enough samples exist), and the
+# slower request is cancelled.
+GROQ_TIMEOUT_SECONDS = float(os.getenv("AISA_GROQ_TIMEOUT_SECONDS", "60"))
+ANTHROPIC_TIMEOUT_SECONDS = float(os.getenv("AISA_ANTHROPIC_TIMEOUT_SECONDS", "120"))
+LLM_MAX_CONNECTIONS = int(os.getenv("AISA_LLM_MAX_CONNECTIONS", "20"))
+LLM_HEDGING_ENABLED = os.getenv("AISA_LLM_HEDGING_ENABLED", "false").lower() == "true"
+LLM_HEDGE_DEFAULT_DELAY_SECONDS = float(os.getenv("AISA_LLM_HEDGE_DEFAULT_DELAY_SECONDS", "5"))
+
+# --- LLM Circuit Breaker & Rate Limiter ---
+# A provider's circuit opens when, over the rolling window, at least
+# AISA_LLM_BREAKER_MIN_CALLS calls were made and the share that failed (or
+# took longer than AISA_LLM_BREAKER_SLOW_CALL_SECONDS) reaches
+# AISA_LLM_BREAKER_FAILURE_RATE. It stays open for the cool-off, then lets a
+# single trial call through. Each provider also has a token bucket, retuned
+# from rate-limit response headers, that makes callers wait (up to
+# AISA_LLM_RATE_LIMIT_MAX_WAIT_SECONDS) instead of failing.
+LLM_BREAKER_WINDOW_SECONDS = float(os.getenv("AISA_LLM_BREAKER_WINDOW_SECONDS", "60"))
+LLM_BREAKER_MIN_CALLS = int(os.getenv("AISA_LLM_BREAKER_MIN_CALLS", "5"))
+LLM_BREAKER_FAILURE_RATE = float(os.getenv("AISA_LLM_BREAKER_FAILURE_RATE", "0.5"))
+LLM_BREAKER_SLOW_CALL_SECONDS = float(os.getenv("AISA_LLM_BREAKER_SLOW_CALL_SECONDS", "45"))
+LLM_BREAKER_COOL_OFF_SECONDS = float(os.getenv("AISA_LLM_BREAKER_COOL_OFF_SECONDS", "30"))
+LLM_RATE_LIMIT_RPS = float(os.getenv("AISA_LLM_RATE_LIMIT_RPS", "5"))
+LLM_RATE_LIMIT_BURST = int(os.getenv("AISA_LLM_RATE_LIMIT_BURST", "10"))
+LLM_RATE_LIMIT_MAX_WAIT_SECONDS = float(os.getenv("AISA_LLM_RATE_LIMIT_MAX_WAIT_SECONDS", "60"))
+
+# --- Search Cache & Offline Index ---
+# Agent 2's search tools answer from a local SQLite cache and full-text index
+# (past results plus curated Playwright/Appium snippets) before calling
+# Tavily, provided the index has at least AISA_SEARCH_LOCAL_MIN_RESULTS
+# matches. Cached queries and indexed network results older than the TTL are
+# ignored (curated snippets never expire). In offline mode they never go to
+# the network and stale entries are still served.
+SEARCH_INDEX_PATH = Path(os.getenv("AISA_SEARCH_INDEX_PATH", str(ARTIFACTS_DIR / "_search_index.sqlite3")))
+SEARCH_CACHE_TTL_SECONDS = int(os.getenv("AISA_SEARCH_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+SEARCH_LOCAL_MIN_RESULTS = int(os.getenv("AISA_SEARCH_LOCAL_MIN_RESULTS", "3"))
+SEARCH_OFFLINE = os.getenv("AISA_SEARCH_OFFLINE", "false").lower() == "true"
+
+# --- Agent 3 Virtualenv Pool ---
+# Generated scripts run in shared virtualenvs keyed by the hash of their
+# normalized requirements.txt instead of a fresh venv per task. The sets in
+# AISA_ENV_PREWARM_SETS (";" between sets, "," between packages) are built
+# in the background at startup; least recently used envs beyond
+# AISA_ENV_POOL_MAX_ENVS are deleted.
+ENV_POOL_DIR = Path(os.getenv("AISA_ENV_POOL_DIR", str(ARTIFACTS_DIR / "_envs")))
+ENV_POOL_MAX_ENVS = int(os.getenv("AISA_ENV_POOL_MAX_ENVS", "8"))
+ENV_POOL_MIN_IDLE_SECONDS = int(os.getenv("AISA_ENV_POOL_MIN_IDLE_SECONDS", "3600"))
+ENV_BUILD_TIMEOUT_SECONDS = int(os.getenv("AISA_ENV_BUILD_TIMEOUT_SECONDS", "900"))
+# Upgrading pip in each new env needs the network; turn it off for offline runs.
+ENV_UPGRADE_PIP = os.getenv("AISA_ENV_UPGRADE_PIP", "true").lower() == "true"
+ENV_PREWARM_ENABLED = os.getenv("AISA_ENV_PREWARM_ENABLED", "true").lower() == "true"
+ENV_PREWARM_SETS = [
+    [package.strip() for package in package_set.split(",") if package.strip()]
+    for package_set in os.getenv(
+        "AISA_ENV_PREWARM_SETS", "playwright,Faker;Appium-Python-Client,Faker"
+    ).split(";")
+    if package_set.strip()
+]
+
+# --- Agent 3 Execution ---
+# "supervisor" runs generated scripts as managed, headless subprocesses
+# (dispatched by the run scheduler, per-task timeout, rotating stdout/stderr
+# logs under agent3/logs) and records the result in status.json from the
+# exit code. "terminal" keeps the old behaviour of opening a terminal window
+# per run.
+AGENT3_MODE = os.getenv("AISA_AGENT3_MODE", "supervisor")
+SUPERVISOR_TASK_TIMEOUT_SECONDS = int(os.getenv("AISA_SUPERVISOR_TASK_TIMEOUT_SECONDS", "1800"))
+SUPERVISOR_LOG_MAX_BYTES = int(os.getenv("AISA_SUPERVISOR_LOG_MAX_BYTES", str(5 * 1024 * 1024)))
+SUPERVISOR_LOG_BACKUPS = int(os.getenv("AISA_SUPERVISOR_LOG_BACKUPS", "3"))
+
+# --- Run Scheduler ---
+# Supervised runs wait in one priority queue and are dispatched to free
+# execution slots: SCHEDULER_WEB_SLOTS for web tasks, and one slot per ready
+# Appium server (device) for mobile tasks. Among equal priorities the
+# submitter served least recently goes first. Past SCHEDULER_MAX_QUEUE
+# waiting runs, new runs are rejected with 429 instead of queued.
+SCHEDULER_WEB_SLOTS = int(os.getenv("AISA_SCHEDULER_WEB_SLOTS", "4"))
+SCHEDULER_MAX_QUEUE = int(os.getenv("AISA_SCHEDULER_MAX_QUEUE", "200"))
+
+# --- Generated Script Runtime ---
+# Scripts use the aisa_runtime helpers (runtime/aisa_runtime.py), whose
+# actions wait for elements instead of sleeping and time each step into
+# agent3/steps.jsonl. Before a Playwright script is saved, a static pass
+# removes fixed sleeps right after actions and turns other sleeps into
+# capped, timed aisa_runtime.pause() calls (Appium scripts keep their sleeps
+# as written), and turns "networkidle" waits into "load" waits.
+SCRIPT_POSTPROCESS_ENABLED = os.getenv("AISA_SCRIPT_POSTPROCESS_ENABLED", "true").lower() == "true"
+RUNTIME_STEP_TIMEOUT_MS = int(os.getenv("AISA_STEP_TIMEOUT_MS", "15000"))
+RUNTIME_MAX_PAUSE_SECONDS = float(os.getenv("AISA_MAX_PAUSE_SECONDS", "10"))
+
+# --- Shared Browser Pool ---
+# Web scripts run in the supervisor connect to one of BROWSER_POOL_SIZE
+# long-lived headless Chromium processes over CDP and open their own isolated
+# context, instead of launching a browser per run. Chromium is the one
+# installed by `playwright install` unless AISA_BROWSER_EXECUTABLE is set; a
+# browser is restarted once idle after BROWSER_RECYCLE_AFTER_RUNS runs (0 never).
+BROWSER_POOL_SIZE = int(os.getenv("AISA_BROWSER_POOL_SIZE", "1"))
+BROWSER_BASE_PORT = int(os.getenv("AISA_BROWSER_BASE_PORT", "9222"))
+BROWSER_EXECUTABLE = os.getenv("AISA_BROWSER_EXECUTABLE", "")
+BROWSER_STARTUP_TIMEOUT_SECONDS = int(os.getenv("AISA_BROWSER_STARTUP_TIMEOUT_SECONDS", "30"))
+BROWSER_RECYCLE_AFTER_RUNS = int(os.getenv("AISA_BROWSER_RECYCLE_AFTER_RUNS", "200"))
+
+# --- Appium Server Pool ---
+# One long-lived Appium server per ADB device found at startup, on ports
+# AISA_APPIUM_BASE_PORT, +2, +4, ... (UiAutomator2 system ports from
+# AISA_APPIUM_SYSTEM_BASE_PORT). Mobile runs lease a ready server and its
+# device. AISA_APPIUM_SERVER_URLS (comma-separated) uses externally managed
+# servers, or a stub HTTP server, instead of spawning any.
+APPIUM_SERVER_URLS = [u.strip() for u in os.getenv("AISA_APPIUM_SERVER_URLS", "").split(",") if u.strip()]
+APPIUM_BASE_PORT = int(os.getenv("AISA_APPIUM_BASE_PORT", "4723"))
+APPIUM_SYSTEM_BASE_PORT = int(os.getenv("AISA_APPIUM_SYSTEM_BASE_PORT", "8200"))
+APPIUM_STARTUP_TIMEOUT_SECONDS = int(os.getenv("AISA_APPIUM_STARTUP_TIMEOUT_SECONDS", "60"))
+APPIUM_LEASE_TIMEOUT_SECONDS = int(os.getenv("AISA_APPIUM_LEASE_TIMEOUT_SECONDS", "300"))
+APPIUM_HEALTH_INTERVAL_SECONDS = int(os.getenv("AISA_APPIUM_HEALTH_INTERVAL_SECONDS", "30"))
+
+# --- Task Event Stream ---
+# In-process pub/sub behind GET /task/{seq_no}/events (SSE) and the
+# /task/{seq_no}/ws WebSocket. Each subscriber buffers at most
+# AISA_EVENTS_BUFFER_SIZE events (oldest dropped first); the last
+# AISA_EVENTS_HISTORY_SIZE events per task are kept for Last-Event-ID replay.
+EVENTS_BUFFER_SIZE = int(os.getenv("AISA_EVENTS_BUFFER_SIZE", "256"))
+EVENTS_HISTORY_SIZE = int(os.getenv("AISA_EVENTS_HISTORY_SIZE", "100"))
+EVENTS_HISTORY_TOPICS = int(os.getenv("AISA_EVENTS_HISTORY_TOPICS", "1000"))
+EVENTS_HEARTBEAT_SECONDS = int(os.getenv("AISA_EVENTS_HEARTBEAT_SECONDS", "15"))
+
+# --- Task Uploads ---
+# /create_task and /create_tasks stream the PDF to a temp file as it arrives,
+# hashing it and checking the PDF header, trailer and page count on the way,
+# then rename it into place. Larger uploads are rejected with 413 as soon as
+# they cross AISA_UPLOAD_MAX_BYTES; AISA_UPLOAD_MAX_PAGES of 0 disables the
+# page limit.
+UPLOAD_MAX_BYTES = int(os.getenv("AISA_UPLOAD_MAX_BYTES", str(50 * 1024 * 1024)))
+UPLOAD_MAX_PAGES = int(os.getenv("AISA_UPLOAD_MAX_PAGES", "500"))
+
+# --- Batch Submission ---
+# POST /create_tasks extracts a shared PDF once and runs the per-task
+# Agent 1 -> Agent 2 pipelines on the job queue, with at most
+# AISA_BATCH_FANOUT of one batch's tasks queued or running at a time.
+BATCH_FANOUT = int(os.getenv("AISA_BATCH_FANOUT", "4"))
+BATCH_MAX_TASKS = int(os.getenv("AISA_BATCH_MAX_TASKS", "100"))
+
+# --- Job Queue ---
+# When enabled, /create_task only persists the upload and returns 202; the
+# Agent 1 -> Agent 2 pipeline runs on a background pool of workers.
+# AISA_JOB_QUEUE_EXECUTOR is either "thread" or "process".
+JOB_QUEUE_ENABLED = os.getenv("AISA_JOB_QUEUE_ENABLED", "true").lower() == "true"
+JOB_QUEUE_WORKERS = int(os.getenv("AISA_JOB_QUEUE_WORKERS", "2"))
+JOB_QUEUE_EXECUTOR = os.getenv("AISA_JOB_QUEUE_EXECUTOR", "thread")
+
+# --- Tracing and Metrics ---
+# Each pipeline stage (PDF extraction, LLM calls, Agent 2 tool calls, env
+# provisioning, script runs) is recorded as a span. Spans feed the
+# histograms and counters served at GET /metrics and are summarized per task
+# in status.json. With AISA_TRACE_EXPORT_PATH set, every finished span is also
+# appended to that file as one JSON line (rotated at AISA_TRACE_EXPORT_MAX_BYTES).
+TRACING_ENABLED = os.getenv("AISA_TRACING_ENABLED", "true").lower() == "true"
+TRACE_EXPORT_PATH = os.getenv("AISA_TRACE_EXPORT_PATH", "")
+TRACE_EXPORT_MAX_BYTES = int(os.getenv("AISA_TRACE_EXPORT_MAX_BYTES", str(50 * 1024 * 1024)))
+TRACE_EXPORT_BACKUPS = int(os.getenv("AISA_TRACE_EXPORT_BACKUPS", "3"))
+METRICS_BUCKETS = [
+    float(b) for b in os.getenv(
+        "AISA_METRICS_BUCKETS", "0.01,0.05,0.1,0.25,0.5,1,2.5,5,10,30,60,120,300,600"
+    ).split(",") if b.strip()
+]
+
+# --- Artifact Retention ---
+# A background compactor packs the directories of finished tasks (statuses in
+# AISA_RETENTION_STATUSES) into artifacts.zip once they are older than
+# AISA_RETENTION_ARCHIVE_AFTER_SECONDS, and deletes them after
+# AISA_RETENTION_DELETE_AFTER_SECONDS. While ARTIFACTS_DIR is above
+# AISA_RETENTION_MAX_BYTES it frees space in order: idle pooled virtualenvs,
+# then packing, then deleting the oldest finished tasks. Reads while packing
+# are throttled to AISA_RETENTION_IO_BYTES_PER_SECOND. 0 disables any of the
+# limits.
+RETENTION_ENABLED = os.getenv("AISA_RETENTION_ENABLED", "true").lower() == "true"
+RETENTION_INTERVAL_SECONDS = int(os.getenv("AISA_RETENTION_INTERVAL_SECONDS", "3600"))
+RETENTION_STATUSES = [
+    s.strip() for s in os.getenv("AISA_RETENTION_STATUSES", "succeeded,failed").split(",") if s.strip()
+]
+RETENTION_ARCHIVE_AFTER_SECONDS = int(os.getenv("AISA_RETENTION_ARCHIVE_AFTER_SECONDS", str(24 * 3600)))
+RETENTION_DELETE_AFTER_SECONDS = int(os.getenv("AISA_RETENTION_DELETE_AFTER_SECONDS", "0"))
+RETENTION_MAX_BYTES = int(os.getenv("AISA_RETENTION_MAX_BYTES", "0"))
+RETENTION_IO_BYTES_PER_SECOND = int(os.getenv("AISA_RETENTION_IO_BYTES_PER_SECOND", str(20 * 1024 * 1024)))
+
 # --- LLM Client Initialization ---
-# Initialize clients once here and import them wherever needed.
-anthropic_client = None
-groq_client = None
-
-try:
-    if ANTHROPIC_API_KEY:
-        from anthropic import Anthropic
-        anthropic_client = Anthropic(api_key=ANTHROPIC_API_KEY)
-        print("Anthropic client initialized successfully.")
-except ImportError:
-    print("Warning: 'anthropic' library not found. To use Anthropic, run 'pip install anthropic'.")
-except Exception as e:
-    print(f"Error initializing Anthropic client: {e}")
+# Clients are created on first use (not at import) and shared afterwards, so
+# importing config stays cheap and the provider SDKs are only loaded by
+# processes that actually call an LLM. The async clients share one pooled
+# httpx connection pool per provider and are only used from llm_utils'
+# shared event loop thread.
+# Importing the agent pipeline (LangChain, provider SDKs, PyMuPDF) is
+# likewise deferred; with AISA_STARTUP_PRELOAD_ENABLED it happens on a
+# background thread right after startup so the first task does not pay for it.
+STARTUP_PRELOAD_ENABLED = os.getenv("AISA_STARTUP_PRELOAD_ENABLED", "true").lower() == "true"
+
+_clients = {}
+_clients_lock = threading.Lock()
 
+def _async_http_client():
+    import httpx
+    return httpx.AsyncClient(limits=httpx.Limits(
+        max_connections=LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_MAX_CONNECTIONS,
+    ))
 
-try:
-    if GROQ_API_KEY:
-        from groq import Groq
-        groq_client = Groq(api_key=GROQ_API_KEY)
+def _create_anthropic_clients() -> tuple:
+    if not ANTHROPIC_API_KEY:
+        return None, None
+    try:
+        from anthropic import Anthropic, AsyncAnthropic
+        clients = (
+            Anthropic(api_key=ANTHROPIC_API_KEY, timeout=ANTHROPIC_TIMEOUT_SECONDS),
+            AsyncAnthropic(
+                api_key=ANTHROPIC_API_KEY, timeout=ANTHROPIC_TIMEOUT_SECONDS, http_client=_async_http_client()
+            ),
+        )
+        print("Anthropic client initialized successfully.")
+        return clients
+    except ImportError:
+        print("Warning: 'anthropic' library not found. To use Anthropic, run 'pip install anthropic'.")
+    except Exception as e:
+        print(f"Error initializing Anthropic client: {e}")
+    return None, None
+
+def _create_groq_clients() -> tuple:
+    if not GROQ_API_KEY:
+        return None, None
+    try:
+        from groq import Groq, AsyncGroq
+        clients = (
+            Groq(api_key=GROQ_API_KEY, timeout=GROQ_TIMEOUT_SECONDS),
+            AsyncGroq(api_key=GROQ_API_KEY, timeout=GROQ_TIMEOUT_SECONDS, http_client=_async_http_client()),
+        )
         print("Groq client initialized successfully.")
-except ImportError:
-    print("Warning: 'groq' library not found. To use Groq, run 'pip install groq'.")
-except Exception as e:
-    print(f"Error initializing Groq client: {e}")
\ No newline at end of file
+        return clients
+    except ImportError:
+        print("Warning: 'groq' library not found. To use Groq, run 'pip install groq'.")
+    except Exception as e:
+        print(f"Error initializing Groq client: {e}")
+    return None, None
+
+def _provider_clients(provider: str) -> tuple:
+    """(sync client, async client) for a provider, created on first use; (None, None) if unavailable."""
+    with _clients_lock:
+        if provider not in _clients:
+            _clients[provider] = _create_anthropic_clients() if provider == "anthropic" else _create_groq_clients()
+        return _clients[provider]
+
+def get_anthropic_client():
+    return _provider_clients("anthropic")[0]
+
+def get_async_anthropic_client():
+    return _provider_clients("anthropic")[1]
+
+def get_groq_client():
+    return _provider_clients("groq")[0]
+
+def get_async_groq_client():
+    return _provider_clients("groq")[1]
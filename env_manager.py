@@ -0,0 +1,339 @@
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import threading
+import subprocess
+from pathlib import Path
+
+from config import (
+    ENV_POOL_DIR, ENV_POOL_MAX_ENVS, ENV_POOL_MIN_IDLE_SECONDS,
+    ENV_PREWARM_ENABLED, ENV_PREWARM_SETS, ENV_BUILD_TIMEOUT_SECONDS, ENV_UPGRADE_PIP,
+)
+import telemetry
+
+METADATA_FILE = "aisa_env.json"
+RUNTIME_DIR = Path(__file__).resolve().parent / "runtime"
+RUNTIME_PTH_FILE = "aisa_runtime.pth"
+LAST_USED_FILE = "last_used"
+NAME_PATTERN = re.compile(r"^([A-Za-z0-9][A-Za-z0-9._-]*)(\[[^\]]*\])?\s*(.*)$")
+
+_build_locks = {}
+_build_locks_lock = threading.Lock()
+_stats = {"hits": 0, "superset_hits": 0, "builds": 0, "build_failures": 0, "evicted": 0, "browser_installs": 0}
+_stats_lock = threading.Lock()
+
+
+class EnvBuildError(Exception):
+    """Raised when a virtualenv cannot be created or its requirements cannot be installed."""
+
+
+def _canonical_name(name: str) -> str:
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def normalize_requirements(text: str) -> list:
+    """
+    Sorted, de-duplicated requirement lines with comments and blank lines
+    removed, whitespace dropped and package names canonicalized, so that
+    "Faker\\nplaywright==1.45.0" and "playwright == 1.45.0\\nfaker" match.
+    """
+    lines = set()
+    for raw in text.splitlines():
+        line = raw.split(" #", 1)[0].strip()
+        if not line or line.startswith("#"):
+            continue
+        match = NAME_PATTERN.match(line)
+        if match and not line.startswith("-"):
+            name, extras, spec = match.groups()
+            line = _canonical_name(name) + (extras or "").lower() + spec.replace(" ", "")
+        lines.add(line)
+    return sorted(lines)
+
+
+def requirements_hash(requirements: list) -> str:
+    return hashlib.sha256("\n".join(requirements).encode("utf-8")).hexdigest()[:16]
+
+
+def env_python(env_dir: Path) -> Path:
+    if sys.platform == "win32":
+        return env_dir / "Scripts" / "python.exe"
+    return env_dir / "bin" / "python"
+
+
+def _read_metadata(env_dir: Path):
+    try:
+        return json.loads((env_dir / METADATA_FILE).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def _touch(env_dir: Path) -> None:
+    (env_dir / LAST_USED_FILE).touch()
+
+
+def _last_used(env_dir: Path) -> float:
+    try:
+        return (env_dir / LAST_USED_FILE).stat().st_mtime
+    except OSError:
+        return 0.0
+
+
+def _ready_envs() -> list:
+    """(env_dir, metadata) for every fully built environment in the pool."""
+    if not ENV_POOL_DIR.exists():
+        return []
+    envs = []
+    for env_dir in ENV_POOL_DIR.iterdir():
+        if env_dir.name.startswith((".", "_")) or not env_dir.is_dir():
+            continue
+        metadata = _read_metadata(env_dir)
+        if metadata is not None:
+            envs.append((env_dir, metadata))
+    return envs
+
+
+def _satisfies(installed: dict, requirement: str) -> bool:
+    """Whether an installed {canonical name: version} map satisfies one requirement line."""
+    match = NAME_PATTERN.match(requirement)
+    if not match or requirement.startswith("-"):
+        return False
+    name, _, spec = match.groups()
+    version = installed.get(_canonical_name(name))
+    if version is None:
+        return False
+    if not spec:
+        return True
+    if spec.startswith("==") and "," not in spec and ";" not in spec:
+        return spec[2:] == version
+    try:
+        from packaging.specifiers import SpecifierSet
+        return SpecifierSet(spec).contains(version, prereleases=True)
+    except Exception:
+        return False
+
+
+def _find_compatible(requirements: list):
+    """An existing environment whose installed packages satisfy every requirement, if any."""
+    for env_dir, metadata in _ready_envs():
+        installed = metadata.get("installed", {})
+        if all(_satisfies(installed, r) for r in requirements):
+            return env_dir
+    return None
+
+
+def _run(cmd: list, log) -> None:
+    log.write(f"$ {' '.join(str(c) for c in cmd)}\n")
+    log.flush()
+    result = subprocess.run(cmd, stdout=log, stderr=subprocess.STDOUT, timeout=ENV_BUILD_TIMEOUT_SECONDS)
+    if result.returncode != 0:
+        raise EnvBuildError(f"'{' '.join(str(c) for c in cmd[:4])} ...' exited with code {result.returncode}.")
+
+
+def _installed_packages(python: Path) -> dict:
+    output = subprocess.run(
+        [str(python), "-m", "pip", "list", "--format=json", "--disable-pip-version-check"],
+        capture_output=True, text=True, check=True,
+    ).stdout
+    return {_canonical_name(p["name"]): p["version"] for p in json.loads(output)}
+
+
+def _build(env_dir: Path, requirements: list) -> None:
+    """
+    Creates the virtualenv in a temporary directory and renames it into place
+    once everything is installed, so a half-built env is never picked up
+    (also across processes). Commands always go through `python -m`, which
+    keeps working after the rename.
+    """
+    tmp_dir = ENV_POOL_DIR / f".{env_dir.name}.{os.getpid()}.{uuid.uuid4().hex[:6]}"
+    ENV_POOL_DIR.mkdir(parents=True, exist_ok=True)
+    print(f"Building virtualenv {env_dir.name} for: {', '.join(requirements) or '(no requirements)'}")
+    started = time.time()
+    try:
+        tmp_dir.mkdir()
+        with (tmp_dir / "build.log").open("w", encoding="utf-8") as log:
+            _run([sys.executable, "-m", "venv", str(tmp_dir)], log)
+            python = env_python(tmp_dir)
+            if ENV_UPGRADE_PIP:
+                _run([str(python), "-m", "pip", "install", "--upgrade", "pip", "--quiet"], log)
+            if requirements:
+                (tmp_dir / "requirements.txt").write_text("\n".join(requirements) + "\n", encoding="utf-8")
+                _run([str(python), "-m", "pip", "install", "-r", str(tmp_dir / "requirements.txt")], log)
+        metadata = {
+            "requirements": requirements,
+            "installed": _installed_packages(python),
+            "created_at": time.time(),
+            "build_seconds": round(time.time() - started, 1),
+        }
+        (tmp_dir / METADATA_FILE).write_text(json.dumps(metadata, indent=2), encoding="utf-8")
+        _touch(tmp_dir)
+        try:
+            os.rename(tmp_dir, env_dir)
+        except OSError:
+            # Another process finished the same env first; use theirs.
+            if _read_metadata(env_dir) is None:
+                raise
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    except (OSError, subprocess.SubprocessError, EnvBuildError, ValueError) as e:
+        with _stats_lock:
+            _stats["build_failures"] += 1
+        log_path = ENV_POOL_DIR / f"_{env_dir.name}.failed.log"
+        if (tmp_dir / "build.log").exists():
+            shutil.copyfile(tmp_dir / "build.log", log_path)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise EnvBuildError(f"Could not build virtualenv for {requirements}: {e} (log: {log_path})")
+    with _stats_lock:
+        _stats["builds"] += 1
+    print(f"Virtualenv {env_dir.name} ready in {time.time() - started:.0f}s.")
+
+
+def _ensure_playwright_browsers(env_dir: Path) -> None:
+    """
+    Runs `playwright install` once per Playwright version. Browsers live in
+    Playwright's shared cache, not in the env, so every env with the same
+    Playwright version reuses them.
+    """
+    version = (_read_metadata(env_dir) or {}).get("installed", {}).get("playwright")
+    if version is None:
+        return
+    marker = ENV_POOL_DIR / f"_playwright-{version}.installed"
+    with _lock_for(marker.name):
+        if marker.exists():
+            return
+        print(f"Installing Playwright {version} browsers...")
+        with (env_dir / "build.log").open("a", encoding="utf-8") as log:
+            _run([str(env_python(env_dir)), "-m", "playwright", "install"], log)
+        marker.touch()
+        with _stats_lock:
+            _stats["browser_installs"] += 1
+
+
+def _install_runtime(env_dir: Path) -> None:
+    """Puts RUNTIME_DIR (the aisa_runtime helpers) on the env's path with a .pth file."""
+    if sys.platform == "win32":
+        site_dirs = [env_dir / "Lib" / "site-packages"]
+    else:
+        site_dirs = list(env_dir.glob("lib/python*/site-packages"))
+    for site_dir in site_dirs:
+        pth = site_dir / RUNTIME_PTH_FILE
+        if not pth.exists() or pth.read_text(encoding="utf-8").strip() != str(RUNTIME_DIR):
+            pth.write_text(f"{RUNTIME_DIR}\n", encoding="utf-8")
+
+
+def _lock_for(key: str) -> threading.Lock:
+    with _build_locks_lock:
+        return _build_locks.setdefault(key, threading.Lock())
+
+
+def idle_envs() -> list:
+    """
+    Pooled environments not used within ENV_POOL_MIN_IDLE_SECONDS (so no
+    task can still be running in them), least recently used first.
+    """
+    now = time.time()
+    envs = sorted((env_dir for env_dir, _ in _ready_envs()), key=_last_used)
+    return [env_dir for env_dir in envs if now - _last_used(env_dir) >= ENV_POOL_MIN_IDLE_SECONDS]
+
+
+def remove_env(env_dir: Path) -> bool:
+    """Deletes one pooled environment. Returns False if it was already gone."""
+    with _lock_for(env_dir.name):
+        # Hide it from lookups before the (slow) delete.
+        doomed = ENV_POOL_DIR / f".evicting.{env_dir.name}.{uuid.uuid4().hex[:6]}"
+        try:
+            os.rename(env_dir, doomed)
+        except OSError:
+            return False
+    shutil.rmtree(doomed, ignore_errors=True)
+    with _stats_lock:
+        _stats["evicted"] += 1
+    return True
+
+
+def evict() -> int:
+    """
+    Deletes least recently used environments beyond ENV_POOL_MAX_ENVS.
+    Environments used within ENV_POOL_MIN_IDLE_SECONDS are never evicted,
+    since a task may still be running in them. Returns the number deleted.
+    """
+    overflow = len(_ready_envs()) - ENV_POOL_MAX_ENVS
+    evicted = 0
+    for env_dir in idle_envs():
+        if evicted >= overflow:
+            break
+        if remove_env(env_dir):
+            evicted += 1
+    return evicted
+
+
+def get_env(requirements_text: str, browsers: bool = False) -> Path:
+    """
+    Returns the python executable of a pooled virtualenv satisfying
+    `requirements_text`, building one if needed. Looks for an env built from
+    the same normalized requirements first, then for any env whose installed
+    packages already satisfy them. With `browsers`, also makes sure the
+    Playwright browsers for the env's Playwright version are installed.
+    Every env gets the aisa_runtime helpers on its path.
+    """
+    requirements = normalize_requirements(requirements_text)
+    env_dir = ENV_POOL_DIR / requirements_hash(requirements)
+
+    with _lock_for(env_dir.name):
+        if _read_metadata(env_dir) is not None:
+            stat = "hits"
+        else:
+            compatible = _find_compatible(requirements)
+            if compatible is not None:
+                env_dir, stat = compatible, "superset_hits"
+            else:
+                with telemetry.span("env.build", packages=len(requirements)):
+                    _build(env_dir, requirements)
+                stat = None
+        _touch(env_dir)
+        _install_runtime(env_dir)
+    if stat:
+        with _stats_lock:
+            _stats[stat] += 1
+    else:
+        evict()
+
+    if browsers:
+        with telemetry.span("env.browsers"):
+            _ensure_playwright_browsers(env_dir)
+    return env_python(env_dir)
+
+
+def prewarm() -> None:
+    """Builds the environments listed in ENV_PREWARM_SETS that do not exist yet."""
+    for package_set in ENV_PREWARM_SETS:
+        try:
+            get_env("\n".join(package_set), browsers="playwright" in (p.lower() for p in package_set))
+        except EnvBuildError as e:
+            print(f"Warning: could not pre-build virtualenv: {e}")
+
+
+def start_prewarm() -> None:
+    """Pre-builds the common environments on a background thread so startup is not delayed."""
+    if ENV_PREWARM_ENABLED and ENV_PREWARM_SETS:
+        threading.Thread(target=prewarm, name="env-prewarm", daemon=True).start()
+
+
+def get_stats() -> dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    envs = _ready_envs()
+    stats["envs"] = [
+        {
+            "id": env_dir.name,
+            "requirements": metadata.get("requirements", []),
+            "last_used": _last_used(env_dir),
+            "build_seconds": metadata.get("build_seconds"),
+        }
+        for env_dir, metadata in sorted(envs, key=lambda e: -_last_used(e[0]))
+    ]
+    stats["max_envs"] = ENV_POOL_MAX_ENVS
+    return stats
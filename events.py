@@ -0,0 +1,140 @@
+import time
+import asyncio
+import threading
+from collections import deque, OrderedDict
+
+from config import EVENTS_BUFFER_SIZE, EVENTS_HISTORY_SIZE, EVENTS_HISTORY_TOPICS
+
+_lock = threading.Lock()
+_subscribers = {}  # seq_no -> set of Subscription
+_history = OrderedDict()  # seq_no -> deque of recent events, least recently published first
+_next_id = {}
+_forward = None  # in a job queue process-pool worker: the queue relaying events to the parent
+
+
+class Subscription:
+    """
+    One consumer's bounded view of a task's events. Publishers may run on any
+    thread; the consumer awaits `get()` on the event loop it subscribed from.
+    When the buffer is full the oldest event is dropped, and the consumer is
+    told how many it missed with an "overflow" event.
+    """
+
+    def __init__(self, seq_no: str, loop: asyncio.AbstractEventLoop, maxsize: int):
+        self.seq_no = seq_no
+        self.maxsize = maxsize
+        self.dropped = 0
+        self._reported_dropped = 0
+        self._buffer = deque()
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+
+    def _push(self, event: dict) -> None:
+        # Called with the module lock held.
+        if len(self._buffer) >= self.maxsize:
+            self._buffer.popleft()
+            self.dropped += 1
+        self._buffer.append(event)
+        try:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        except RuntimeError:
+            pass  # The subscriber's loop is closed; it will be unsubscribed.
+
+    def _pop(self):
+        with _lock:
+            if self.dropped > self._reported_dropped:
+                missed, self._reported_dropped = self.dropped - self._reported_dropped, self.dropped
+                return {"id": None, "type": "overflow", "seq_no": self.seq_no, "time": time.time(),
+                        "data": {"dropped": missed}}
+            return self._buffer.popleft() if self._buffer else None
+
+    async def get(self, timeout: float = None):
+        """Returns the next event, or None if `timeout` seconds pass without one."""
+        while True:
+            event = self._pop()
+            if event is not None:
+                return event
+            self._wakeup.clear()
+            event = self._pop()
+            if event is not None:
+                return event
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+
+
+def forward_to(queue) -> None:
+    """
+    Called in job queue process-pool workers, whose subscribers live in the
+    parent: publish() then sends each event to `queue` for relay() to publish.
+    """
+    global _forward
+    _forward = queue
+
+
+def relay(queue) -> None:
+    """In the parent, publishes the events workers send through `queue` until it yields None."""
+    while True:
+        item = queue.get()
+        if item is None:
+            return
+        try:
+            publish(*item)
+        except Exception as e:
+            print(f"Event relay: could not publish {item[1]} for {item[0]}: {e}")
+
+
+def publish(seq_no: str, event_type: str, data: dict) -> None:
+    """Delivers an event to every current subscriber of the task and keeps it for replay."""
+    if _forward is not None:
+        _forward.put((seq_no, event_type, data))
+        return
+    with _lock:
+        event_id = _next_id.get(seq_no, 0) + 1
+        _next_id[seq_no] = event_id
+        event = {"id": event_id, "type": event_type, "seq_no": seq_no, "time": time.time(), "data": data}
+        history = _history.pop(seq_no, None) or deque(maxlen=EVENTS_HISTORY_SIZE)
+        history.append(event)
+        _history[seq_no] = history
+        while len(_history) > EVENTS_HISTORY_TOPICS:
+            evicted, _ = _history.popitem(last=False)
+            if evicted not in _subscribers:
+                _next_id.pop(evicted, None)
+        for subscription in _subscribers.get(seq_no, ()):
+            subscription._push(event)
+
+
+def subscribe(seq_no: str, last_event_id: int = None) -> Subscription:
+    """
+    Subscribes the calling event loop to a task's events. With
+    `last_event_id`, recent events after it are replayed first.
+    """
+    subscription = Subscription(seq_no, asyncio.get_running_loop(), EVENTS_BUFFER_SIZE)
+    with _lock:
+        if last_event_id is not None:
+            for event in _history.get(seq_no, ()):
+                if event["id"] > last_event_id:
+                    subscription._push(event)
+        _subscribers.setdefault(seq_no, set()).add(subscription)
+    return subscription
+
+
+def unsubscribe(subscription: Subscription) -> None:
+    with _lock:
+        subscribers = _subscribers.get(subscription.seq_no)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del _subscribers[subscription.seq_no]
+
+
+def get_stats() -> dict:
+    with _lock:
+        subscriptions = [s for subs in _subscribers.values() for s in subs]
+        return {
+            "subscribers": len(subscriptions),
+            "topics_with_subscribers": len(_subscribers),
+            "topics_with_history": len(_history),
+            "dropped": sum(s.dropped for s in subscriptions),
+        }
@@ -0,0 +1,221 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from config import BLOB_STORE_DIR, INGEST_CACHE_DIR, IMAGE_PHASH_INDEX_MAX_ENTRIES
+
+HASH_CHUNK_SIZE = 1024 * 1024
+PHASH_INDEX_FILE = INGEST_CACHE_DIR / "phash_index.jsonl"
+
+# In-memory copy of the perceptual-hash index (phash -> entry, oldest first),
+# reloaded when the file changes (other workers append to and compact it too).
+_phash_lock = threading.Lock()
+_phash_entries = OrderedDict()
+_phash_index_lines = 0
+_phash_index_stamp = None
+
+
+def hash_bytes(data: bytes) -> str:
+    """Returns the sha256 hex digest of a byte string."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path: Path) -> str:
+    """Returns the sha256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with Path(path).open("rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def blueprint_key(pdf_hash: str, instructions: str, platform: str) -> str:
+    """Cache key for a blueprint: the same PDF with the same instructions and platform."""
+    return hash_bytes("\0".join([pdf_hash, instructions.strip(), platform]).encode("utf-8"))
+
+
+def blob_path(digest: str, ext: str) -> Path:
+    """Location of a blob in the store, fanned out by the first two hex chars."""
+    return BLOB_STORE_DIR / digest[:2] / f"{digest}.{ext}"
+
+
+def _tmp_path(path: Path) -> Path:
+    # Unique per process and thread, so concurrent writers never share a temp file.
+    return path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    tmp_path = _tmp_path(path)
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+
+
+def link_blob(blob: Path, dest: Path) -> None:
+    """Places a blob at `dest` as a hardlink, falling back to a copy across filesystems."""
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = _tmp_path(dest)
+    try:
+        os.link(blob, tmp_path)
+    except OSError:
+        shutil.copyfile(blob, tmp_path)
+    os.replace(tmp_path, dest)
+
+
+def store_blob(data: bytes, ext: str) -> str:
+    """Stores bytes in the blob store (once) and returns their digest."""
+    digest = hash_bytes(data)
+    path = blob_path(digest, ext)
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        _write_atomic(path, data)
+    return digest
+
+
+def dedupe_file(path: Path, digest: str, ext: str) -> None:
+    """Moves a file into the blob store and leaves a hardlink to the stored copy in its place."""
+    blob = blob_path(digest, ext)
+    if not blob.exists():
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(path, blob)
+            return
+        except OSError:
+            shutil.copyfile(path, blob)
+    link_blob(blob, path)
+
+
+def _read_entry(path: Path):
+    if not path.exists():
+        return None
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Ignoring unreadable ingest cache entry {path.name}: {e}")
+        return None
+
+
+def _write_entry(path: Path, entry) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    _write_atomic(path, json.dumps(entry, indent=2).encode("utf-8"))
+
+
+def load_extraction(pdf_hash: str):
+    """
+    Returns the cached extraction for a PDF as
+    {"pages": [str], "images": [{"name", "blob", "ext"}], "aliases": {name: canonical_name}},
+    or None if the PDF has not been seen (or one of its blobs has gone missing).
+    """
+    entry = _read_entry(INGEST_CACHE_DIR / "extractions" / f"{pdf_hash}.json")
+    if entry is None or "pages" not in entry:
+        return None
+    if not all(blob_path(img["blob"], img["ext"]).exists() for img in entry["images"]):
+        return None
+    return entry
+
+
+def save_extraction(pdf_hash: str, pages: list, images: list, aliases: dict) -> None:
+    """Records the per-page text and images of a PDF. `images` entries must already be in the blob store."""
+    _write_entry(
+        INGEST_CACHE_DIR / "extractions" / f"{pdf_hash}.json",
+        {"pages": pages, "images": images, "aliases": aliases},
+    )
+
+
+def materialize_images(images: list, out_dir: Path) -> list:
+    """Hardlinks cached images into a task dir under their original names and returns their paths."""
+    image_paths = []
+    for img in images:
+        dest = out_dir / img["name"]
+        link_blob(blob_path(img["blob"], img["ext"]), dest)
+        image_paths.append(str(dest))
+    return image_paths
+
+
+def load_blueprint(key: str):
+    """Returns the cached blueprint for a blueprint_key(), or None."""
+    return _read_entry(INGEST_CACHE_DIR / "blueprints" / f"{key}.json")
+
+
+def save_blueprint(key: str, blueprint) -> None:
+    _write_entry(INGEST_CACHE_DIR / "blueprints" / f"{key}.json", blueprint)
+
+
+def _phash_index_file_stamp():
+    try:
+        st = PHASH_INDEX_FILE.stat()
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def _refresh_phash_index() -> None:
+    """Reloads the index if the file changed. Called with _phash_lock held."""
+    global _phash_entries, _phash_index_lines, _phash_index_stamp
+    stamp = _phash_index_file_stamp()
+    if stamp is None or stamp == _phash_index_stamp:
+        return
+    entries, lines = OrderedDict(), 0
+    with PHASH_INDEX_FILE.open("r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # A partially written line from a concurrent append.
+            lines += 1
+            entries.pop(entry["phash"], None)
+            entries[entry["phash"]] = entry
+    while len(entries) > IMAGE_PHASH_INDEX_MAX_ENTRIES:
+        entries.popitem(last=False)
+    _phash_entries, _phash_index_lines, _phash_index_stamp = entries, lines, stamp
+
+
+def _compact_phash_index() -> None:
+    """Rewrites the index file with only the entries kept in memory. Called with _phash_lock held."""
+    global _phash_index_lines, _phash_index_stamp
+    data = "".join(json.dumps(entry) + "\n" for entry in _phash_entries.values())
+    _write_atomic(PHASH_INDEX_FILE, data.encode("utf-8"))
+    _phash_index_lines, _phash_index_stamp = len(_phash_entries), _phash_index_file_stamp()
+
+
+def find_image(phash: str):
+    """
+    Returns {"phash", "blob", "ext"} for a previously stored image with
+    exactly this perceptual hash, or None. Near-identical images are only
+    merged within one document; across documents they may differ in what
+    matters (a screenshot's text, say), so only an identical hash is reused.
+    """
+    with _phash_lock:
+        _refresh_phash_index()
+        entry = _phash_entries.get(phash)
+    if entry is not None and blob_path(entry["blob"], entry["ext"]).exists():
+        return entry
+    return None
+
+
+def register_image_hash(phash: str, digest: str, ext: str) -> None:
+    """
+    Adds a stored image to the cross-document perceptual-hash index. The
+    file is compacted to the newest IMAGE_PHASH_INDEX_MAX_ENTRIES once it
+    holds twice that many lines.
+    """
+    global _phash_index_lines, _phash_index_stamp
+    entry = {"phash": phash, "blob": digest, "ext": ext}
+    with _phash_lock:
+        _refresh_phash_index()
+        if phash in _phash_entries:
+            return
+        PHASH_INDEX_FILE.parent.mkdir(parents=True, exist_ok=True)
+        with PHASH_INDEX_FILE.open("a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+        _phash_entries[phash] = entry
+        _phash_index_lines += 1
+        while len(_phash_entries) > IMAGE_PHASH_INDEX_MAX_ENTRIES:
+            _phash_entries.popitem(last=False)
+        if _phash_index_lines > 2 * IMAGE_PHASH_INDEX_MAX_ENTRIES:
+            _compact_phash_index()
+        else:
+            _phash_index_stamp = _phash_index_file_stamp()
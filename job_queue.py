@@ -0,0 +1,278 @@
+import time
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from pathlib import Path
+from fastapi import HTTPException
+
+from config import JOB_QUEUE_WORKERS, JOB_QUEUE_EXECUTOR
+from agents import agent_1
+
+import events
+import state_manager
+import telemetry
+from state_store import StateConflict
+
+# Stages we keep latency samples for. "queue_wait" is the time a job spent
+# waiting for a free worker; "total" covers Agent 1 + Agent 2.
+STAGES = ("queue_wait", "agent1", "agent2", "total")
+LATENCY_WINDOW = 500
+# Statuses of a task the previous server process left mid-pipeline.
+INTERRUPTED_STATUSES = ("processing", "blueprint_created")
+LIST_PAGE_SIZE = 1000
+
+_lock = threading.Lock()
+_executor = None
+_event_queue = None  # process executor only: workers' task events, relayed by events.relay()
+_stopped = False
+_in_flight = 0
+_completed = 0
+_failed = 0
+_latencies = {stage: deque(maxlen=LATENCY_WINDOW) for stage in STAGES}
+
+
+def run_pipeline(seq_no: str, pdf_path: Path, instructions: str, platform: str, timings: dict = None,
+                 extraction: dict = None) -> dict:
+    """
+    Runs Agent 1 -> Agent 2 for a task, moving its status through state_manager.
+    Per-stage durations (in seconds) are written into `timings` as they complete.
+    `extraction` is a PDF extraction shared by a batch (see agent_1.extract_pdf_content).
+    Returns the final task state.
+    """
+    # Agent 2 pulls in LangChain and the provider SDKs, so it is imported on
+    # first use (or by preload()) rather than when the server starts.
+    from agents import agent_2
+
+    timings = {} if timings is None else timings
+    task_dir = state_manager.get_task_dir(seq_no)
+    pipeline_start = time.perf_counter()
+
+    state = state_manager.update_task_state(seq_no, {"status": "processing"})
+    # Hashed while it was uploaded, so extraction need not read it again for that.
+    pdf_hash = (state.get("pdf") or {}).get("sha256")
+    try:
+        with telemetry.task(seq_no):
+            stage_start = time.perf_counter()
+            with telemetry.span("agent1", platform=platform):
+                blueprint = agent_1.run_agent1(
+                    seq_no, task_dir, pdf_path, instructions, platform, extraction, pdf_hash
+                )
+            timings["agent1"] = time.perf_counter() - stage_start
+            state_manager.update_task_state(seq_no, {"status": "blueprint_created"})
+
+            stage_start = time.perf_counter()
+            with telemetry.span("agent2", platform=platform):
+                artifacts = agent_2.run_agent2(seq_no, task_dir, blueprint)
+            timings["agent2"] = time.perf_counter() - stage_start
+    except Exception as e:
+        detail = e.detail if isinstance(e, HTTPException) else str(e)
+        timings.update(telemetry.summarize(telemetry.pop_task_spans(seq_no)))
+        state_manager.update_task_state(seq_no, {"status": "failed", "error": detail, "timings": timings})
+        raise
+
+    timings["total"] = time.perf_counter() - pipeline_start
+    # Per-stage breakdown (PDF extraction, each LLM and tool call) from the task's spans.
+    timings.update(telemetry.summarize(telemetry.pop_task_spans(seq_no)))
+    return state_manager.update_task_state(seq_no, {
+        "status": "ready",
+        "artifacts": artifacts,
+        "timings": timings,
+    })
+
+
+def _run_job(seq_no: str, pdf_path: Path, instructions: str, platform: str, enqueued_at: float,
+             extraction: dict = None) -> dict:
+    """Worker entry point. Never raises, so the outcome can be reported back from a process pool."""
+    timings = {"queue_wait": time.time() - enqueued_at}
+    telemetry.record("pipeline.queue_wait", timings["queue_wait"], seq_no=seq_no)
+    try:
+        run_pipeline(seq_no, pdf_path, instructions, platform, timings, extraction)
+        print(f"Task {seq_no} created successfully and is ready for execution.")
+        ok = True
+    except Exception as e:
+        print(f"[{seq_no}] Pipeline failed: {e}")
+        ok = False
+    # Empty unless this is a process-pool worker, whose spans the parent replays.
+    return {"ok": ok, "timings": timings, "spans": telemetry.drain_worker_spans()}
+
+
+def _on_job_done(future) -> None:
+    global _in_flight, _completed, _failed
+    if future.cancelled():
+        # Dropped by shutdown() before it started; recover() re-enqueues it on the next start.
+        with _lock:
+            _in_flight -= 1
+        return
+    try:
+        outcome = future.result()
+    except Exception as e:
+        # Only reachable if the worker itself died (e.g. a crashed process).
+        print(f"Job worker crashed: {e}")
+        outcome = {"ok": False, "timings": {}}
+    telemetry.replay(outcome.get("spans", []))
+
+    with _lock:
+        _in_flight -= 1
+        if outcome["ok"]:
+            _completed += 1
+        else:
+            _failed += 1
+        for stage, seconds in outcome["timings"].items():
+            if stage in _latencies:
+                _latencies[stage].append(seconds)
+
+
+def _init_worker(event_queue) -> None:
+    """Process-pool worker initializer: spans and task events go back to the parent."""
+    telemetry.mark_worker_process()
+    events.forward_to(event_queue)
+
+
+def start() -> None:
+    """Creates the worker pool. Called once on server startup."""
+    global _executor, _event_queue
+    if _executor is not None:
+        return
+    if JOB_QUEUE_EXECUTOR == "process":
+        # State changes made in a worker are published to SSE/WebSocket subscribers here, live.
+        _event_queue = multiprocessing.Queue()
+        threading.Thread(target=events.relay, args=(_event_queue,), name="aisa-event-relay", daemon=True).start()
+        _executor = ProcessPoolExecutor(
+            max_workers=JOB_QUEUE_WORKERS, initializer=_init_worker, initargs=(_event_queue,),
+        )
+    else:
+        _executor = ThreadPoolExecutor(max_workers=JOB_QUEUE_WORKERS, thread_name_prefix="aisa-job")
+    print(f"Job queue started with {JOB_QUEUE_WORKERS} {JOB_QUEUE_EXECUTOR} worker(s).")
+
+
+def preload() -> None:
+    """Imports the heavy pipeline modules (LangChain, provider SDKs, PyMuPDF) ahead of the first task."""
+    started = time.perf_counter()
+    try:
+        import fitz  # noqa: F401
+        from agents import agent_2  # noqa: F401
+    except ImportError as e:
+        print(f"Warning: could not preload the pipeline modules: {e}")
+        return
+    print(f"Pipeline modules preloaded in {time.perf_counter() - started:.1f}s.")
+
+
+def start_preload() -> None:
+    """Runs preload() on a background thread so it never delays startup."""
+    threading.Thread(target=preload, name="aisa-preload", daemon=True).start()
+
+
+def shutdown() -> None:
+    """
+    Stops accepting jobs and cancels the ones that have not started, without
+    waiting for the running ones. Cancelled tasks stay "queued" until
+    recover() runs on the next start.
+    """
+    global _executor, _event_queue, _stopped
+    _stopped = True
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+    if _event_queue is not None:
+        _event_queue.put(None)
+        _event_queue = None
+
+
+def _tasks_in(status: str) -> list:
+    seq_nos, offset = [], 0
+    while True:
+        page = state_manager.list_tasks(status=status, limit=LIST_PAGE_SIZE, offset=offset)
+        seq_nos += [summary["seq_no"] for summary in page]
+        if len(page) < LIST_PAGE_SIZE:
+            return seq_nos
+        offset += LIST_PAGE_SIZE
+
+
+def recover(requeue: bool = True) -> dict:
+    """
+    Called once on startup, before new tasks arrive. Tasks still "queued"
+    (including batch tasks) lost their job when the previous server stopped,
+    and are enqueued again, or marked failed with `requeue=False` (when the
+    job queue is off). Tasks it left "processing" or "blueprint_created" were
+    cut off mid-pipeline and are marked failed. Returns the counts.
+    """
+    requeued, failed = 0, 0
+    # Interrupted tasks first, so re-enqueued ones that start right away are not mistaken for them.
+    for status in INTERRUPTED_STATUSES:
+        for seq_no in _tasks_in(status):
+            try:
+                state_manager.transition_task_state(seq_no, INTERRUPTED_STATUSES, {
+                    "status": "failed", "error": "The server stopped while the pipeline was running.",
+                })
+                failed += 1
+            except (StateConflict, FileNotFoundError):
+                pass
+    for seq_no in reversed(_tasks_in("queued")):  # oldest first
+        state = state_manager.get_task_state(seq_no)
+        pdf_path = state_manager.get_task_dir(seq_no) / "input.pdf"
+        if not state or state.get("status") != "queued":
+            continue
+        if not requeue or not pdf_path.exists():
+            error = "The task's PDF is missing." if requeue else "The server restarted before the task ran."
+            try:
+                state_manager.transition_task_state(seq_no, ("queued",), {"status": "failed", "error": error})
+                failed += 1
+            except (StateConflict, FileNotFoundError):
+                pass
+            continue
+        submit(seq_no, pdf_path, state["instructions"], state["platform"])
+        requeued += 1
+    if requeued or failed:
+        print(f"Job queue recovery: re-enqueued {requeued} queued tasks, failed {failed} others.")
+    return {"requeued": requeued, "failed": failed}
+
+
+def submit(seq_no: str, pdf_path: Path, instructions: str, platform: str, extraction: dict = None,
+           on_done=None) -> None:
+    """
+    Enqueues the agent pipeline for a task whose PDF is already on disk.
+    `extraction` is a batch's shared PDF extraction; `on_done(future)` is
+    called once the job has finished or been cancelled. Raises RuntimeError
+    after shutdown().
+    """
+    global _in_flight
+    if _stopped:
+        raise RuntimeError("The job queue has been shut down.")
+    if _executor is None:
+        start()
+    with _lock:
+        _in_flight += 1
+    future = _executor.submit(_run_job, seq_no, pdf_path, instructions, platform, time.time(), extraction)
+    future.add_done_callback(_on_job_done)
+    if on_done is not None:
+        future.add_done_callback(on_done)
+
+
+def _summarize(samples) -> dict:
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+    last = len(ordered) - 1
+    return {
+        "count": len(ordered),
+        "mean": sum(ordered) / len(ordered),
+        "p50": ordered[int(last * 0.50)],
+        "p95": ordered[int(last * 0.95)],
+        "max": ordered[-1],
+    }
+
+
+def get_stats() -> dict:
+    """Returns pool size, queue depth and per-stage latency over the last LATENCY_WINDOW jobs."""
+    with _lock:
+        running = min(_in_flight, JOB_QUEUE_WORKERS)
+        return {
+            "executor": JOB_QUEUE_EXECUTOR,
+            "workers": JOB_QUEUE_WORKERS,
+            "running": running,
+            "queue_depth": _in_flight - running,
+            "completed": _completed,
+            "failed": _failed,
+            "latency_seconds": {stage: _summarize(_latencies[stage]) for stage in STAGES},
+        }
@@ -0,0 +1,142 @@
+import io
+import json
+
+
+class StreamingJSONError(ValueError):
+    """Raised when streamed LLM output cannot be (or can no longer become) the expected JSON."""
+
+
+class IncrementalJSONParser:
+    """
+    Consumes an LLM completion chunk by chunk and reports pieces of the JSON
+    payload as soon as they are complete, instead of waiting for the whole
+    response.
+
+    The payload must be an object: text before the first '{' (brackets and
+    quotes included) and after its matching '}' is ignored, like
+    extract_json_from_response. `on_field(key, value)` fires as each
+    top-level field completes, and `on_item(key, index, value)` for each
+    element of a top-level field whose value is an array. Callbacks may raise
+    to abort the stream early.
+    """
+
+    def __init__(self, on_field=None, on_item=None):
+        self.on_field = on_field
+        self.on_item = on_item
+        self.done = False
+        self._buffer = io.StringIO(newline="")  # Everything fed so far; pieces are read back by offset.
+        self._pos = 0
+        self._stack = []
+        self._root_start = None
+        self._end = None
+        self._in_string = False
+        self._escape = False
+        self._key_start = None
+        self._key = None
+        self._awaiting_value = False
+        self._value_start = None
+        self._array_depth = None
+        self._item_start = None
+        self._item_index = 0
+
+    @property
+    def text(self) -> str:
+        """Everything fed so far."""
+        return self._buffer.getvalue()
+
+    def _slice(self, start: int, end: int) -> str:
+        self._buffer.seek(start)
+        return self._buffer.read(end - start)
+
+    def _load(self, raw: str, what: str):
+        try:
+            return json.loads(raw)
+        except json.JSONDecodeError as e:
+            raise StreamingJSONError(f"Malformed JSON in {what}: {e}")
+
+    def _end_field(self, pos: int) -> None:
+        if self._value_start is None:
+            return
+        value = self._load(self._slice(self._value_start, pos), f"field '{self._key}'")
+        self._value_start, self._awaiting_value = None, False
+        if self.on_field:
+            self.on_field(self._key, value)
+        self._key = None
+
+    def _end_item(self, pos: int) -> None:
+        if self._item_start is None:
+            return
+        value = self._load(self._slice(self._item_start, pos), f"item {self._item_index} of '{self._key}'")
+        self._item_start = None
+        if self.on_item:
+            self.on_item(self._key, self._item_index, value)
+        self._item_index += 1
+
+    def _feed_char(self, ch: str, pos: int) -> None:
+        if self._root_start is None:
+            if ch == "{":
+                self._root_start = pos
+                self._stack.append(ch)
+            return
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif ch == "\\":
+                self._escape = True
+            elif ch == '"':
+                self._in_string = False
+                if self._key_start is not None:
+                    self._key = self._load(self._slice(self._key_start, pos + 1), "a key")
+                    self._key_start = None
+            return
+        if ch.isspace():
+            return
+
+        depth = len(self._stack)
+        starts_value = self._awaiting_value and depth == 1
+        if starts_value:
+            self._awaiting_value, self._value_start = False, pos
+        elif depth == self._array_depth and self._item_start is None and ch not in ",]":
+            self._item_start = pos
+
+        if ch == '"':
+            self._in_string = True
+            if depth == 1 and self._value_start is None:
+                self._key_start = pos
+        elif ch in "{[":
+            self._stack.append(ch)
+            if starts_value and ch == "[":
+                self._array_depth, self._item_index = 2, 0
+        elif ch in "}]":
+            if ch == "]" and depth == self._array_depth:
+                self._end_item(pos)
+                self._array_depth = None
+            if depth == 1:
+                self._end_field(pos)
+            self._stack.pop()
+            if not self._stack:
+                self.done, self._end = True, pos + 1
+        elif ch == ",":
+            if depth == self._array_depth:
+                self._end_item(pos)
+            elif depth == 1:
+                self._end_field(pos)
+        elif ch == ":" and depth == 1:
+            self._awaiting_value = True
+
+    def feed(self, chunk: str) -> None:
+        """Processes the next piece of the completion."""
+        self._buffer.seek(0, io.SEEK_END)
+        self._buffer.write(chunk)
+        for ch in chunk:
+            if self.done:
+                break
+            self._feed_char(ch, self._pos)
+            self._pos += 1
+
+    def close(self):
+        """Returns the complete parsed payload, or raises if the stream ended early."""
+        if not self.done:
+            what = "no JSON object" if self._root_start is None else "an incomplete JSON object"
+            raise StreamingJSONError(f"LLM response ended with {what}.")
+        return self._load(self._slice(self._root_start, self._end), "the response")
@@ -0,0 +1,117 @@
+import time
+import sqlite3
+import hashlib
+import threading
+
+from config import LLM_CACHE_ENABLED, LLM_CACHE_PATH, LLM_CACHE_TTL_SECONDS, LLM_CACHE_MAX_ENTRIES
+
+_lock = threading.Lock()
+_conn = None
+_stats = {"hits": 0, "misses": 0, "writes": 0, "expired": 0, "evicted": 0}
+
+
+def _get_conn() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        LLM_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        _conn = sqlite3.connect(str(LLM_CACHE_PATH), check_same_thread=False, timeout=30)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, provider TEXT, model TEXT, response TEXT,"
+            " created_at REAL, last_access REAL)"
+        )
+        _conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        _conn.commit()
+    return _conn
+
+
+def make_key(provider: str, model: str, system_prompt: str, prompt: str) -> str:
+    """Cache key: (provider, model, sha256(system_prompt), sha256(prompt))."""
+    system_hash = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()
+    prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    return f"{provider}:{model}:{system_hash}:{prompt_hash}"
+
+
+def get(provider: str, model: str, system_prompt: str, prompt: str):
+    """Returns the cached response text, or None on a miss or expiry."""
+    if not LLM_CACHE_ENABLED:
+        return None
+
+    key = make_key(provider, model, system_prompt, prompt)
+    now = time.time()
+    with _lock:
+        conn = _get_conn()
+        row = conn.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            _stats["misses"] += 1
+            return None
+        response, created_at = row
+        if now - created_at > LLM_CACHE_TTL_SECONDS:
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            conn.commit()
+            _stats["expired"] += 1
+            _stats["misses"] += 1
+            return None
+        conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+        conn.commit()
+        _stats["hits"] += 1
+        return response
+
+
+def put(provider: str, model: str, system_prompt: str, prompt: str, response: str) -> None:
+    """Stores a response and evicts the least recently used entries beyond LLM_CACHE_MAX_ENTRIES."""
+    if not LLM_CACHE_ENABLED:
+        return
+    key = make_key(provider, model, system_prompt, prompt)
+    now = time.time()
+    with _lock:
+        conn = _get_conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO responses (key, provider, model, response, created_at, last_access)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (key, provider, model, response, now, now),
+        )
+        overflow = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0] - LLM_CACHE_MAX_ENTRIES
+        if overflow > 0:
+            conn.execute(
+                "DELETE FROM responses WHERE key IN"
+                " (SELECT key FROM responses ORDER BY last_access ASC LIMIT ?)",
+                (overflow,),
+            )
+            _stats["evicted"] += overflow
+        conn.commit()
+        _stats["writes"] += 1
+
+
+def delete(provider: str, model: str, system_prompt: str, prompt: str) -> None:
+    """Drops one entry, e.g. a cached response that turned out to be unusable."""
+    if not LLM_CACHE_ENABLED:
+        return
+    key = make_key(provider, model, system_prompt, prompt)
+    with _lock:
+        conn = _get_conn()
+        conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+        conn.commit()
+
+
+def clear() -> None:
+    """Deletes every cached response."""
+    if not LLM_CACHE_ENABLED:
+        return
+    with _lock:
+        conn = _get_conn()
+        conn.execute("DELETE FROM responses")
+        conn.commit()
+
+
+def get_stats() -> dict:
+    """Hit/miss counters for this process plus the current size of the store."""
+    with _lock:
+        stats = dict(_stats)
+        stats["enabled"] = LLM_CACHE_ENABLED
+        if LLM_CACHE_ENABLED:
+            stats["entries"] = _get_conn().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
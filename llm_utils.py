@@ -1,44 +1,335 @@
 import re
 import json
+import time
+import asyncio
+import threading
+import contextvars
+from collections import deque
 from fastapi import HTTPException
-from config import anthropic_client, groq_client
+from config import (
+    get_anthropic_client, get_groq_client, get_async_anthropic_client, get_async_groq_client,
+    GROQ_TIMEOUT_SECONDS, ANTHROPIC_TIMEOUT_SECONDS,
+    LLM_HEDGING_ENABLED, LLM_HEDGE_DEFAULT_DELAY_SECONDS,
+)
+from json_stream import IncrementalJSONParser
+import llm_cache
+import provider_guard
+import telemetry
 
-def get_llm_response(prompt: str, system_prompt: str) -> str:
+GROQ_MODEL = "openai/gpt-oss-20b"
+ANTHROPIC_MODEL = "claude-3-haiku-20240307"
+
+def _record_usage(span: dict, usage) -> None:
+    """Copies the token counts of a Groq (OpenAI-style) or Anthropic usage object onto an llm.call span."""
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_tokens", None) or getattr(usage, "input_tokens", None)
+    completion_tokens = getattr(usage, "completion_tokens", None) or getattr(usage, "output_tokens", None)
+    if prompt_tokens is not None:
+        span["prompt_tokens"] = prompt_tokens
+    if completion_tokens is not None:
+        span["completion_tokens"] = completion_tokens
+
+def _cached_response(candidates, system_prompt: str, prompt: str, validate=None):
+    """
+    The first cached response of the (provider, model) `candidates`, or None.
+    A cached response that fails `validate` is dropped from the cache.
     """
-    Gets a response from an LLM, trying Groq first and falling back to Anthropic.
+    for provider, model in candidates:
+        cached = llm_cache.get(provider, model, system_prompt, prompt)
+        if cached is None:
+            continue
+        if validate is not None:
+            try:
+                validate(cached)
+            except Exception as e:
+                print(f"--- Dropping invalid cached LLM response ({provider}): {e} ---")
+                llm_cache.delete(provider, model, system_prompt, prompt)
+                continue
+        print(f"--- LLM cache hit ({provider}) ---")
+        return cached
+    return None
+
+def _cache_response(provider: str, model: str, system_prompt: str, prompt: str, response_text: str, validate=None) -> None:
+    """Caches a fresh response, but only once it passes `validate` (which raises if it does not)."""
+    if validate is not None:
+        validate(response_text)
+    llm_cache.put(provider, model, system_prompt, prompt, response_text)
+
+# --- Streaming ---
+
+def _stream_completion(prompt: str, system_prompt: str, use_cache: bool, source: dict):
     """
+    Yields the completion text chunk by chunk, trying Groq first and falling
+    back to Anthropic. A fallback is only possible before the first chunk has
+    been yielded. Nothing is cached here: `source` is filled in with the
+    "provider" and "model" that answered and whether the text came from the
+    cache ("cached"), for the caller to cache or invalidate it once checked.
+    """
+    groq_client, anthropic_client = get_groq_client(), get_anthropic_client()
+    if use_cache:
+        for provider, model, client in (("groq", GROQ_MODEL, groq_client), ("anthropic", ANTHROPIC_MODEL, anthropic_client)):
+            cached = llm_cache.get(provider, model, system_prompt, prompt) if client else None
+            if cached is not None:
+                print(f"--- LLM cache hit ({provider}) ---")
+                source.update({"provider": provider, "model": model, "cached": True})
+                yield cached
+                return
+
+    chunks = []
     # Priority 1: Groq
     if groq_client:
         try:
-            print("--- Calling Groq API (Primary) ---")
-            chat_completion = groq_client.chat.completions.create(
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": prompt}
-                ],
-                model="openai/gpt-oss-20b",
-            )
-            return chat_completion.choices[0].message.content
+            print("--- Streaming from Groq API (Primary) ---")
+            source.update({"provider": "groq", "model": GROQ_MODEL, "cached": False})
+            with provider_guard.get_guard("groq").guarded() as call, \
+                    telemetry.span("llm.call", provider="groq", model=GROQ_MODEL, stream=True) as span:
+                raw = groq_client.chat.completions.with_raw_response.create(
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": prompt}
+                    ],
+                    model=GROQ_MODEL,
+                    stream=True,
+                )
+                call["headers"] = raw.headers
+                for chunk in raw.parse():
+                    text = chunk.choices[0].delta.content if chunk.choices else None
+                    if text:
+                        chunks.append(text)
+                        yield text
+                    # Groq reports usage on the last chunk of a stream.
+                    _record_usage(span, getattr(getattr(chunk, "x_groq", None), "usage", None))
+            return
         except Exception as e:
+            if chunks:
+                raise HTTPException(status_code=500, detail=f"Groq stream failed mid-response: {e}")
             print(f"Groq API failed: {e}. Falling back to Anthropic.")
 
     # Priority 2: Anthropic (Fallback)
     if anthropic_client:
         try:
-            print("--- Calling Anthropic API (Fallback) ---")
-            message = anthropic_client.messages.create(
-                model="claude-3-haiku-20240307",
-                max_tokens=4096,
-                system=system_prompt,
-                messages=[{"role": "user", "content": prompt}]
-            )
-            return message.content[0].text
+            print("--- Streaming from Anthropic API (Fallback) ---")
+            source.update({"provider": "anthropic", "model": ANTHROPIC_MODEL, "cached": False})
+            with provider_guard.get_guard("anthropic").guarded() as call, \
+                    telemetry.span("llm.call", provider="anthropic", model=ANTHROPIC_MODEL, stream=True) as span, \
+                    anthropic_client.messages.stream(
+                        model=ANTHROPIC_MODEL,
+                        max_tokens=4096,
+                        system=system_prompt,
+                        messages=[{"role": "user", "content": prompt}]
+                    ) as stream:
+                call["headers"] = stream.response.headers
+                for text in stream.text_stream:
+                    chunks.append(text)
+                    yield text
+                _record_usage(span, stream.get_final_message().usage)
+            return
         except Exception as e:
             print(f"Anthropic API also failed: {e}")
             raise HTTPException(status_code=500, detail="Both LLM providers failed.")
 
     raise HTTPException(status_code=500, detail="No LLM providers are configured.")
 
+def get_llm_json_streaming(prompt: str, system_prompt: str, on_field=None, on_item=None, use_cache: bool = True):
+    """
+    Streams a completion through an IncrementalJSONParser so the caller can
+    validate fields and array items as they arrive (see json_stream). If a
+    callback raises, the stream is closed right away. The completion is only
+    cached once it has parsed and passed every callback; a cached completion
+    that fails either is dropped from the cache.
+    Returns (parsed_json, response_text).
+    """
+    parser = IncrementalJSONParser(on_field, on_item)
+    source = {}
+    stream = _stream_completion(prompt, system_prompt, use_cache, source)
+    try:
+        try:
+            for text in stream:
+                parser.feed(text)
+        finally:
+            stream.close()
+        parsed = parser.close()
+    except Exception:
+        if source.get("cached"):
+            llm_cache.delete(source["provider"], source["model"], system_prompt, prompt)
+        raise
+    if not source["cached"]:
+        llm_cache.put(source["provider"], source["model"], system_prompt, prompt, parser.text)
+    return parsed, parser.text
+
+# --- Async client layer ---
+
+# Minimum latency samples before a provider's p95 is trusted as the hedge deadline.
+HEDGE_MIN_SAMPLES = 20
+
+class AsyncProvider:
+    """
+    An async completion backend for get_llm_response_async. `complete` is a
+    coroutine function taking (prompt, system_prompt) and returning the text,
+    or (text, response_headers[, usage]) so the rate limiter can follow the
+    provider's limits and the call's span gets its token counts. Tests can
+    pass local stubs to set_async_providers().
+    """
+
+    def __init__(self, name: str, model: str, complete, timeout: float):
+        self.name = name
+        self.model = model
+        self.complete = complete
+        self.timeout = timeout
+        self.latencies = deque(maxlen=200)
+
+    def hedge_delay(self) -> float:
+        """Seconds to wait for this provider before hedging: its recent p95 latency."""
+        if len(self.latencies) < HEDGE_MIN_SAMPLES:
+            return LLM_HEDGE_DEFAULT_DELAY_SECONDS
+        ordered = sorted(self.latencies)
+        return ordered[int((len(ordered) - 1) * 0.95)]
+
+async def _groq_complete(prompt: str, system_prompt: str) -> tuple:
+    raw = await get_async_groq_client().chat.completions.with_raw_response.create(
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ],
+        model=GROQ_MODEL,
+    )
+    response = raw.parse()
+    return response.choices[0].message.content, raw.headers, response.usage
+
+async def _anthropic_complete(prompt: str, system_prompt: str) -> tuple:
+    raw = await get_async_anthropic_client().messages.with_raw_response.create(
+        model=ANTHROPIC_MODEL,
+        max_tokens=4096,
+        system=system_prompt,
+        messages=[{"role": "user", "content": prompt}]
+    )
+    response = raw.parse()
+    return response.content[0].text, raw.headers, response.usage
+
+def _default_async_providers() -> list:
+    providers = []
+    if get_async_groq_client():
+        providers.append(AsyncProvider("groq", GROQ_MODEL, _groq_complete, GROQ_TIMEOUT_SECONDS))
+    if get_async_anthropic_client():
+        providers.append(AsyncProvider("anthropic", ANTHROPIC_MODEL, _anthropic_complete, ANTHROPIC_TIMEOUT_SECONDS))
+    return providers
+
+_async_providers = None
+
+def get_async_providers() -> list:
+    """Async providers in priority order (Groq first, then Anthropic, unless overridden)."""
+    global _async_providers
+    if _async_providers is None:
+        _async_providers = _default_async_providers()
+    return _async_providers
+
+def set_async_providers(providers: list = None) -> None:
+    """Replaces the async providers (e.g. with local stubs); None restores the configured SDK clients."""
+    global _async_providers
+    _async_providers = providers
+
+# The async SDK clients keep pooled connections that belong to the loop they
+# were first used on, so every async LLM call in a process runs on this one
+# long-lived loop (started on first use) and pipeline threads block on it.
+_loop = None
+_loop_lock = threading.Lock()
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="aisa-llm-loop", daemon=True).start()
+        return _loop
+
+async def _in_context(coro, context):
+    # Carries the caller's trace context (see telemetry.bind) onto the loop.
+    for var, value in context.items():
+        var.set(value)
+    return await coro
+
+def run_async(coro):
+    """Runs a coroutine on the shared LLM event loop and blocks the calling (non-loop) thread for its result."""
+    future = asyncio.run_coroutine_threadsafe(_in_context(coro, contextvars.copy_context()), _get_loop())
+    try:
+        return future.result()
+    except BaseException:
+        future.cancel()
+        raise
+
+async def _call_provider(provider: AsyncProvider, prompt: str, system_prompt: str, validate=None) -> str:
+    async with provider_guard.get_guard(provider.name).guarded_async() as call:
+        with telemetry.span("llm.call", provider=provider.name, model=provider.model) as span:
+            started = time.perf_counter()
+            result = await asyncio.wait_for(provider.complete(prompt, system_prompt), provider.timeout)
+            provider.latencies.append(time.perf_counter() - started)
+            result = result if isinstance(result, tuple) else (result,)
+            response_text = result[0]
+            call["headers"] = result[1] if len(result) > 1 else None
+            _record_usage(span, result[2] if len(result) > 2 else None)
+    _cache_response(provider.name, provider.model, system_prompt, prompt, response_text, validate)
+    return response_text
+
+async def _hedged_call(primary: AsyncProvider, secondary: AsyncProvider, prompt: str, system_prompt: str,
+                       validate=None) -> str:
+    """
+    Sends to `primary`; if it has not answered within its hedge deadline (or
+    fails first), also sends to `secondary`. Returns the first successful
+    reply and cancels whichever request is still running.
+    """
+    pending = {asyncio.create_task(_call_provider(primary, prompt, system_prompt, validate)): primary}
+    hedged = False
+    try:
+        done, _ = await asyncio.wait(pending, timeout=primary.hedge_delay())
+        while True:
+            for task in done:
+                provider = pending.pop(task)
+                if task.exception() is None:
+                    print(f"--- Hedged LLM call answered by {provider.name} ---")
+                    return task.result()
+                print(f"{provider.name} API failed: {task.exception()}")
+            if not hedged:
+                print(f"--- Hedging LLM call to {secondary.name} ---")
+                pending[asyncio.create_task(_call_provider(secondary, prompt, system_prompt, validate))] = secondary
+                hedged = True
+            if not pending:
+                raise HTTPException(status_code=500, detail="Both LLM providers failed.")
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def get_llm_response_async(prompt: str, system_prompt: str, use_cache: bool = True, hedge: bool = None,
+                                 validate=None) -> str:
+    """
+    Gets a complete response through the async SDK clients (pipeline
+    threads call it through run_async). Without hedging, providers are tried in priority order. With hedging
+    (default from AISA_LLM_HEDGING_ENABLED), the first two providers race as
+    described in _hedged_call. A reply rejected by `validate` counts as that
+    provider failing and is not cached.
+    """
+    providers = get_async_providers()
+    if not providers:
+        raise HTTPException(status_code=500, detail="No LLM providers are configured.")
+
+    if use_cache:
+        cached = _cached_response([(p.name, p.model) for p in providers], system_prompt, prompt, validate)
+        if cached is not None:
+            return cached
+
+    hedge = LLM_HEDGING_ENABLED if hedge is None else hedge
+    if hedge and len(providers) > 1:
+        return await _hedged_call(providers[0], providers[1], prompt, system_prompt, validate)
+
+    for provider in providers:
+        try:
+            print(f"--- Calling {provider.name} API (async) ---")
+            return await _call_provider(provider, prompt, system_prompt, validate)
+        except Exception as e:
+            print(f"{provider.name} API failed: {e}")
+    raise HTTPException(status_code=500, detail="All LLM providers failed.")
+
 def extract_json_from_response(text: str) -> dict:
     """
     Extracts JSON content robustly from an LLM response by finding the
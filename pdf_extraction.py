@@ -0,0 +1,151 @@
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from config import PDF_EXTRACT_WORKERS, PDF_PAGES_PER_RANGE
+
+_pool_lock = threading.Lock()
+_pool = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    """Returns the shared extraction process pool, creating it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=PDF_EXTRACT_WORKERS)
+        return _pool
+
+
+# Size of the grey thumbnail a perceptual hash is computed from (4x4 pixels per dHash cell).
+PHASH_THUMBNAIL_SIZE = (36, 32)
+
+
+def perceptual_hash(page, bbox):
+    """
+    Returns a 64-bit difference hash (dHash) of the image shown at `bbox` on
+    `page` as 16 hex chars, or None if it cannot be rendered. Only a small
+    grey thumbnail of that area is rendered, which lets MuPDF decode large
+    images at reduced resolution instead of in full. The thumbnail is reduced
+    to a 9x8 grid of mean grey levels and each bit records whether a cell is
+    brighter than its right-hand neighbour, so re-encoded or rescaled copies
+    of the same screenshot hash alike.
+    """
+    import fitz  # PyMuPDF; imported on first use to keep it off the server's startup path
+
+    try:
+        rect = fitz.Rect(bbox)
+        if rect.is_empty:
+            return None
+        thumb_width, thumb_height = PHASH_THUMBNAIL_SIZE
+        matrix = fitz.Matrix(thumb_width / rect.width, thumb_height / rect.height)
+        pix = page.get_pixmap(matrix=matrix, clip=rect, colorspace=fitz.csGRAY, alpha=False)
+    except Exception:
+        return None
+
+    width, height = pix.width, pix.height
+    if width < 9 or height < 8:
+        return None
+    samples, stride = pix.samples, pix.stride
+
+    # Average (at most) 4x4 thumbnail pixels per cell.
+    cells = []
+    for row in range(8):
+        y0, y1 = row * height // 8, (row + 1) * height // 8
+        ys = range(y0, y1, max(1, (y1 - y0) // 4))
+        for col in range(9):
+            x0, x1 = col * width // 9, (col + 1) * width // 9
+            xs = range(x0, x1, max(1, (x1 - x0) // 4))
+            values = [samples[y * stride + x] for y in ys for x in xs]
+            cells.append(sum(values) / len(values))
+
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (cells[row * 9 + col] > cells[row * 9 + col + 1])
+    return f"{bits:016x}"
+
+
+def extract_page_range(pdf_path: str, start: int, stop: int, xref_owners: dict = None,
+                       hash_images: bool = False) -> list:
+    """
+    Extracts text and images for pages [start, stop) of a PDF. Each call opens
+    its own fitz document, so it is safe to run in a separate process.
+
+    An image is only extracted on the page that owns its xref (its first page
+    in the document, per `xref_owners`); repeats are returned without "bytes"
+    so the caller can point them at the first copy. With `hash_images`,
+    extracted images carry a "phash" (None otherwise or if it cannot be computed).
+    """
+    import fitz
+
+    pages = []
+    doc = fitz.open(pdf_path)
+    try:
+        for page_num in range(start, stop):
+            page = doc[page_num]
+            images, decoded = [], set()
+            bboxes = {}
+            if hash_images:
+                bboxes = {info["xref"]: info["bbox"] for info in page.get_image_info(xrefs=True) if info["xref"]}
+            for img_index, img in enumerate(page.get_images(full=True)):
+                xref = img[0]
+                owner = xref_owners.get(xref, page_num) if xref_owners else page_num
+                if owner != page_num or xref in decoded:
+                    images.append({"index": img_index, "xref": xref})
+                    continue
+                decoded.add(xref)
+                base_image = doc.extract_image(xref)
+                images.append({
+                    "index": img_index,
+                    "xref": xref,
+                    "bytes": base_image["image"],
+                    "ext": base_image["ext"],
+                    "phash": perceptual_hash(page, bboxes[xref]) if xref in bboxes else None,
+                })
+            pages.append({"page_num": page_num, "text": page.get_text(), "images": images})
+    finally:
+        doc.close()
+    return pages
+
+
+def iter_pages(pdf_path: Path, hash_images: bool = False):
+    """
+    Yields one dict per page, in page order: {"page_num", "text", "images"}.
+    Each image carries its "xref"; only the first occurrence of an xref in the
+    document carries "bytes", "ext" and "phash" (see extract_page_range).
+
+    Documents longer than one range are split into PDF_PAGES_PER_RANGE-page
+    ranges that are parsed concurrently in the process pool. Pages are yielded
+    as soon as their range (and every range before it) is done, so callers can
+    start working before the last page has been parsed.
+    """
+    import fitz
+
+    # Reading the image lists does not decode anything, so working out which
+    # page owns each xref up front is cheap and lets every range skip repeats.
+    xref_owners = {}
+    with fitz.open(pdf_path) as doc:
+        page_count = doc.page_count
+        for page_num in range(page_count):
+            for img in doc.get_page_images(page_num, full=True):
+                xref_owners.setdefault(img[0], page_num)
+
+    ranges = [(start, min(start + PDF_PAGES_PER_RANGE, page_count)) for start in range(0, page_count, PDF_PAGES_PER_RANGE)]
+    if len(ranges) <= 1 or PDF_EXTRACT_WORKERS <= 1:
+        for start, stop in ranges:
+            yield from extract_page_range(str(pdf_path), start, stop, xref_owners, hash_images)
+        return
+
+    pool = _get_pool()
+    futures = [
+        pool.submit(extract_page_range, str(pdf_path), start, stop, xref_owners, hash_images)
+        for start, stop in ranges
+    ]
+    try:
+        for future in futures:
+            yield from future.result()
+    finally:
+        # If the consumer stops early (or a range fails), drop the ranges not started yet.
+        for future in futures:
+            future.cancel()
@@ -0,0 +1,107 @@
+import re
+import math
+from collections import Counter
+
+# Rough characters-per-token ratio for English prose with both Groq and Anthropic tokenizers.
+CHARS_PER_TOKEN = 4
+
+# Only the first and last BOILERPLATE_EDGE_LINES non-empty lines of a page
+# can be a running header/footer or a page number. Such a line is dropped
+# when it is a page number, or when it appears in those positions on at
+# least this share of pages (and on at least BOILERPLATE_MIN_PAGES pages).
+BOILERPLATE_EDGE_LINES = 2
+BOILERPLATE_MIN_FRACTION = 0.5
+BOILERPLATE_MIN_PAGES = 3
+
+PAGE_NUMBER_PATTERN = re.compile(r"^(page\s*)?\d+(\s*(of|/)\s*\d+)?$", re.IGNORECASE)
+DIGITS_PATTERN = re.compile(r"\d+")
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate; good enough for budgeting, not for billing."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _normalize_line(line: str) -> str:
+    # "Confidential - Page 3 of 10" and "... Page 4 of 10" should count as the
+    # same footer, but "Step 3: ..." and "Step 4: ..." must stay distinct.
+    line = line.strip().lower()
+    return DIGITS_PATTERN.sub("#", line) if "page" in line else line
+
+
+def _edge_indexes(lines: list) -> set:
+    """Indexes of the first and last BOILERPLATE_EDGE_LINES non-empty lines of a page."""
+    filled = [i for i, line in enumerate(lines) if line.strip()]
+    return set(filled[:BOILERPLATE_EDGE_LINES] + filled[-BOILERPLATE_EDGE_LINES:])
+
+
+def strip_boilerplate(page_texts: list) -> list:
+    """
+    Removes page numbers and running headers/footers from each page's text.
+    Only lines at the top or bottom of a page are candidates, so numbers,
+    amounts and instructions repeated in the body ("Tap Next") are kept.
+    """
+    page_lines = [text.splitlines() for text in page_texts]
+    page_edges = [_edge_indexes(lines) for lines in page_lines]
+    line_counts = Counter()
+    for lines, edges in zip(page_lines, page_edges):
+        line_counts.update({_normalize_line(lines[i]) for i in edges})
+
+    min_pages = max(BOILERPLATE_MIN_PAGES, math.ceil(len(page_texts) * BOILERPLATE_MIN_FRACTION))
+    repeated = {line for line, count in line_counts.items() if count >= min_pages}
+
+    stripped = []
+    for lines, edges in zip(page_lines, page_edges):
+        kept = [
+            line for i, line in enumerate(lines)
+            if line.strip() and not (
+                i in edges
+                and (PAGE_NUMBER_PATTERN.match(line.strip()) or _normalize_line(line) in repeated)
+            )
+        ]
+        stripped.append("\n".join(kept))
+    return stripped
+
+
+def format_pages(page_texts: list, first_page: int = 1) -> str:
+    """Joins page texts with the page markers Agent 1 has always used in its prompt."""
+    return "".join(
+        f"\n--- PDF Page {page_no} Text ---\n{text}"
+        for page_no, text in enumerate(page_texts, start=first_page)
+    )
+
+
+def chunk_pages(page_texts: list, chunk_tokens: int) -> list:
+    """
+    Groups consecutive pages into chunks of at most `chunk_tokens` estimated
+    tokens. A single page larger than the limit becomes its own chunk.
+    Returns a list of (first_page_number, formatted_text).
+    """
+    chunks, current, current_tokens, first_page = [], [], 0, 1
+    for page_no, text in enumerate(page_texts, start=1):
+        page_tokens = estimate_tokens(text)
+        if current and current_tokens + page_tokens > chunk_tokens:
+            chunks.append((first_page, format_pages(current, first_page)))
+            current, current_tokens, first_page = [], 0, page_no
+        current.append(text)
+        current_tokens += page_tokens
+    if current:
+        chunks.append((first_page, format_pages(current, first_page)))
+    return chunks
+
+
+def merge_blueprints(partials: list) -> dict:
+    """
+    Merges per-chunk blueprints (in document order) into one: the first
+    non-empty summary wins, steps are concatenated and step_ids renumbered.
+    """
+    summary, steps = {}, []
+    for partial in partials:
+        if isinstance(partial, list):
+            partial = {"steps": partial}
+        if not summary and partial.get("summary"):
+            summary = partial["summary"]
+        steps.extend(step for step in partial.get("steps", []) if isinstance(step, dict))
+    for step_id, step in enumerate(steps, start=1):
+        step["step_id"] = step_id
+    return {"summary": summary, "steps": steps}
@@ -0,0 +1,287 @@
+import re
+import time
+import asyncio
+import threading
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+from datetime import datetime, timezone
+
+from config import (
+    LLM_BREAKER_WINDOW_SECONDS, LLM_BREAKER_MIN_CALLS, LLM_BREAKER_FAILURE_RATE,
+    LLM_BREAKER_SLOW_CALL_SECONDS, LLM_BREAKER_COOL_OFF_SECONDS,
+    LLM_RATE_LIMIT_RPS, LLM_RATE_LIMIT_BURST, LLM_RATE_LIMIT_MAX_WAIT_SECONDS,
+)
+
+DURATION_PART_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+class ProviderUnavailable(Exception):
+    """Raised instead of calling a provider whose circuit is open or whose rate limit wait is too long."""
+
+
+def _parse_reset(value: str):
+    """
+    Seconds until a rate-limit window resets. Groq sends durations such as
+    "2m59.56s" or "120ms"; Anthropic sends RFC 3339 timestamps.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = DURATION_PART_PATTERN.findall(value)
+    if parts and "".join(number + unit for number, unit in parts) == value:
+        return sum(float(number) * DURATION_UNITS[unit] for number, unit in parts)
+    try:
+        reset_at = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        return max(0.0, (reset_at - datetime.now(timezone.utc)).total_seconds())
+    except ValueError:
+        return None
+
+
+class CircuitBreaker:
+    """Rolling-window circuit breaker: closed -> open -> half_open -> closed."""
+
+    def __init__(self):
+        self.state = "closed"
+        self.opened_until = 0.0
+        self._calls = deque()  # (timestamp, failed)
+        self._trial_in_flight = False
+
+    def cancel_trial(self) -> None:
+        """Frees the half-open trial slot when an admitted call never ran."""
+        self._trial_in_flight = False
+
+    def _trim(self, now: float) -> None:
+        while self._calls and now - self._calls[0][0] > LLM_BREAKER_WINDOW_SECONDS:
+            self._calls.popleft()
+
+    def allow(self, now: float) -> bool:
+        if self.state == "open":
+            if now < self.opened_until:
+                return False
+            self.state = "half_open"
+        if self.state == "half_open":
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+        return True
+
+    def record(self, now: float, failed: bool) -> None:
+        if self.state == "half_open":
+            self._trial_in_flight = False
+            if failed:
+                self._open(now)
+            else:
+                self.state = "closed"
+                self._calls.clear()
+            return
+        self._calls.append((now, failed))
+        self._trim(now)
+        failures = sum(1 for _, f in self._calls if f)
+        if len(self._calls) >= LLM_BREAKER_MIN_CALLS and failures / len(self._calls) >= LLM_BREAKER_FAILURE_RATE:
+            self._open(now)
+
+    def _open(self, now: float) -> None:
+        self.state = "open"
+        self.opened_until = now + LLM_BREAKER_COOL_OFF_SECONDS
+        self._calls.clear()
+
+    def snapshot(self, now: float) -> dict:
+        self._trim(now)
+        failures = sum(1 for _, f in self._calls if f)
+        return {
+            "state": self.state,
+            "window_calls": len(self._calls),
+            "window_failure_rate": failures / len(self._calls) if self._calls else 0.0,
+            "cool_off_remaining": max(0.0, self.opened_until - now) if self.state == "open" else 0.0,
+        }
+
+
+class TokenBucket:
+    """Request-rate token bucket whose rate follows the provider's rate-limit headers."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.blocked_until = 0.0
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, now: float) -> float:
+        """Takes a token, returning how many seconds the caller must wait before using it."""
+        self._refill(now)
+        self.tokens -= 1
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < 0:
+            wait = max(wait, -self.tokens / self.rate)
+        return wait
+
+    def tune(self, now: float, remaining, reset_seconds, retry_after) -> None:
+        if retry_after is not None:
+            self.blocked_until = max(self.blocked_until, now + retry_after)
+        if remaining is None or not reset_seconds:
+            return
+        if remaining <= 0:
+            self.blocked_until = max(self.blocked_until, now + reset_seconds)
+            return
+        # Spread what is left of the provider's window evenly over the time until it resets.
+        self._refill(now)
+        self.rate = max(0.05, min(LLM_RATE_LIMIT_RPS, remaining / reset_seconds))
+        self.tokens = min(self.tokens, float(remaining))
+
+
+class ProviderGuard:
+    """Circuit breaker, rate limiter and counters for one LLM provider."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.breaker = CircuitBreaker()
+        self.bucket = TokenBucket(LLM_RATE_LIMIT_RPS, LLM_RATE_LIMIT_BURST)
+        self.counters = {
+            "requests": 0, "successes": 0, "failures": 0, "slow_calls": 0,
+            "rate_limited": 0, "rejected_open": 0, "throttled": 0, "throttle_wait_seconds": 0.0,
+        }
+        self._latencies = deque(maxlen=200)
+        self._lock = threading.Lock()
+
+    def _admit(self) -> float:
+        """Checks the breaker and reserves a rate-limit slot. Returns the seconds to wait."""
+        with self._lock:
+            now = time.monotonic()
+            if not self.breaker.allow(now):
+                self.counters["rejected_open"] += 1
+                raise ProviderUnavailable(f"{self.name} circuit is open.")
+            wait = self.bucket.reserve(now)
+            if wait > LLM_RATE_LIMIT_MAX_WAIT_SECONDS:
+                self.bucket.tokens += 1  # Give the slot back; we will not use it.
+                self.breaker.cancel_trial()
+                raise ProviderUnavailable(f"{self.name} rate limit wait of {wait:.1f}s is too long.")
+            self.counters["requests"] += 1
+            if wait > 0:
+                self.counters["throttled"] += 1
+                self.counters["throttle_wait_seconds"] += wait
+            return wait
+
+    def acquire(self) -> None:
+        """Blocks until the provider may be called, or raises ProviderUnavailable."""
+        wait = self._admit()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self) -> None:
+        wait = self._admit()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def release(self) -> None:
+        """Forgets an admitted call that was abandoned (cancelled or closed) before it finished."""
+        with self._lock:
+            self.breaker.cancel_trial()
+
+    @contextmanager
+    def guarded(self):
+        """
+        Admits one call (waiting on the rate limiter) and records its outcome.
+        Yields a dict in which the caller may store the response "headers".
+        """
+        self.acquire()
+        started, call = time.perf_counter(), {}
+        try:
+            yield call
+        except Exception as e:
+            self.record_failure(time.perf_counter() - started, e)
+            raise
+        except BaseException:
+            self.release()
+            raise
+        self.record_success(time.perf_counter() - started, call.get("headers"))
+
+    @asynccontextmanager
+    async def guarded_async(self):
+        """Async counterpart of guarded()."""
+        await self.acquire_async()
+        started, call = time.perf_counter(), {}
+        try:
+            yield call
+        except Exception as e:
+            self.record_failure(time.perf_counter() - started, e)
+            raise
+        except BaseException:
+            self.release()
+            raise
+        self.record_success(time.perf_counter() - started, call.get("headers"))
+
+    def update_from_headers(self, headers) -> None:
+        """Retunes the token bucket from Groq or Anthropic rate-limit response headers."""
+        if not headers:
+            return
+        remaining = headers.get("x-ratelimit-remaining-requests") or headers.get("anthropic-ratelimit-requests-remaining")
+        reset = headers.get("x-ratelimit-reset-requests") or headers.get("anthropic-ratelimit-requests-reset")
+        retry_after = headers.get("retry-after")
+        try:
+            remaining = int(remaining) if remaining is not None else None
+        except ValueError:
+            remaining = None
+        with self._lock:
+            self.bucket.tune(time.monotonic(), remaining, _parse_reset(reset), _parse_reset(retry_after))
+
+    def record_success(self, latency: float, headers=None) -> None:
+        self.update_from_headers(headers)
+        slow = latency > LLM_BREAKER_SLOW_CALL_SECONDS
+        with self._lock:
+            self.counters["successes"] += 1
+            self.counters["slow_calls"] += slow
+            self._latencies.append(latency)
+            self.breaker.record(time.monotonic(), failed=slow)
+
+    def record_failure(self, latency: float, error: Exception) -> None:
+        response = getattr(error, "response", None)
+        if response is not None:
+            self.update_from_headers(getattr(response, "headers", None))
+        with self._lock:
+            self.counters["failures"] += 1
+            if getattr(error, "status_code", None) == 429:
+                self.counters["rate_limited"] += 1
+            self._latencies.append(latency)
+            self.breaker.record(time.monotonic(), failed=True)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            now = time.monotonic()
+            ordered = sorted(self._latencies)
+            return {
+                "circuit": self.breaker.snapshot(now),
+                "rate_limiter": {
+                    "rate_per_second": self.bucket.rate,
+                    "tokens": max(0.0, self.bucket.tokens),
+                    "blocked_for": max(0.0, self.bucket.blocked_until - now),
+                },
+                "latency_p95": ordered[int((len(ordered) - 1) * 0.95)] if ordered else None,
+                "counters": dict(self.counters),
+            }
+
+
+_guards = {}
+_guards_lock = threading.Lock()
+
+
+def get_guard(name: str) -> ProviderGuard:
+    """Returns the process-wide guard for a provider, creating it on first use."""
+    with _guards_lock:
+        if name not in _guards:
+            _guards[name] = ProviderGuard(name)
+        return _guards[name]
+
+
+def get_all_states() -> dict:
+    with _guards_lock:
+        guards = list(_guards.values())
+    return {guard.name: guard.snapshot() for guard in guards}
@@ -0,0 +1,404 @@
+import os
+import time
+import uuid
+import shutil
+import zipfile
+import mimetypes
+import threading
+from pathlib import Path, PurePosixPath
+from fastapi import HTTPException
+
+from config import (
+    ARTIFACTS_DIR, ENV_POOL_DIR, RETENTION_INTERVAL_SECONDS, RETENTION_STATUSES,
+    RETENTION_ARCHIVE_AFTER_SECONDS, RETENTION_DELETE_AFTER_SECONDS, RETENTION_MAX_BYTES,
+    RETENTION_IO_BYTES_PER_SECOND,
+)
+import env_manager
+import state_manager
+from state_store import STATUS_FILE, LOCK_FILE
+
+ARCHIVE_FILE = "artifacts.zip"
+IO_CHUNK_BYTES = 1024 * 1024
+# Already compressed; deflating them again costs CPU for almost nothing.
+STORED_SUFFIXES = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".zip", ".gz"}
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp", ".tif", ".tiff"}
+DATABASE_SUFFIXES = (".sqlite3", ".sqlite3-wal", ".sqlite3-shm", ".sqlite3-journal")
+LIST_PAGE_SIZE = 1000
+
+_stopping = threading.Event()
+_wake = threading.Event()
+_run_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {"runs": 0, "envs_deleted": 0, "archived": 0, "deleted": 0, "bytes_freed": 0, "errors": 0}
+_last_run = None
+_started = False
+
+
+class _IOBudget:
+    """Sleeps the compactor so its reads stay under `bytes_per_second` (0 = unthrottled)."""
+
+    def __init__(self, bytes_per_second: int):
+        self.rate = bytes_per_second
+        self._start = time.monotonic()
+        self._bytes = 0
+
+    def consume(self, size: int) -> None:
+        if self.rate <= 0:
+            return
+        self._bytes += size
+        ahead = self._bytes / self.rate - (time.monotonic() - self._start)
+        if ahead > 0:
+            # Shutdown cuts the wait short; the pass then stops at the next task.
+            _stopping.wait(ahead)
+
+
+# --- Sizes ---
+
+def _disk_bytes(st: os.stat_result) -> int:
+    blocks = getattr(st, "st_blocks", None)
+    return blocks * 512 if blocks is not None else st.st_size
+
+
+def _walk_files(root: Path):
+    """(path, stat) of every regular file under `root`, without following symlinks."""
+    try:
+        entries = list(os.scandir(root))
+    except OSError:
+        return
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                yield from _walk_files(Path(entry.path))
+            elif entry.is_file(follow_symlinks=False):
+                yield Path(entry.path), entry.stat(follow_symlinks=False)
+        except OSError:
+            continue
+
+
+def _tree_bytes(root: Path) -> int:
+    """Bytes freed by deleting `root`: files with no hard links elsewhere."""
+    return sum(_disk_bytes(st) for _, st in _walk_files(root) if st.st_nlink <= 1)
+
+
+def _classify(parts: tuple) -> str:
+    """Artifact type of a file from its path parts relative to ARTIFACTS_DIR."""
+    top, name = parts[0], parts[-1]
+    if len(parts) == 1:
+        if name.endswith(DATABASE_SUFFIXES):
+            return "databases"
+        return "uploads" if name.startswith(".upload-") else "other"
+    if top.startswith("_"):
+        # _envs, _blobs, _ingest_cache, _batches, _browsers, ...
+        return top.lstrip("_")
+    if name in (STATUS_FILE, LOCK_FILE) or name.startswith(f".{STATUS_FILE}."):
+        return "status"
+    if name == ARCHIVE_FILE:
+        return "archives"
+    if parts[1:] == ("input.pdf",):
+        return "pdfs"
+    if Path(name).suffix.lower() in IMAGE_SUFFIXES:
+        return "images"
+    return {"agent1": "extractions", "agent2": "scripts", "agent3": "run_logs"}.get(parts[1], "other")
+
+
+def get_usage() -> dict:
+    """
+    Disk usage of ARTIFACTS_DIR (and ENV_POOL_DIR if it lives elsewhere) by
+    artifact type. A file hard-linked from several places (the ingest cache
+    links PDFs and page images to its blob store) is counted once, under the
+    first place it is found, so the types add up to the total.
+    """
+    roots = [(ARTIFACTS_DIR, ())]
+    if ARTIFACTS_DIR not in ENV_POOL_DIR.parents:
+        roots.append((ENV_POOL_DIR, ("_envs",)))
+    by_type, seen, total = {}, set(), 0
+    tasks, archived = set(), 0
+    for root, prefix in roots:
+        for path, st in _walk_files(root):
+            key = (st.st_dev, st.st_ino)
+            if key in seen:
+                continue
+            seen.add(key)
+            parts = prefix + path.relative_to(root).parts
+            kind = _classify(parts)
+            size = _disk_bytes(st)
+            entry = by_type.setdefault(kind, {"bytes": 0, "files": 0})
+            entry["bytes"] += size
+            entry["files"] += 1
+            total += size
+            if len(parts) > 1 and not parts[0].startswith("_"):
+                tasks.add(parts[0])
+                archived += parts[1:] == (ARCHIVE_FILE,)
+    try:
+        disk = shutil.disk_usage(ARTIFACTS_DIR)
+        disk = {"total": disk.total, "used": disk.used, "free": disk.free}
+    except OSError:
+        disk = None
+    return {
+        "total_bytes": total,
+        "max_bytes": RETENTION_MAX_BYTES or None,
+        "by_type": dict(sorted(by_type.items(), key=lambda item: -item[1]["bytes"])),
+        "task_dirs": len(tasks),
+        "archived_tasks": archived,
+        "disk": disk,
+        "retention": get_stats(),
+    }
+
+
+# --- Archived task directories ---
+
+def _relative(path: str) -> str:
+    """Normalizes a path inside a task directory; rejects anything that could escape it."""
+    relative = PurePosixPath(path.replace("\\", "/"))
+    if relative.is_absolute() or not relative.parts or any(p in ("", ".", "..") for p in relative.parts):
+        raise HTTPException(status_code=400, detail="Invalid artifact path.")
+    return relative.as_posix()
+
+
+def list_artifacts(seq_no: str) -> list:
+    """The files of a task directory, whether still on disk or packed into its archive."""
+    task_dir = state_manager.get_task_dir(seq_no)
+    files = {}
+    archive_path = task_dir / ARCHIVE_FILE
+    if archive_path.exists():
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                files[info.filename] = {"path": info.filename, "size": info.file_size, "archived": True}
+    for path, st in _walk_files(task_dir):
+        if path.name.startswith(".") or path == archive_path:
+            continue
+        relative = path.relative_to(task_dir).as_posix()
+        files[relative] = {"path": relative, "size": st.st_size, "archived": False}
+    return sorted(files.values(), key=lambda f: f["path"])
+
+
+def read_artifact(seq_no: str, path: str) -> tuple:
+    """
+    (content or file path, media type) of one file of a task. Files still on
+    disk are returned as a Path; files packed into the archive as bytes.
+    Raises HTTPException 404 if the task has no such file.
+    """
+    relative = _relative(path)
+    task_dir = state_manager.get_task_dir(seq_no)
+    media_type = mimetypes.guess_type(relative)[0] or "application/octet-stream"
+    candidate = task_dir / relative
+    if candidate.is_file() and candidate.name not in (LOCK_FILE, ARCHIVE_FILE):
+        return candidate, media_type
+    archive_path = task_dir / ARCHIVE_FILE
+    try:
+        with zipfile.ZipFile(archive_path) as archive:
+            return archive.read(relative), media_type
+    except (FileNotFoundError, KeyError):
+        raise HTTPException(status_code=404, detail=f"Task {seq_no} has no file '{relative}'.")
+
+
+def _pack(seq_no: str, budget: _IOBudget) -> int:
+    """
+    Packs a task directory into artifacts.zip next to its status file, then
+    deletes the packed files and the directories left empty. The archive is renamed into place before
+    anything is deleted, so every file stays readable throughout. Returns
+    the bytes freed.
+    """
+    task_dir = state_manager.get_task_dir(seq_no)
+    # Status, lock and temp files stay outside the archive, and so do files
+    # hard-linked to the ingest cache's blobs: on disk they take no extra space.
+    files = [
+        (path, st) for path, st in _walk_files(task_dir)
+        if not path.name.startswith(".") and path.name != STATUS_FILE and st.st_nlink <= 1
+    ]
+    if not files:
+        return 0
+    tmp = task_dir / f".{ARCHIVE_FILE}.{uuid.uuid4().hex[:6]}.tmp"
+    original_bytes = 0
+    try:
+        with zipfile.ZipFile(tmp, "w") as archive:
+            for path, st in files:
+                info = zipfile.ZipInfo.from_file(path, path.relative_to(task_dir).as_posix())
+                stored = path.suffix.lower() in STORED_SUFFIXES
+                info.compress_type = zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED
+                with path.open("rb") as src, archive.open(info, "w", force_zip64=True) as dst:
+                    for chunk in iter(lambda: src.read(IO_CHUNK_BYTES), b""):
+                        budget.consume(len(chunk))
+                        dst.write(chunk)
+                original_bytes += st.st_size
+        os.replace(tmp, task_dir / ARCHIVE_FILE)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    archive_bytes = (task_dir / ARCHIVE_FILE).stat().st_size
+    state_manager.update_task_state(seq_no, {"archive": {
+        "file": ARCHIVE_FILE,
+        "files": len(files),
+        "original_bytes": original_bytes,
+        "archive_bytes": archive_bytes,
+        "archived_at": time.time(),
+    }})
+
+    freed = 0
+    for path, st in files:
+        path.unlink(missing_ok=True)
+        freed += _disk_bytes(st)
+    for dirpath, _, _ in sorted(os.walk(task_dir), key=lambda entry: -len(entry[0])):
+        if Path(dirpath) != task_dir:
+            try:
+                os.rmdir(dirpath)
+            except OSError:
+                pass  # not empty
+    return freed - archive_bytes
+
+
+def _delete(seq_no: str) -> int:
+    """Deletes a task's state and directory. Returns the bytes freed."""
+    task_dir = state_manager.get_task_dir(seq_no)
+    freed = _tree_bytes(task_dir)
+    state_manager.delete_task_state(seq_no)
+    # Hide it from lookups before the (slow) delete.
+    doomed = ARTIFACTS_DIR / f".deleting.{seq_no}.{uuid.uuid4().hex[:6]}"
+    try:
+        os.rename(task_dir, doomed)
+    except OSError:
+        doomed = task_dir
+    shutil.rmtree(doomed, ignore_errors=True)
+    return freed
+
+
+# --- Compaction ---
+
+def _finished_tasks() -> list:
+    """(finished_at, seq_no, archived) of tasks in RETENTION_STATUSES, oldest first."""
+    tasks = []
+    for status in RETENTION_STATUSES:
+        offset = 0
+        while True:
+            page = state_manager.list_tasks(status=status, limit=LIST_PAGE_SIZE, offset=offset)
+            for summary in page:
+                state = state_manager.get_task_state(summary["seq_no"])
+                if not state or state.get("status") not in RETENTION_STATUSES:
+                    continue
+                finished_at = (state.get("run") or {}).get("finished_at") or state.get("created_at") or 0
+                tasks.append((finished_at, summary["seq_no"], "archive" in state))
+            if len(page) < LIST_PAGE_SIZE:
+                break
+            offset += LIST_PAGE_SIZE
+    return sorted(tasks)
+
+
+def run_once() -> dict:
+    """
+    One compaction pass: deletes and packs finished tasks past their age
+    limits, then, while over RETENTION_MAX_BYTES, deletes idle pooled
+    virtualenvs, packs the oldest finished tasks and finally deletes them.
+    Returns what it did.
+    """
+    global _last_run
+    with _run_lock:
+        started = time.time()
+        budget = _IOBudget(RETENTION_IO_BYTES_PER_SECOND)
+        result = {"envs_deleted": 0, "archived": 0, "deleted": 0, "bytes_freed": 0, "errors": 0}
+
+        def apply(counter: str, fn, seq_no: str, *args) -> int:
+            try:
+                freed = fn(seq_no, *args)
+            except Exception as e:
+                result["errors"] += 1
+                print(f"[{seq_no}] Retention: {fn.__name__.strip('_')} failed: {e}")
+                return 0
+            result[counter] += 1
+            result["bytes_freed"] += freed
+            return freed
+
+        tasks = _finished_tasks()
+        remaining = []
+        for finished_at, seq_no, archived in tasks:
+            if _stopping.is_set():
+                break
+            age = started - finished_at
+            if RETENTION_DELETE_AFTER_SECONDS and age >= RETENTION_DELETE_AFTER_SECONDS:
+                apply("deleted", _delete, seq_no)
+                continue
+            if not archived and RETENTION_ARCHIVE_AFTER_SECONDS and age >= RETENTION_ARCHIVE_AFTER_SECONDS:
+                apply("archived", _pack, seq_no, budget)
+                archived = True
+            remaining.append((seq_no, archived))
+
+        if RETENTION_MAX_BYTES and not _stopping.is_set():
+            excess = get_usage()["total_bytes"] - RETENTION_MAX_BYTES
+            for env_dir in env_manager.idle_envs():
+                if excess <= 0 or _stopping.is_set():
+                    break
+                freed = _tree_bytes(env_dir)
+                if env_manager.remove_env(env_dir):
+                    result["envs_deleted"] += 1
+                    result["bytes_freed"] += freed
+                    excess -= freed
+            for seq_no, archived in remaining:
+                if excess <= 0 or _stopping.is_set():
+                    break
+                if not archived:
+                    excess -= apply("archived", _pack, seq_no, budget)
+            for seq_no, _ in remaining:
+                if excess <= 0 or _stopping.is_set():
+                    break
+                excess -= apply("deleted", _delete, seq_no)
+
+        result["seconds"] = round(time.time() - started, 3)
+        with _stats_lock:
+            _stats["runs"] += 1
+            for key in ("envs_deleted", "archived", "deleted", "bytes_freed", "errors"):
+                _stats[key] += result[key]
+            _last_run = {"started_at": started, **result}
+        if any(result[key] for key in ("envs_deleted", "archived", "deleted")):
+            print(
+                f"Retention: deleted {result['envs_deleted']} envs and {result['deleted']} tasks, "
+                f"archived {result['archived']} tasks, freed {result['bytes_freed']} bytes."
+            )
+        return result
+
+
+def _loop() -> None:
+    while not _stopping.is_set():
+        try:
+            run_once()
+        except Exception as e:
+            print(f"Retention: compaction pass failed: {e}")
+        _wake.wait(RETENTION_INTERVAL_SECONDS)
+        _wake.clear()
+
+
+def start() -> None:
+    """Starts the background compactor (one pass now, then every RETENTION_INTERVAL_SECONDS)."""
+    global _started
+    with _stats_lock:
+        if _started:
+            return
+        _started = True
+    threading.Thread(target=_loop, name="retention", daemon=True).start()
+
+
+def trigger() -> bool:
+    """Wakes the compactor for an immediate pass. Returns False if it is not running."""
+    if not _started:
+        return False
+    _wake.set()
+    return True
+
+
+def shutdown() -> None:
+    _stopping.set()
+    _wake.set()
+
+
+def get_stats() -> dict:
+    with _stats_lock:
+        stats = dict(_stats)
+        stats["last_run"] = _last_run
+    stats["running"] = _started and not _stopping.is_set()
+    stats["policy"] = {
+        "statuses": RETENTION_STATUSES,
+        "archive_after_seconds": RETENTION_ARCHIVE_AFTER_SECONDS or None,
+        "delete_after_seconds": RETENTION_DELETE_AFTER_SECONDS or None,
+        "max_bytes": RETENTION_MAX_BYTES or None,
+        "io_bytes_per_second": RETENTION_IO_BYTES_PER_SECOND or None,
+        "interval_seconds": RETENTION_INTERVAL_SECONDS,
+    }
+    return stats
@@ -0,0 +1,166 @@
+"""
+Runtime helpers for AISA's generated automation scripts.
+
+Every pooled task virtualenv has this directory on its path, so a script can
+simply `import aisa_runtime`. It depends only on the standard library and, for
+the browser helpers, on Playwright.
+"""
+import os
+import json
+import time
+from contextlib import contextmanager
+
+# Set by the AISA supervisor for web runs: the CDP endpoint of a shared,
+# already running headless Chromium.
+CDP_URL_ENV = "AISA_BROWSER_CDP_URL"
+HEADLESS_ENV = "AISA_HEADLESS"
+# Where step timings are appended as JSON lines (set by the supervisor).
+STEP_LOG_ENV = "AISA_STEP_LOG"
+
+STEP_TIMEOUT_MS = int(os.getenv("AISA_STEP_TIMEOUT_MS", "15000"))
+MAX_PAUSE_SECONDS = float(os.getenv("AISA_MAX_PAUSE_SECONDS", "10"))
+
+
+@contextmanager
+def step(name: str):
+    """Times the block as one named step, printing it and appending it to the step log."""
+    started = time.perf_counter()
+    error = None
+    try:
+        yield
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        seconds = round(time.perf_counter() - started, 4)
+        print(f"[aisa] {name}: {'failed' if error else 'ok'} in {seconds:.2f}s")
+        path = os.getenv(STEP_LOG_ENV)
+        if path:
+            with open(path, "a", encoding="utf-8") as log:
+                log.write(json.dumps({"step": name, "seconds": seconds, "ok": error is None, "error": error}) + "\n")
+
+
+@contextmanager
+def browser_page(**context_options):
+    """
+    Yields a Playwright Page in a fresh, isolated browser context.
+
+    Under the AISA supervisor the context is opened in the shared headless
+    browser (AISA_BROWSER_CDP_URL), so no browser has to start. Anywhere else
+    a local Chromium is launched, headless unless AISA_HEADLESS=0.
+    `context_options` are passed to `browser.new_context()` (user_agent,
+    viewport, locale, ...). Actions on the page time out after
+    AISA_STEP_TIMEOUT_MS (15s by default). The context is closed when the block exits; a
+    shared browser is only disconnected from, never closed.
+    """
+    from playwright.sync_api import sync_playwright
+
+    with sync_playwright() as playwright:
+        cdp_url = os.getenv(CDP_URL_ENV)
+        if cdp_url:
+            browser = playwright.chromium.connect_over_cdp(cdp_url)
+        else:
+            browser = playwright.chromium.launch(headless=os.getenv(HEADLESS_ENV, "1") != "0")
+        context = browser.new_context(**context_options)
+        try:
+            page = context.new_page()
+            page.set_default_timeout(STEP_TIMEOUT_MS)
+            yield page
+        finally:
+            context.close()
+            browser.close()
+
+
+# --- Actions ---
+# Playwright already waits for an element to be attached, visible, stable,
+# enabled and unobscured before acting on it, so none of these need (or
+# should be followed by) a fixed sleep. `target` is a selector or a Locator.
+
+def _locator(page, target):
+    return page.locator(target) if isinstance(target, str) else target
+
+
+def _describe(target) -> str:
+    return target if isinstance(target, str) else str(target)
+
+
+def goto(page, url: str, wait_until: str = "domcontentloaded", **options):
+    """Navigates and returns as soon as the DOM is ready, not when the network goes idle."""
+    with step(f"goto {url}"):
+        return page.goto(url, wait_until=wait_until, **options)
+
+
+def click(page, target, **options):
+    """Clicks the element once it is actionable."""
+    with step(f"click {_describe(target)}"):
+        _locator(page, target).click(**options)
+
+
+def fill(page, target, value: str, **options):
+    """Fills the input once it is editable."""
+    with step(f"fill {_describe(target)}"):
+        _locator(page, target).fill(value, **options)
+
+
+def press(page, target, key: str, **options):
+    with step(f"press {key} on {_describe(target)}"):
+        _locator(page, target).press(key, **options)
+
+
+def select(page, target, value, **options):
+    with step(f"select {_describe(target)}"):
+        _locator(page, target).select_option(value, **options)
+
+
+def expect_visible(page, target, timeout: float = None):
+    """Waits until the element is visible; fails the step after `timeout` ms."""
+    from playwright.sync_api import expect
+
+    with step(f"expect visible {_describe(target)}"):
+        expect(_locator(page, target)).to_be_visible(timeout=timeout or STEP_TIMEOUT_MS)
+
+
+def expect_text(page, target, text, timeout: float = None):
+    """Waits until the element contains `text` (a string or compiled regex)."""
+    from playwright.sync_api import expect
+
+    with step(f"expect text {_describe(target)}"):
+        expect(_locator(page, target)).to_contain_text(text, timeout=timeout or STEP_TIMEOUT_MS)
+
+
+def expect_url(page, url, timeout: float = None):
+    """Waits until the page URL matches `url` (a string, glob or compiled regex)."""
+    with step(f"expect url {url}"):
+        page.wait_for_url(url, timeout=timeout or STEP_TIMEOUT_MS)
+
+
+# --- Generic waits (also for Appium) ---
+
+def wait_until(condition, timeout: float = None, interval: float = 0.1, description: str = "condition"):
+    """
+    Polls `condition()` until it returns something truthy and returns that
+    value; raises TimeoutError after `timeout` seconds (AISA_STEP_TIMEOUT_MS
+    by default). Use this instead of sleeping for a guessed amount of time.
+    """
+    timeout = STEP_TIMEOUT_MS / 1000 if timeout is None else timeout
+    with step(f"wait until {description}"):
+        deadline = time.monotonic() + timeout
+        while True:
+            value = condition()
+            if value:
+                return value
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"Timed out after {timeout:.1f}s waiting for {description}.")
+            time.sleep(interval)
+
+
+def pause(seconds: float, reason: str = "pause"):
+    """
+    An intentional fixed pause (e.g. holding a press-and-hold button), capped
+    at AISA_MAX_PAUSE_SECONDS (with a warning) and recorded as a step. Not
+    for waiting on the page: use the actions and waits above for that.
+    """
+    if seconds > MAX_PAUSE_SECONDS:
+        print(f"aisa_runtime: pause of {seconds}s ({reason}) capped at {MAX_PAUSE_SECONDS}s.")
+    with step(reason):
+        time.sleep(min(seconds, MAX_PAUSE_SECONDS))
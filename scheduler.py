@@ -0,0 +1,232 @@
+import time
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from config import SCHEDULER_WEB_SLOTS, SCHEDULER_MAX_QUEUE
+
+import appium_pool
+import state_manager
+from state_store import StateConflict
+
+QUEUE_WAIT_WINDOW = 500
+
+
+class QueueFull(Exception):
+    """Raised when accepting more runs would exceed SCHEDULER_MAX_QUEUE (backpressure)."""
+
+
+class NoCapacity(Exception):
+    """Raised when there is no slot at all that could ever run a task of this kind."""
+
+
+class Slot:
+    """One unit of execution capacity: a browser context (web) or a leased Appium server and device (mobile)."""
+
+    def __init__(self, slot_id: str, kind: str, url: str = None, udid: str = None):
+        self.id = slot_id
+        self.kind = kind
+        self.url = url
+        self.udid = udid
+        self.ready = True
+        self.busy_with = None
+        self.busy_since = None
+        self.busy_seconds = 0.0
+        self.runs = 0
+        self.created = time.monotonic()
+
+    def snapshot(self, now: float) -> dict:
+        busy = self.busy_seconds + (now - self.busy_since if self.busy_since else 0.0)
+        lifetime = max(now - self.created, 1e-9)
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "device": self.udid,
+            "ready": self.ready,
+            "busy_with": self.busy_with,
+            "runs": self.runs,
+            "busy_seconds": round(busy, 3),
+            "utilization": round(busy / lifetime, 4),
+        }
+
+
+class _Entry:
+    def __init__(self, seq_no: str, kind: str, priority: int, submitter: str, run, order: int):
+        self.seq_no = seq_no
+        self.kind = kind
+        self.priority = priority
+        self.submitter = submitter
+        self.run = run
+        self.order = order
+        self.enqueued = time.monotonic()
+
+
+_cond = threading.Condition()
+_queue = []
+_slots = {f"web-{i}": Slot(f"web-{i}", "web") for i in range(SCHEDULER_WEB_SLOTS)}
+_last_served = {}  # submitter -> dispatch counter when last served
+_counter = itertools.count()
+_dispatched = itertools.count(1)
+_queue_waits = {"web": deque(maxlen=QUEUE_WAIT_WINDOW), "mobile": deque(maxlen=QUEUE_WAIT_WINDOW)}
+_workers = None
+_dispatcher = None
+_stopping = False
+
+
+def _sync_mobile_slots() -> None:
+    """
+    Mirrors the Appium pool: one mobile slot per server, dispatched to only
+    while the server is ready (called with _cond held).
+    """
+    servers = {s["url"]: s for s in appium_pool.get_stats()["servers"]}
+    for server in servers.values():
+        slot_id = f"mobile-{server['udid'] or server['url']}"
+        if slot_id not in _slots:
+            _slots[slot_id] = Slot(slot_id, "mobile", url=server["url"], udid=server["udid"])
+        _slots[slot_id].ready = server["ready"]
+
+
+def _pick(kind: str):
+    """
+    The next entry of this kind: highest priority first; among equal
+    priorities, the submitter served least recently (so one large batch cannot
+    starve others), then first come first served.
+    """
+    candidates = [e for e in _queue if e.kind == kind]
+    if not candidates:
+        return None
+    top = max(e.priority for e in candidates)
+    return min(
+        (e for e in candidates if e.priority == top),
+        key=lambda e: (_last_served.get(e.submitter, -1), e.order),
+    )
+
+
+def _finish(slot: Slot) -> None:
+    with _cond:
+        slot.busy_seconds += time.monotonic() - slot.busy_since
+        slot.busy_with, slot.busy_since = None, None
+        _cond.notify_all()
+
+
+def _execute(entry: _Entry, slot: Slot) -> None:
+    try:
+        entry.run(slot)
+    except Exception as e:
+        print(f"[{entry.seq_no}] Scheduled run failed: {e}")
+    finally:
+        _finish(slot)
+
+
+def _dispatch_loop() -> None:
+    while True:
+        with _cond:
+            while True:
+                if _stopping:
+                    return
+                _sync_mobile_slots()
+                assignment = None
+                for slot in _slots.values():
+                    if slot.ready and slot.busy_with is None:
+                        entry = _pick(slot.kind)
+                        if entry is not None:
+                            assignment = (entry, slot)
+                            break
+                if assignment:
+                    break
+                # Wake up periodically to notice Appium servers becoming ready.
+                _cond.wait(timeout=1.0)
+            entry, slot = assignment
+            _queue.remove(entry)
+            now = time.monotonic()
+            slot.busy_with, slot.busy_since, slot.runs = entry.seq_no, now, slot.runs + 1
+            _last_served[entry.submitter] = next(_dispatched)
+            _queue_waits[entry.kind].append(now - entry.enqueued)
+        _workers.submit(_execute, entry, slot)
+
+
+def start() -> None:
+    global _workers, _dispatcher, _stopping
+    with _cond:
+        if _dispatcher is not None:
+            return
+        _stopping = False
+        _workers = ThreadPoolExecutor(max_workers=SCHEDULER_WEB_SLOTS + 32, thread_name_prefix="aisa-slot")
+        _dispatcher = threading.Thread(target=_dispatch_loop, name="aisa-scheduler", daemon=True)
+        _dispatcher.start()
+
+
+def has_room(count: int = 1) -> bool:
+    with _cond:
+        return len(_queue) + count <= SCHEDULER_MAX_QUEUE
+
+
+def enqueue(seq_no: str, kind: str, run, priority: int = 0, submitter: str = "default") -> None:
+    """
+    Queues `run(slot)` to be called on a worker thread once a free slot of
+    `kind` ("web" or "mobile") is available. Raises QueueFull when the queue
+    is at SCHEDULER_MAX_QUEUE and NoCapacity when no slot of that kind exists.
+    """
+    start()
+    with _cond:
+        _sync_mobile_slots()
+        if not any(slot.kind == kind for slot in _slots.values()):
+            raise NoCapacity(f"No {kind} execution slots are available.")
+        if len(_queue) >= SCHEDULER_MAX_QUEUE:
+            raise QueueFull(f"The run queue is full ({SCHEDULER_MAX_QUEUE} waiting); retry later.")
+        _queue.append(_Entry(seq_no, kind, priority, submitter, run, next(_counter)))
+        _cond.notify_all()
+
+
+def shutdown() -> None:
+    """
+    Stops dispatching. Runs still queued are dropped and their tasks put
+    back from "scheduled" to "ready", so they can be run again.
+    """
+    global _dispatcher, _stopping
+    with _cond:
+        _stopping = True
+        dropped = list(_queue)
+        _queue.clear()
+        _cond.notify_all()
+        dispatcher, _dispatcher = _dispatcher, None
+    for entry in dropped:
+        try:
+            state_manager.transition_task_state(entry.seq_no, "scheduled", {"status": "ready", "run": None})
+        except (StateConflict, FileNotFoundError):
+            pass  # already moved on, or deleted
+    if dispatcher is not None:
+        dispatcher.join(timeout=5)
+    if _workers is not None:
+        _workers.shutdown(wait=False)
+
+
+def _summarize(samples) -> dict:
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+    last = len(ordered) - 1
+    return {
+        "count": len(ordered),
+        "p50": ordered[int(last * 0.50)],
+        "p95": ordered[int(last * 0.95)],
+        "max": ordered[-1],
+    }
+
+
+def get_stats() -> dict:
+    """Queue depth per kind and submitter, per-slot utilization and queue wait percentiles."""
+    with _cond:
+        now = time.monotonic()
+        depth, by_submitter = {"web": 0, "mobile": 0}, {}
+        for entry in _queue:
+            depth[entry.kind] += 1
+            by_submitter[entry.submitter] = by_submitter.get(entry.submitter, 0) + 1
+        return {
+            "max_queue": SCHEDULER_MAX_QUEUE,
+            "queue_depth": depth,
+            "queued_by_submitter": by_submitter,
+            "slots": [slot.snapshot(now) for slot in _slots.values()],
+            "queue_wait_seconds": {kind: _summarize(waits) for kind, waits in _queue_waits.items()},
+        }
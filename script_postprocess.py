@@ -0,0 +1,170 @@
+import ast
+
+# Calls after which a fixed sleep is pure dead time in a Playwright script:
+# Playwright actions (and the aisa_runtime wrappers) auto-wait for their
+# elements. Appium/Selenium actions do not, so an Appium script's sleeps may
+# be all that lets the next screen (or the app) load, and they are left
+# exactly as written: neither removed nor turned into capped pauses.
+ACTION_NAMES = {
+    "click", "dblclick", "tap", "fill", "type", "press", "press_sequentially", "check", "uncheck",
+    "select_option", "select", "hover", "goto", "set_input_files",
+}
+# Load states that wait for the network to go quiet, which on most sites
+# costs seconds and adds nothing once actions wait for their elements.
+SLOW_LOAD_STATES = {"networkidle"}
+FAST_LOAD_STATE = "load"
+PAUSE_CALL = "aisa_runtime.pause"
+
+
+def _sleep_names(tree: ast.Module) -> tuple:
+    """Names bound to the time module and to time.sleep anywhere in the script."""
+    modules, functions = set(), set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                if alias.name == "time":
+                    modules.add(alias.asname or "time")
+        elif isinstance(node, ast.ImportFrom) and node.module == "time":
+            for alias in node.names:
+                if alias.name == "sleep":
+                    functions.add(alias.asname or "sleep")
+    return modules, functions
+
+
+def _is_sleep(call: ast.Call, modules: set, functions: set) -> bool:
+    func = call.func
+    if isinstance(func, ast.Attribute):
+        return func.attr == "sleep" and isinstance(func.value, ast.Name) and func.value.id in modules
+    return isinstance(func, ast.Name) and func.id in functions
+
+
+def _imported_modules(tree: ast.Module) -> set:
+    """Top-level package names imported anywhere in the script."""
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name.split(".")[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.add(node.module.split(".")[0])
+    return names
+
+
+def _is_playwright(tree: ast.Module, framework: str = None) -> bool:
+    if framework:
+        return framework.lower() == "playwright"
+    modules = _imported_modules(tree)
+    return "appium" not in modules and "selenium" not in modules and bool(modules & {"playwright", "aisa_runtime"})
+
+
+def _is_action(statement: ast.stmt) -> bool:
+    if not (isinstance(statement, ast.Expr) and isinstance(statement.value, ast.Call)):
+        return False
+    func = statement.value.func
+    name = func.attr if isinstance(func, ast.Attribute) else getattr(func, "id", None)
+    return name in ACTION_NAMES
+
+
+class _Offsets:
+    """Maps AST (line, UTF-8 byte column) positions to offsets into the encoded source."""
+
+    def __init__(self, source: bytes):
+        self.starts = [0]
+        for line in source.splitlines(keepends=True):
+            self.starts.append(self.starts[-1] + len(line))
+
+    def span(self, node: ast.AST) -> tuple:
+        return (self.starts[node.lineno - 1] + node.col_offset,
+                self.starts[node.end_lineno - 1] + node.end_col_offset)
+
+
+def postprocess(code: str, framework: str = None) -> tuple:
+    """
+    Rewrites the dead-time patterns of a generated script. In a Playwright
+    script (`framework`, or else judged by the script's imports), a fixed
+    sleep right after an action is removed and any other sleep becomes an
+    explicit, capped and timed `aisa_runtime.pause()`; an Appium script's
+    sleeps are not touched. A "networkidle" load-state wait
+    becomes a wait for "load". Returns (code, changes), where changes
+    describes each rewrite. If the script cannot be parsed, or the rewrite
+    does not compile, it is returned unchanged with no changes.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return code, []
+    source = code.encode("utf-8")
+    offsets = _Offsets(source)
+    modules, functions = _sleep_names(tree)
+    playwright = _is_playwright(tree, framework)
+    edits, changes = [], []  # edits: (start, end, replacement bytes)
+    handled = set()
+
+    # Statement-level sleeps, judged by the statement before them.
+    for node in ast.walk(tree):
+        for field in ("body", "orelse", "finalbody"):
+            body = getattr(node, field, None)
+            if not isinstance(body, list):
+                continue
+            for index, statement in enumerate(body):
+                if not (isinstance(statement, ast.Expr) and isinstance(statement.value, ast.Call)
+                        and _is_sleep(statement.value, modules, functions)):
+                    continue
+                handled.add(id(statement.value))
+                if not playwright:
+                    continue
+                if index > 0 and _is_action(body[index - 1]):
+                    edits.append((*offsets.span(statement), b"pass"))
+                    changes.append(f"line {statement.lineno}: removed fixed sleep after an action")
+                else:
+                    start, end = offsets.span(statement.value.func)
+                    edits.append((start, end, PAUSE_CALL.encode("utf-8")))
+                    changes.append(f"line {statement.lineno}: fixed sleep made an explicit aisa_runtime.pause()")
+
+    pauses = sum(1 for _, _, replacement in edits if replacement != b"pass")
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Call):
+            continue
+        if playwright and id(node) not in handled and _is_sleep(node, modules, functions):
+            start, end = offsets.span(node.func)
+            edits.append((start, end, PAUSE_CALL.encode("utf-8")))
+            changes.append(f"line {node.lineno}: fixed sleep made an explicit aisa_runtime.pause()")
+            pauses += 1
+        func = node.func
+        if isinstance(func, ast.Attribute) and func.attr in ("wait_for_load_state", "goto"):
+            values = node.args[:1] if func.attr == "wait_for_load_state" else []
+            values += [kw.value for kw in node.keywords if kw.arg in ("state", "wait_until")]
+            for value in values:
+                if isinstance(value, ast.Constant) and value.value in SLOW_LOAD_STATES:
+                    edits.append((*offsets.span(value), f'"{FAST_LOAD_STATE}"'.encode("utf-8")))
+                    changes.append(f"line {node.lineno}: waits for '{FAST_LOAD_STATE}' instead of '{value.value}'")
+
+    if not edits:
+        return code, []
+    if pauses and not any(
+        isinstance(node, ast.Import) and any(alias.name == "aisa_runtime" and alias.asname is None for alias in node.names)
+        for node in tree.body
+    ):
+        edits.append((_import_offset(tree, offsets), _import_offset(tree, offsets), b"import aisa_runtime\n"))
+
+    rewritten = source
+    for start, end, replacement in sorted(edits, key=lambda edit: edit[0], reverse=True):
+        rewritten = rewritten[:start] + replacement + rewritten[end:]
+    rewritten = rewritten.decode("utf-8")
+    try:
+        compile(rewritten, "automation_script.py", "exec")
+    except SyntaxError:
+        return code, []
+    return rewritten, changes
+
+
+def _import_offset(tree: ast.Module, offsets: _Offsets) -> int:
+    """Start of the line where a top-level import can go: after the docstring and __future__ imports."""
+    for index, statement in enumerate(tree.body):
+        if index == 0 and isinstance(statement, ast.Expr) and isinstance(statement.value, ast.Constant) \
+                and isinstance(statement.value.value, str):
+            continue
+        if isinstance(statement, ast.ImportFrom) and statement.module == "__future__":
+            continue
+        decorators = getattr(statement, "decorator_list", [])
+        return offsets.starts[min([statement.lineno] + [d.lineno for d in decorators]) - 1]
+    return offsets.starts[-1]
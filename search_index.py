@@ -0,0 +1,159 @@
+import re
+import json
+import time
+import sqlite3
+import threading
+from pathlib import Path
+
+from config import SEARCH_INDEX_PATH, SEARCH_CACHE_TTL_SECONDS, SEARCH_LOCAL_MIN_RESULTS, SEARCH_OFFLINE
+
+CURATED_SNIPPETS_FILE = Path(__file__).parent / "search_snippets.json"
+MAX_RESULTS = 5
+
+# Words that do not change what a "how to ... in Playwright" query is about.
+STOPWORDS = {
+    "a", "an", "and", "the", "to", "in", "on", "of", "for", "with", "using", "use",
+    "how", "do", "i", "is", "it", "by", "example", "examples", "python",
+}
+TOKEN_PATTERN = re.compile(r"[a-z0-9_]+")
+
+_lock = threading.Lock()
+_conn = None
+_fts_enabled = False
+_stats = {"cache_hits": 0, "index_hits": 0, "network": 0, "offline_misses": 0}
+
+
+def normalize_query(query: str) -> list:
+    """Lowercased, de-duplicated, sorted content words of a query."""
+    return sorted({t for t in TOKEN_PATTERN.findall(query.lower()) if t not in STOPWORDS})
+
+
+def _cache_key(query: str, search_depth: str) -> str:
+    return f"{search_depth}:{' '.join(normalize_query(query))}"
+
+
+def _get_conn() -> sqlite3.Connection:
+    global _conn, _fts_enabled
+    if _conn is not None:
+        return _conn
+    SEARCH_INDEX_PATH.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(SEARCH_INDEX_PATH), check_same_thread=False, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS search_cache ("
+        " key TEXT PRIMARY KEY, query TEXT, search_depth TEXT, results TEXT, created_at REAL)"
+    )
+    # When each indexed URL was fetched; NULL for curated snippets, which do
+    # not expire. Snippets without a row here are not served.
+    conn.execute("CREATE TABLE IF NOT EXISTS snippet_sources (url TEXT PRIMARY KEY, fetched_at REAL)")
+    try:
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS snippets USING fts5(title, content, url UNINDEXED)")
+        _fts_enabled = True
+    except sqlite3.OperationalError as e:
+        print(f"Warning: SQLite FTS5 is unavailable ({e}); search falls back to the exact-query cache only.")
+    conn.commit()
+    _conn = conn
+    if _fts_enabled:
+        _seed_curated_snippets(conn)
+    return conn
+
+
+def _seed_curated_snippets(conn: sqlite3.Connection) -> None:
+    """Loads the curated Playwright/Appium snippets into the index once."""
+    if not CURATED_SNIPPETS_FILE.exists():
+        return
+    snippets = json.loads(CURATED_SNIPPETS_FILE.read_text(encoding="utf-8"))
+    known = {row[0] for row in conn.execute("SELECT url FROM snippets")}
+    new = [(s["title"], s["content"], s["url"]) for s in snippets if s["url"] not in known]
+    if new:
+        conn.executemany("INSERT INTO snippets (title, content, url) VALUES (?, ?, ?)", new)
+    conn.executemany(
+        "INSERT OR IGNORE INTO snippet_sources (url, fetched_at) VALUES (?, NULL)",
+        [(s["url"],) for s in snippets],
+    )
+    conn.commit()
+
+
+def _index_results(conn: sqlite3.Connection, results: list, now: float) -> None:
+    """Indexes network results, replacing older copies of the same URLs."""
+    if not _fts_enabled:
+        return
+    curated = {row[0] for row in conn.execute("SELECT url FROM snippet_sources WHERE fetched_at IS NULL")}
+    results = [r for r in results if r.get("url") and r["url"] not in curated]
+    conn.executemany("DELETE FROM snippets WHERE url = ?", [(r["url"],) for r in results])
+    conn.executemany(
+        "INSERT INTO snippets (title, content, url) VALUES (?, ?, ?)",
+        [(r.get("title", ""), r.get("content", ""), r["url"]) for r in results],
+    )
+    conn.executemany(
+        "INSERT OR REPLACE INTO snippet_sources (url, fetched_at) VALUES (?, ?)",
+        [(r["url"], now) for r in results],
+    )
+
+
+def _purge_expired(conn: sqlite3.Connection, now: float) -> None:
+    """Drops cached queries and indexed network results older than the TTL."""
+    cutoff = now - SEARCH_CACHE_TTL_SECONDS
+    conn.execute("DELETE FROM search_cache WHERE created_at < ?", (cutoff,))
+    if _fts_enabled:
+        conn.execute(
+            "DELETE FROM snippets WHERE url IN (SELECT url FROM snippet_sources WHERE fetched_at < ?)", (cutoff,)
+        )
+        conn.execute("DELETE FROM snippet_sources WHERE fetched_at < ?", (cutoff,))
+
+
+def _search_local(conn: sqlite3.Connection, tokens: list, now: float) -> list:
+    if not _fts_enabled or not tokens:
+        return []
+    # Every content word must appear (FTS5 implicit AND); quoting keeps tokens literal.
+    match = " ".join(f'"{t}"' for t in tokens)
+    cutoff = float("-inf") if SEARCH_OFFLINE else now - SEARCH_CACHE_TTL_SECONDS
+    rows = conn.execute(
+        "SELECT snippets.title, snippets.content, snippets.url FROM snippets"
+        " JOIN snippet_sources ON snippet_sources.url = snippets.url"
+        " WHERE snippets MATCH ? AND (snippet_sources.fetched_at IS NULL OR snippet_sources.fetched_at >= ?)"
+        " ORDER BY bm25(snippets) LIMIT ?",
+        (match, cutoff, MAX_RESULTS),
+    ).fetchall()
+    return [{"title": title, "content": content, "url": url} for title, content, url in rows]
+
+
+def search(query: str, search_depth: str, fetch) -> list:
+    """
+    Returns search results as [{"url", "content", ...}]. Tries, in order: the
+    cached results for the normalized query, the local full-text index, and
+    finally `fetch()` (the live Tavily call), whose results are cached and
+    indexed. Entries from the network older than SEARCH_CACHE_TTL_SECONDS are
+    skipped, and purged whenever new results are stored. In offline mode
+    `fetch` is never called and stale entries are still used.
+    """
+    key, tokens, now = _cache_key(query, search_depth), normalize_query(query), time.time()
+    with _lock:
+        conn = _get_conn()
+        row = conn.execute("SELECT results, created_at FROM search_cache WHERE key = ?", (key,)).fetchone()
+        if row and (SEARCH_OFFLINE or now - row[1] <= SEARCH_CACHE_TTL_SECONDS):
+            _stats["cache_hits"] += 1
+            return json.loads(row[0])
+
+        local = _search_local(conn, tokens, now)
+        if len(local) >= SEARCH_LOCAL_MIN_RESULTS or SEARCH_OFFLINE:
+            _stats["index_hits" if local else "offline_misses"] += 1
+            return local
+
+    results = fetch()
+    with _lock:
+        _stats["network"] += 1
+        conn = _get_conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO search_cache (key, query, search_depth, results, created_at) VALUES (?, ?, ?, ?, ?)",
+            (key, query, search_depth, json.dumps(results), now),
+        )
+        _index_results(conn, results, now)
+        _purge_expired(conn, now)
+        conn.commit()
+    return results
+
+
+def get_stats() -> dict:
+    with _lock:
+        return {**_stats, "offline": SEARCH_OFFLINE, "full_text_index": _fts_enabled}
@@ -1,13 +1,47 @@
-import json
+import copy
+import time
+import threading
+from collections import OrderedDict
 from pathlib import Path
-from config import ARTIFACTS_DIR
+from config import ARTIFACTS_DIR, STATE_BACKEND, STATE_DB_PATH, STATE_CACHE_SIZE
+
+import events
+from state_store import JsonFileStore, SQLiteStore, StateConflict
+
+# Minimum seconds between two progress writes for the same task, so
+# token-level streaming does not turn into a status.json write per token.
+PROGRESS_MIN_INTERVAL = 0.5
+_last_progress_write = {}
 
 def get_task_dir(seq_no: str) -> Path:
     """Returns the path to the task directory."""
     return ARTIFACTS_DIR / seq_no
 
+def _make_store():
+    if STATE_BACKEND == "sqlite":
+        return SQLiteStore(STATE_DB_PATH)
+    if STATE_BACKEND != "json":
+        raise ValueError(f"Unknown AISA_STATE_BACKEND '{STATE_BACKEND}'; expected 'json' or 'sqlite'.")
+    return JsonFileStore(ARTIFACTS_DIR)
+
+_store = _make_store()
+
+# Write-through cache of recently used task states: seq_no -> (version, state).
+# A cached state is only served while the store's cheap version check
+# (file stat / indexed column) still matches, so writes from other worker
+# processes are picked up.
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def _cache_put(seq_no: str, version, state: dict) -> None:
+    with _cache_lock:
+        _cache[seq_no] = (version, copy.deepcopy(state))
+        _cache.move_to_end(seq_no)
+        while len(_cache) > STATE_CACHE_SIZE:
+            _cache.popitem(last=False)
+
 def create_task_state(seq_no: str, platform: str, instructions: str) -> dict:
-    """Creates the initial status.json file for a new task."""
+    """Creates the initial state (status.json or database row) for a new task."""
     task_dir = get_task_dir(seq_no)
     task_dir.mkdir(exist_ok=True)
 
@@ -16,39 +50,70 @@ def create_task_state(seq_no: str, platform: str, instructions: str) -> dict:
         "status": "created",
         "platform": platform,
         "instructions": instructions,
+        "created_at": time.time(),
         "artifacts": {}
     }
 
-    status_file = task_dir / "status.json"
-    with status_file.open("w", encoding="utf-8") as f:
-        json.dump(initial_state, f, indent=2)
+    _cache_put(seq_no, _store.create(seq_no, initial_state), initial_state)
 
+    events.publish(seq_no, "state", {"status": initial_state["status"], "changes": initial_state})
     return initial_state
 
 def get_task_state(seq_no: str) -> dict:
-    """Reads and returns the content of status.json for a given task."""
-    task_dir = get_task_dir(seq_no)
-    status_file = task_dir / "status.json"
-
-    if not status_file.exists():
+    """Returns the current state of a task, or None if it does not exist."""
+    version = _store.version(seq_no)
+    if version is None:
         return None
+    with _cache_lock:
+        cached = _cache.get(seq_no)
+        if cached is not None and cached[0] == version:
+            _cache.move_to_end(seq_no)
+            return copy.deepcopy(cached[1])
+    state = _store.load(seq_no)
+    if state is not None:
+        _cache_put(seq_no, version, state)
+    return state
 
-    with status_file.open("r", encoding="utf-8") as f:
-        return json.load(f)
+def _apply_update(seq_no: str, new_data: dict, expected=None) -> dict:
+    def apply(current_state: dict) -> dict:
+        if expected is not None and current_state.get("status") not in expected:
+            raise StateConflict(seq_no, current_state.get("status"), expected)
+        current_state.update(new_data)
+        return current_state
+
+    current_state, version = _store.update(seq_no, apply)
+    _cache_put(seq_no, version, current_state)
+    events.publish(seq_no, "state", {"status": current_state.get("status"), "changes": new_data})
+    return current_state
 
 def update_task_state(seq_no: str, new_data: dict) -> dict:
-    """Updates the status.json file with new data."""
-    task_dir = get_task_dir(seq_no)
-    status_file = task_dir / "status.json"
+    """Merges new data into the task's state (atomically, under the store's lock)."""
+    return _apply_update(seq_no, new_data)
 
-    if not status_file.exists():
-        raise FileNotFoundError(f"Status file for task {seq_no} not found.")
+def transition_task_state(seq_no: str, expected, new_data: dict) -> dict:
+    """
+    Compare-and-set: applies `new_data` only if the task's status is
+    `expected` (a status or a collection of statuses); otherwise raises
+    StateConflict without changing anything.
+    """
+    expected = {expected} if isinstance(expected, str) else set(expected)
+    return _apply_update(seq_no, new_data, expected)
 
-    with status_file.open("r+", encoding="utf-8") as f:
-        current_state = json.load(f)
-        current_state.update(new_data)
-        f.seek(0)
-        json.dump(current_state, f, indent=2)
-        f.truncate()
+def delete_task_state(seq_no: str) -> None:
+    """Deletes a task's stored state; the task then no longer exists for get_task_state or list_tasks."""
+    _store.delete(seq_no)
+    with _cache_lock:
+        _cache.pop(seq_no, None)
+    _last_progress_write.pop(seq_no, None)
 
-    return current_state
+def list_tasks(status: str = None, platform: str = None, limit: int = 100, offset: int = 0) -> list:
+    """Task summaries (seq_no, status, platform, created_at), newest first."""
+    return _store.list(status=status, platform=platform, limit=limit, offset=offset)
+
+def report_progress(seq_no: str, stage: str, force: bool = False, **fields) -> None:
+    """Records partial progress for a running stage under "progress" in status.json (throttled)."""
+    now = time.monotonic()
+    if not force and now - _last_progress_write.get(seq_no, 0) < PROGRESS_MIN_INTERVAL:
+        return
+    _last_progress_write[seq_no] = now
+    update_task_state(seq_no, {"progress": {"stage": stage, **fields}})
@@ -0,0 +1,230 @@
+import os
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+STATUS_FILE = "status.json"
+LOCK_FILE = ".status.lock"
+LOCK_STRIPES = 64
+
+
+class StateConflict(Exception):
+    """Raised when a compare-and-set transition finds the task in an unexpected status."""
+
+    def __init__(self, seq_no: str, status: str, expected):
+        super().__init__(f"Task {seq_no} is '{status}', expected one of {sorted(expected)}.")
+        self.seq_no = seq_no
+        self.status = status
+        self.expected = expected
+
+
+def _summary(state: dict) -> dict:
+    """The indexed fields of a task, as returned by list()."""
+    return {
+        "seq_no": state["seq_no"],
+        "status": state.get("status"),
+        "platform": state.get("platform"),
+        "created_at": state.get("created_at"),
+    }
+
+
+class JsonFileStore:
+    """
+    One status.json per task directory (the original layout). Updates hold a
+    per-task file lock (so they are safe across worker processes too) and
+    replace the file atomically. Listing uses an in-memory index built by
+    scanning the task directories once.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self._locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        self._index = None
+        self._index_lock = threading.Lock()
+
+    def _status_file(self, seq_no: str) -> Path:
+        return self.root / seq_no / STATUS_FILE
+
+    @contextmanager
+    def _locked(self, seq_no: str):
+        with self._locks[hash(seq_no) % LOCK_STRIPES]:
+            with (self.root / seq_no / LOCK_FILE).open("a+b") as f:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                try:
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(f, fcntl.LOCK_UN)
+                    else:
+                        f.seek(0)
+                        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _write(self, seq_no: str, state: dict):
+        """Writes the state and returns its version (called with the task's lock held)."""
+        path = self._status_file(seq_no)
+        tmp = path.with_name(f".{STATUS_FILE}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_text(json.dumps(state, indent=2), encoding="utf-8")
+        os.replace(tmp, path)
+        self._index_put(state)
+        return self.version(seq_no)
+
+    def _index_put(self, state: dict) -> None:
+        with self._index_lock:
+            if self._index is not None:
+                self._index[state["seq_no"]] = _summary(state)
+
+    def create(self, seq_no: str, state: dict):
+        """Stores a new task's state and returns its version."""
+        (self.root / seq_no).mkdir(parents=True, exist_ok=True)
+        with self._locked(seq_no):
+            return self._write(seq_no, state)
+
+    def load(self, seq_no: str):
+        try:
+            return json.loads(self._status_file(seq_no).read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return None
+
+    def version(self, seq_no: str):
+        """
+        Changes whenever the stored state changes; None if the task does not
+        exist. Every write replaces the file, so its inode changes even when
+        a same-size write lands within the filesystem's mtime granularity.
+        """
+        try:
+            stat = self._status_file(seq_no).stat()
+        except FileNotFoundError:
+            return None
+        return (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def update(self, seq_no: str, apply) -> tuple:
+        """Atomically replaces the state with `apply(current_state)`. Returns (state, version)."""
+        if not self._status_file(seq_no).exists():
+            raise FileNotFoundError(f"Status file for task {seq_no} not found.")
+        with self._locked(seq_no):
+            state = apply(self.load(seq_no))
+            return state, self._write(seq_no, state)
+
+    def delete(self, seq_no: str) -> None:
+        """Removes the task's status.json (the caller removes the rest of its directory)."""
+        if not self._status_file(seq_no).exists():
+            return
+        with self._locked(seq_no):
+            self._status_file(seq_no).unlink(missing_ok=True)
+        with self._index_lock:
+            if self._index is not None:
+                self._index.pop(seq_no, None)
+
+    def list(self, status: str = None, platform: str = None, limit: int = 100, offset: int = 0) -> list:
+        with self._index_lock:
+            if self._index is None:
+                self._index = {}
+                for path in self.root.glob(f"*/{STATUS_FILE}"):
+                    try:
+                        state = json.loads(path.read_text(encoding="utf-8"))
+                        self._index[state["seq_no"]] = _summary(state)
+                    except (OSError, ValueError, KeyError):
+                        continue
+            rows = [
+                row for row in self._index.values()
+                if (status is None or row["status"] == status) and (platform is None or row["platform"] == platform)
+            ]
+        rows.sort(key=lambda row: row["created_at"] or 0, reverse=True)
+        return rows[offset:offset + limit]
+
+
+class SQLiteStore:
+    """
+    All task states in one SQLite database in WAL mode, with the status,
+    platform and creation time in indexed columns for listing. Updates run
+    in an IMMEDIATE transaction, so read-modify-write is atomic across
+    threads and processes.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS tasks ("
+                " seq_no TEXT PRIMARY KEY, status TEXT, platform TEXT,"
+                " created_at REAL, version INTEGER, state TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS tasks_platform ON tasks (platform, created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS tasks_created_at ON tasks (created_at)")
+            self._local.conn = conn
+        return conn
+
+    def _write(self, conn: sqlite3.Connection, state: dict, version: int) -> None:
+        conn.execute(
+            "INSERT OR REPLACE INTO tasks (seq_no, status, platform, created_at, version, state)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (state["seq_no"], state.get("status"), state.get("platform"), state.get("created_at"),
+             version, json.dumps(state)),
+        )
+
+    def create(self, seq_no: str, state: dict):
+        self._write(self._conn(), state, 1)
+        return 1
+
+    def load(self, seq_no: str):
+        row = self._conn().execute("SELECT state FROM tasks WHERE seq_no = ?", (seq_no,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def version(self, seq_no: str):
+        row = self._conn().execute("SELECT version FROM tasks WHERE seq_no = ?", (seq_no,)).fetchone()
+        return row[0] if row else None
+
+    def update(self, seq_no: str, apply) -> tuple:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT state, version FROM tasks WHERE seq_no = ?", (seq_no,)).fetchone()
+            if row is None:
+                raise FileNotFoundError(f"State for task {seq_no} not found.")
+            state = apply(json.loads(row[0]))
+            self._write(conn, state, row[1] + 1)
+            conn.execute("COMMIT")
+            return state, row[1] + 1
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def delete(self, seq_no: str) -> None:
+        self._conn().execute("DELETE FROM tasks WHERE seq_no = ?", (seq_no,))
+
+    def list(self, status: str = None, platform: str = None, limit: int = 100, offset: int = 0) -> list:
+        clauses, params = [], []
+        if status is not None:
+            clauses.append("status = ?")
+            params.append(status)
+        if platform is not None:
+            clauses.append("platform = ?")
+            params.append(platform)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._conn().execute(
+            f"SELECT seq_no, status, platform, created_at FROM tasks{where}"
+            " ORDER BY created_at DESC LIMIT ? OFFSET ?",
+            (*params, limit, offset),
+        ).fetchall()
+        return [{"seq_no": s, "status": st, "platform": p, "created_at": c} for s, st, p, c in rows]
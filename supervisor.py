@@ -0,0 +1,247 @@
+import os
+import sys
+import json
+import time
+import logging
+import threading
+import subprocess
+from contextlib import ExitStack
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+
+from config import (
+    SUPERVISOR_TASK_TIMEOUT_SECONDS, SUPERVISOR_LOG_MAX_BYTES, SUPERVISOR_LOG_BACKUPS,
+    RUNTIME_STEP_TIMEOUT_MS, RUNTIME_MAX_PAUSE_SECONDS,
+)
+
+import appium_pool
+import browser_pool
+import events
+import scheduler
+import state_manager
+import telemetry
+
+KILL_GRACE_SECONDS = 5
+STEP_LOG_FILE = "steps.jsonl"
+SLOWEST_STEPS = 5
+
+_lock = threading.Lock()
+_running = {}  # seq_no -> Popen of the automation script
+_stats = {"succeeded": 0, "failed": 0, "timed_out": 0}
+
+
+def _make_logger(path: Path) -> logging.Logger:
+    """A standalone (unregistered) logger writing bare lines to a rotating file."""
+    logger = logging.Logger(path.stem)
+    handler = RotatingFileHandler(
+        path, maxBytes=SUPERVISOR_LOG_MAX_BYTES, backupCount=SUPERVISOR_LOG_BACKUPS, encoding="utf-8"
+    )
+    handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+    logger.addHandler(handler)
+    return logger
+
+
+def _close_logger(logger: logging.Logger) -> None:
+    for handler in list(logger.handlers):
+        handler.close()
+        logger.removeHandler(handler)
+
+
+def _pump(seq_no: str, stream_name: str, stream, logger: logging.Logger) -> None:
+    """Copies a child's output stream line by line into its log and the task's event stream."""
+    for line in iter(stream.readline, ""):
+        line = line.rstrip("\n")
+        logger.info(line)
+        events.publish(seq_no, "log", {"stream": stream_name, "line": line})
+    stream.close()
+
+
+def _summarize_steps(path: Path):
+    """Totals and the slowest steps from the aisa_runtime step log, or None if the script wrote none."""
+    try:
+        lines = path.read_text(encoding="utf-8").splitlines()
+    except OSError:
+        return None
+    steps = []
+    for line in lines:
+        try:
+            steps.append(json.loads(line))
+        except ValueError:
+            continue
+    if not steps:
+        return None
+    return {
+        "count": len(steps),
+        "failed": sum(1 for s in steps if not s.get("ok")),
+        "total_seconds": round(sum(s.get("seconds", 0) for s in steps), 3),
+        "slowest": sorted(steps, key=lambda s: s.get("seconds", 0), reverse=True)[:SLOWEST_STEPS],
+    }
+
+
+def _popen(cmd: list, cwd: Path, **kwargs) -> subprocess.Popen:
+    # A new process group/session lets us kill the script and anything it spawned.
+    if sys.platform == "win32":
+        kwargs["creationflags"] = subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        kwargs["start_new_session"] = True
+    return subprocess.Popen([str(c) for c in cmd], cwd=str(cwd), **kwargs)
+
+
+def _terminate(proc: subprocess.Popen) -> None:
+    """Stops a child and its process group: terminate first, kill after a grace period."""
+    if proc.poll() is not None:
+        return
+    try:
+        if sys.platform == "win32":
+            proc.terminate()
+        else:
+            os.killpg(proc.pid, 15)
+        proc.wait(timeout=KILL_GRACE_SECONDS)
+    except subprocess.TimeoutExpired:
+        if sys.platform == "win32":
+            proc.kill()
+        else:
+            os.killpg(proc.pid, 9)
+        proc.wait()
+    except ProcessLookupError:
+        pass
+
+
+def _run(seq_no: str, python: Path, script_path: Path, work_dir: Path, platform: str, slot) -> None:
+    """Runs one automation script on a scheduler slot and records the outcome in status.json."""
+    log_dir = work_dir / "logs"
+    log_dir.mkdir(parents=True, exist_ok=True)
+    started = time.time()
+    run_info = state_manager.get_task_state(seq_no).get("run", {})
+    run_info.update({
+        "started_at": started,
+        "queue_wait": started - run_info.get("queued_at", started),
+        "slot": slot.id,
+    })
+    state_manager.update_task_state(seq_no, {"status": "running", "run": run_info})
+    telemetry.record("run.queue_wait", run_info["queue_wait"], seq_no=seq_no, platform=platform)
+    print(f"[{seq_no}] Supervisor started automation script.")
+
+    proc, error, timed_out = None, None, False
+    step_log = work_dir / STEP_LOG_FILE
+    stdout_log, stderr_log = _make_logger(log_dir / "stdout.log"), _make_logger(log_dir / "stderr.log")
+    try:
+        with ExitStack() as stack:
+            step_log.unlink(missing_ok=True)
+            env = {
+                **os.environ,
+                "PYTHONUNBUFFERED": "1",
+                "AISA_HEADLESS": "1",
+                "AISA_STEP_LOG": str(step_log),
+                "AISA_STEP_TIMEOUT_MS": str(RUNTIME_STEP_TIMEOUT_MS),
+                "AISA_MAX_PAUSE_SECONDS": str(RUNTIME_MAX_PAUSE_SECONDS),
+            }
+            if platform == "mobile":
+                server = stack.enter_context(appium_pool.lease(seq_no, url=slot.url))
+                env.update(server.env())
+                run_info.update({"appium_url": server.url, "device": server.udid})
+            else:
+                cdp_url = stack.enter_context(browser_pool.lease(seq_no))
+                if cdp_url:
+                    env["AISA_BROWSER_CDP_URL"] = cdp_url
+                run_info["browser"] = cdp_url
+            proc = _popen(
+                [python, script_path], work_dir, env=env, text=True, encoding="utf-8", errors="replace",
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            )
+            with _lock:
+                _running[seq_no] = proc
+            pumps = [
+                threading.Thread(target=_pump, args=(seq_no, "stdout", proc.stdout, stdout_log), daemon=True),
+                threading.Thread(target=_pump, args=(seq_no, "stderr", proc.stderr, stderr_log), daemon=True),
+            ]
+            for pump in pumps:
+                pump.start()
+            try:
+                proc.wait(timeout=SUPERVISOR_TASK_TIMEOUT_SECONDS)
+            except subprocess.TimeoutExpired:
+                timed_out = True
+                _terminate(proc)
+            for pump in pumps:
+                pump.join(timeout=KILL_GRACE_SECONDS)
+    except Exception as e:
+        error = str(e)
+    finally:
+        with _lock:
+            _running.pop(seq_no, None)
+        if proc is not None:
+            _terminate(proc)
+        _close_logger(stdout_log)
+        _close_logger(stderr_log)
+
+    exit_code = proc.returncode if proc is not None else None
+    if timed_out:
+        error = f"Automation script timed out after {SUPERVISOR_TASK_TIMEOUT_SECONDS}s."
+    elif error is None and exit_code != 0:
+        error = f"Automation script exited with code {exit_code}."
+    status = "succeeded" if error is None else "failed"
+    finished = time.time()
+    steps = _summarize_steps(step_log)
+    telemetry.record(
+        "script.run", finished - started, "ok" if error is None else "error", seq_no,
+        platform=platform, exit_code=exit_code, timed_out=timed_out, steps=(steps or {}).get("count"),
+    )
+    run_info.update({
+        "finished_at": finished,
+        "duration": finished - started,
+        "exit_code": exit_code,
+        "timed_out": timed_out,
+        "steps": steps,
+        "logs": {"stdout": str(log_dir / "stdout.log"), "stderr": str(log_dir / "stderr.log")},
+        # Env provisioning, queue wait and the run itself, from the task's spans.
+        **telemetry.summarize(telemetry.pop_task_spans(seq_no)),
+    })
+    update = {"status": status, "run": run_info}
+    if error:
+        update["error"] = error
+    state_manager.update_task_state(seq_no, update)
+    with _lock:
+        _stats["timed_out" if timed_out else status] += 1
+    print(f"[{seq_no}] Automation script finished: {status} (exit code {exit_code}).")
+
+
+def submit(seq_no: str, python: Path, script_path: Path, work_dir: Path, platform: str,
+           priority: int = 0, submitter: str = "default") -> dict:
+    """
+    Marks the task as scheduled and queues its script with the scheduler,
+    which starts it once a web or mobile slot is free. Raises
+    scheduler.QueueFull / scheduler.NoCapacity (leaving the task's status as
+    it was). Returns the updated task state.
+    """
+    with _lock:
+        if seq_no in _running:
+            raise RuntimeError(f"Task {seq_no} is already running.")
+    previous_status = state_manager.get_task_state(seq_no)["status"]
+    state = state_manager.update_task_state(seq_no, {
+        "status": "scheduled",
+        "run": {"queued_at": time.time(), "priority": priority, "submitter": submitter},
+    })
+    try:
+        scheduler.enqueue(
+            seq_no, platform,
+            lambda slot: _run(seq_no, python, script_path, work_dir, platform, slot),
+            priority=priority, submitter=submitter,
+        )
+    except (scheduler.QueueFull, scheduler.NoCapacity):
+        state_manager.update_task_state(seq_no, {"status": previous_status, "run": None})
+        raise
+    return state
+
+
+def shutdown() -> None:
+    """Stops dispatching and kills every running script; queued runs are dropped."""
+    scheduler.shutdown()
+    with _lock:
+        procs = list(_running.values())
+    for proc in procs:
+        _terminate(proc)
+
+
+def get_stats() -> dict:
+    with _lock:
+        return {"running": len(_running), **_stats}
@@ -0,0 +1,269 @@
+import json
+import time
+import uuid
+import logging
+import functools
+import threading
+import contextvars
+from collections import OrderedDict
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+
+from config import (
+    TRACING_ENABLED, TRACE_EXPORT_PATH, TRACE_EXPORT_MAX_BYTES, TRACE_EXPORT_BACKUPS, METRICS_BUCKETS,
+)
+
+# Finished spans are kept per task until the task's summary is written to
+# status.json; both limits only matter for tasks that never get there.
+MAX_TRACKED_TASKS = 1000
+MAX_SPANS_PER_TASK = 500
+
+# name -> (type, help, label names). Labels are limited to low-cardinality
+# span attributes; a task's seq_no is never a label.
+METRICS = {
+    "aisa_stage_duration_seconds": ("histogram", "Duration of each traced pipeline stage.", ("stage",)),
+    "aisa_stage_total": ("counter", "Traced pipeline stages by outcome.", ("stage", "status")),
+    "aisa_llm_call_duration_seconds": ("histogram", "Latency of LLM calls.", ("provider", "model")),
+    "aisa_llm_calls_total": ("counter", "LLM calls by outcome.", ("provider", "model", "status")),
+    "aisa_llm_tokens_total": ("counter", "Tokens sent to and received from LLM providers.", ("provider", "model", "type")),
+    "aisa_tool_duration_seconds": ("histogram", "Latency of Agent 2 tool calls.", ("tool",)),
+    "aisa_tool_calls_total": ("counter", "Agent 2 tool calls by outcome.", ("tool", "status")),
+}
+
+_current = contextvars.ContextVar("aisa_span", default=None)  # (trace_id, span_id) of the innermost open span
+_lock = threading.Lock()
+_series = {name: {} for name in METRICS}  # name -> {label values: counter value or histogram state}
+_task_spans = OrderedDict()  # seq_no -> finished spans, least recently updated first
+_exporter = None
+_worker_process = False
+_worker_spans = []  # finished in this worker process and not yet handed to the parent
+
+
+def mark_worker_process() -> None:
+    """Initializer for job queue process-pool workers: their spans are exported by the parent (see replay())."""
+    global _worker_process
+    _worker_process = True
+
+
+# --- Metrics ---
+
+def _inc(name: str, labels: tuple, value: float = 1) -> None:
+    series = _series[name]
+    series[labels] = series.get(labels, 0) + value
+
+
+def _observe(name: str, labels: tuple, value: float) -> None:
+    state = _series[name].get(labels)
+    if state is None:
+        state = _series[name][labels] = {"buckets": [0] * len(METRICS_BUCKETS), "sum": 0.0, "count": 0}
+    for index, bound in enumerate(METRICS_BUCKETS):
+        if value <= bound:
+            state["buckets"][index] += 1
+            break
+    state["sum"] += value
+    state["count"] += 1
+
+
+def _record_metrics(span: dict) -> None:
+    """Updates the metric families from one finished span. Called under _lock."""
+    name, seconds, status, attributes = span["name"], span["duration_seconds"], span["status"], span["attributes"]
+    _observe("aisa_stage_duration_seconds", (name,), seconds)
+    _inc("aisa_stage_total", (name, status))
+    if name == "llm.call":
+        provider, model = str(attributes.get("provider", "unknown")), str(attributes.get("model", "unknown"))
+        _observe("aisa_llm_call_duration_seconds", (provider, model), seconds)
+        _inc("aisa_llm_calls_total", (provider, model, status))
+        for kind in ("prompt", "completion"):
+            tokens = attributes.get(f"{kind}_tokens")
+            if isinstance(tokens, (int, float)):
+                _inc("aisa_llm_tokens_total", (provider, model, kind), tokens)
+    elif name == "agent2.tool":
+        tool = str(attributes.get("tool", "unknown"))
+        _observe("aisa_tool_duration_seconds", (tool,), seconds)
+        _inc("aisa_tool_calls_total", (tool, status))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def render(gauges: list = None) -> str:
+    """
+    The metric families in the Prometheus text exposition format. `gauges`
+    adds point-in-time values as (name, help, [(labels dict, value)]).
+    """
+    lines = []
+    with _lock:
+        for name, (kind, help_text, label_names) in METRICS.items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            for values, state in sorted(_series[name].items()):
+                if kind == "counter":
+                    lines.append(f"{name}{_labels(label_names, values)} {state}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(METRICS_BUCKETS, state["buckets"]):
+                    cumulative += count
+                    bucket_labels = _labels(label_names, values, f'le="{bound}"')
+                    lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+                bucket_labels = _labels(label_names, values, 'le="+Inf"')
+                lines.append(f"{name}_bucket{bucket_labels} {state['count']}")
+                lines.append(f"{name}_sum{_labels(label_names, values)} {state['sum']}")
+                lines.append(f"{name}_count{_labels(label_names, values)} {state['count']}")
+    for name, help_text, samples in gauges or []:
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+        for labels, value in samples:
+            lines.append(f"{name}{_labels(tuple(labels), tuple(labels.values()))} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# --- Spans ---
+
+def _export(span: dict) -> None:
+    global _exporter
+    if not TRACE_EXPORT_PATH:
+        return
+    with _lock:
+        if _exporter is None:
+            path = Path(TRACE_EXPORT_PATH).expanduser()
+            path.parent.mkdir(parents=True, exist_ok=True)
+            _exporter = logging.Logger("aisa-traces")
+            handler = RotatingFileHandler(
+                path, maxBytes=TRACE_EXPORT_MAX_BYTES, backupCount=TRACE_EXPORT_BACKUPS, encoding="utf-8"
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            _exporter.addHandler(handler)
+    _exporter.info(json.dumps(span, default=str))
+
+
+def _finish(span: dict, track: bool = True) -> None:
+    with _lock:
+        _record_metrics(span)
+        if _worker_process:
+            _worker_spans.append(span)
+        trace_id = span["trace_id"]
+        if trace_id and track:
+            spans = _task_spans.setdefault(trace_id, [])
+            if len(spans) < MAX_SPANS_PER_TASK:
+                spans.append(span)
+            _task_spans.move_to_end(trace_id)
+            while len(_task_spans) > MAX_TRACKED_TASKS:
+                _task_spans.popitem(last=False)
+    if not _worker_process:
+        _export(span)
+
+
+def _new_span(name: str, seq_no, attributes: dict) -> dict:
+    parent = _current.get()
+    return {
+        "name": name,
+        "trace_id": seq_no or (parent[0] if parent else None),
+        "span_id": uuid.uuid4().hex[:16],
+        "parent_id": parent[1] if parent else None,
+        "start": time.time(),
+        "duration_seconds": 0.0,
+        "status": "ok",
+        "attributes": attributes,
+    }
+
+
+@contextmanager
+def span(name: str, seq_no: str = None, **attributes):
+    """
+    Times the block as a span named `name`, nested under the enclosing span
+    (or task()) and attributed to its task unless `seq_no` is given. Yields
+    the attributes dict, so the block can add to it, e.g. token counts. An
+    exception marks the span "error" and is re-raised.
+    """
+    if not TRACING_ENABLED:
+        yield attributes
+        return
+    record = _new_span(name, seq_no, attributes)
+    token = _current.set((record["trace_id"], record["span_id"]))
+    started = time.perf_counter()
+    try:
+        yield attributes
+    except Exception as e:
+        record["status"], record["error"] = "error", f"{type(e).__name__}: {e}"[:500]
+        raise
+    except BaseException:
+        # A generator closed mid-span (e.g. a stream the caller stopped reading).
+        record["status"] = "cancelled"
+        raise
+    finally:
+        record["duration_seconds"] = time.perf_counter() - started
+        try:
+            _current.reset(token)
+        except ValueError:
+            # Opened inside a generator that was resumed from another context.
+            pass
+        _finish(record)
+
+
+def record(name: str, seconds: float, status: str = "ok", seq_no: str = None, **attributes) -> None:
+    """Records a span for a duration measured elsewhere (queue waits, child processes)."""
+    if not TRACING_ENABLED:
+        return
+    entry = _new_span(name, seq_no, attributes)
+    entry.update({"start": time.time() - seconds, "duration_seconds": seconds, "status": status})
+    _finish(entry)
+
+
+@contextmanager
+def task(seq_no: str):
+    """Attributes every span opened in the block (on this thread or a bind()-ed callable) to `seq_no`."""
+    token = _current.set((seq_no, None))
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def bind(fn):
+    """`fn` bound to the caller's trace context, for handing to a thread pool."""
+    return functools.partial(contextvars.copy_context().run, fn)
+
+
+def pop_task_spans(seq_no: str) -> list:
+    with _lock:
+        return _task_spans.pop(seq_no, [])
+
+
+def drain_worker_spans() -> list:
+    """In a process-pool worker, the spans finished since the last call (to return to the parent)."""
+    with _lock:
+        spans = list(_worker_spans)
+        _worker_spans.clear()
+        return spans
+
+
+def replay(spans: list) -> None:
+    """Records spans finished in a process-pool worker in this process's metrics and export."""
+    for entry in spans:
+        _finish(entry, track=False)
+
+
+def summarize(spans: list) -> dict:
+    """Per-stage {"count", "seconds"} totals of a task's spans, plus its LLM token totals."""
+    stages, tokens = {}, {"prompt": 0, "completion": 0}
+    for entry in spans:
+        stage = stages.setdefault(entry["name"], {"count": 0, "seconds": 0.0})
+        stage["count"] += 1
+        stage["seconds"] = round(stage["seconds"] + entry["duration_seconds"], 4)
+        if entry["status"] != "ok":
+            stage[entry["status"]] = stage.get(entry["status"], 0) + 1
+        for kind in tokens:
+            value = entry["attributes"].get(f"{kind}_tokens")
+            if isinstance(value, (int, float)):
+                tokens[kind] += value
+    summary = {"stages": stages}
+    if any(tokens.values()):
+        summary["llm_tokens"] = tokens
+    return summary
@@ -0,0 +1,16 @@
+"""
+Test setup: the repo root is importable, artifacts (task dirs, caches, state)
+go to a throwaway home directory and the on-disk LLM cache is off. This runs
+before any test imports config.
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+_home = tempfile.mkdtemp(prefix="aisa-tests-")
+os.environ["HOME"] = os.environ["USERPROFILE"] = _home
+(Path(_home) / "AISA_TASKS").mkdir()
+os.environ["AISA_LLM_CACHE_ENABLED"] = "false"
@@ -0,0 +1,65 @@
+import time
+import socket
+
+import pytest
+
+import appium_pool
+from benchmarks.standins import FakeAppiumServer
+
+
+@pytest.fixture
+def stub_appium():
+    server = FakeAppiumServer()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def pool(monkeypatch, stub_appium):
+    """The pool pointed at the stub as an externally managed server, bound to one fake device."""
+    monkeypatch.setattr(appium_pool, "APPIUM_SERVER_URLS", [stub_appium.url])
+    monkeypatch.setattr(appium_pool, "APPIUM_STARTUP_TIMEOUT_SECONDS", 5)
+    monkeypatch.setattr(appium_pool, "discover_devices", lambda: ["emulator-5554"])
+    monkeypatch.setattr(appium_pool, "_servers", [])
+    monkeypatch.setattr(appium_pool, "_stopping", appium_pool.threading.Event())
+    appium_pool._start()
+    yield appium_pool
+    appium_pool._stopping.set()
+
+
+def _closed_port_url() -> str:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+
+def test_probe_reports_the_stub_ready(stub_appium):
+    assert appium_pool.probe(stub_appium.url)
+    assert stub_appium.requests == 1
+
+
+def test_probe_fails_without_a_server():
+    assert not appium_pool.probe(_closed_port_url(), timeout=0.5)
+
+
+def test_wait_ready_returns_as_soon_as_the_probe_passes(stub_appium):
+    started = time.monotonic()
+    assert appium_pool.wait_ready(stub_appium.url, timeout=5)
+    assert time.monotonic() - started < 1
+
+
+def test_wait_ready_gives_up_after_the_timeout():
+    started = time.monotonic()
+    assert not appium_pool.wait_ready(_closed_port_url(), timeout=0.6)
+    assert time.monotonic() - started < 3
+
+
+def test_lease_hands_out_the_ready_server_and_its_device(pool, stub_appium):
+    with pool.lease("task-1", timeout=1) as server:
+        assert server.env() == {"AISA_APPIUM_URL": stub_appium.url, "AISA_DEVICE_UDID": "emulator-5554"}
+        assert pool.get_stats()["leased"] == 1
+        with pytest.raises(RuntimeError):
+            with pool.lease("task-2", timeout=0.2):
+                pass
+    with pool.lease("task-2", timeout=0.2) as server:
+        assert server.leases == 2
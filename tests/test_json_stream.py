@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+from json_stream import IncrementalJSONParser, StreamingJSONError
+
+BLUEPRINT = {
+    "summary": {"goal": "Sign in", "platform": "web"},
+    "steps": [{"action": "click", "description": "Tap [Next] {x}"}, {"action": "type_text", "description": "\"quoted\""}],
+}
+
+
+def _feed(text: str, parser: IncrementalJSONParser, chunk_size: int = 7):
+    for start in range(0, len(text), chunk_size):
+        parser.feed(text[start:start + chunk_size])
+    return parser.close()
+
+
+def test_reports_fields_and_items_as_they_complete():
+    fields, items = [], []
+    parser = IncrementalJSONParser(lambda key, value: fields.append(key), lambda key, index, value: items.append((key, index)))
+
+    assert _feed("Sure:\n" + json.dumps(BLUEPRINT) + "\nDone.", parser) == BLUEPRINT
+    assert fields == ["summary", "steps"]
+    assert items == [("steps", 0), ("steps", 1)]
+
+
+def test_prose_brackets_and_quotes_before_the_object_are_ignored():
+    text = 'Steps [see below] and a "quote: ' + json.dumps(BLUEPRINT)
+    assert _feed(text, IncrementalJSONParser()) == BLUEPRINT
+
+
+def test_root_array_is_not_a_payload():
+    with pytest.raises(StreamingJSONError, match="no JSON object"):
+        _feed("[1, 2, 3]", IncrementalJSONParser())
+
+
+def test_truncated_stream_raises():
+    with pytest.raises(StreamingJSONError):
+        _feed(json.dumps(BLUEPRINT)[:-5], IncrementalJSONParser())
+
+
+def test_callback_error_aborts():
+    def reject(key, index, value):
+        raise ValueError("bad step")
+
+    parser = IncrementalJSONParser(on_item=reject)
+    with pytest.raises(ValueError, match="bad step"):
+        _feed(json.dumps(BLUEPRINT), parser)
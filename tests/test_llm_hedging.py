@@ -0,0 +1,81 @@
+import time
+import asyncio
+
+import pytest
+
+import llm_utils
+from llm_utils import AsyncProvider, HEDGE_MIN_SAMPLES
+
+
+class StubProvider(AsyncProvider):
+    """A local provider that answers `reply` after `delay` seconds and records what happened to each call."""
+
+    def __init__(self, name: str, delay: float, reply: str = None, p95: float = 0.05):
+        super().__init__(name, f"{name}-stub", self._complete, timeout=5)
+        self.delay = delay
+        self.reply = reply if reply is not None else f"reply from {name}"
+        self.started_at = []
+        self.cancelled = 0
+        self.latencies.extend([p95] * HEDGE_MIN_SAMPLES)
+
+    async def _complete(self, prompt: str, system_prompt: str) -> str:
+        self.started_at.append(time.perf_counter())
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return self.reply
+
+
+@pytest.fixture
+def providers():
+    def install(*stubs):
+        llm_utils.set_async_providers(list(stubs))
+        return stubs
+    yield install
+    llm_utils.set_async_providers(None)
+
+
+def _call(**kwargs):
+    return llm_utils.run_async(llm_utils.get_llm_response_async("prompt", "system", use_cache=False, **kwargs))
+
+
+def test_hedge_fires_after_deadline_and_cancels_slower_call(providers):
+    slow, fast = providers(StubProvider("primary", delay=2), StubProvider("secondary", delay=0.01))
+    started = time.perf_counter()
+
+    assert _call(hedge=True) == "reply from secondary"
+
+    assert fast.started_at[0] - started >= slow.hedge_delay()
+    assert time.perf_counter() - started < 1
+    # The losing call is cancelled once the winner has answered.
+    deadline = time.monotonic() + 1
+    while not slow.cancelled and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert slow.cancelled == 1
+
+
+def test_no_hedge_when_primary_answers_within_deadline(providers):
+    primary, secondary = providers(StubProvider("primary", delay=0.01, p95=0.5), StubProvider("secondary", delay=0))
+
+    assert _call(hedge=True) == "reply from primary"
+    assert secondary.started_at == []
+
+
+def test_rejected_reply_counts_as_failure(providers):
+    def validate(text):
+        if text == "garbage":
+            raise ValueError("not a blueprint")
+
+    providers(StubProvider("primary", delay=0, reply="garbage"), StubProvider("secondary", delay=0.01))
+
+    assert _call(hedge=True, validate=validate) == "reply from secondary"
+    assert _call(hedge=False, validate=validate) == "reply from secondary"
+
+
+def test_hedge_delay_uses_p95_once_enough_samples():
+    provider = StubProvider("primary", delay=0, p95=0.2)
+    assert provider.hedge_delay() == pytest.approx(0.2)
+    provider.latencies.clear()
+    assert provider.hedge_delay() == llm_utils.LLM_HEDGE_DEFAULT_DELAY_SECONDS
@@ -0,0 +1,71 @@
+import time
+import uuid
+import threading
+
+import pytest
+
+import scheduler
+import state_manager
+
+
+@pytest.fixture
+def one_web_slot(monkeypatch):
+    """A scheduler with a single web slot and room for two waiting runs."""
+    monkeypatch.setattr(scheduler, "_slots", {"web-0": scheduler.Slot("web-0", "web")})
+    monkeypatch.setattr(scheduler, "SCHEDULER_MAX_QUEUE", 2)
+    yield scheduler._slots["web-0"]
+    scheduler.shutdown()
+
+
+def _wait_for(condition, timeout: float = 5) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def _blocking_run(release: threading.Event, ran: list, name: str):
+    def run(slot) -> None:
+        ran.append(name)
+        release.wait(5)
+    return run
+
+
+def test_full_queue_rejects_new_runs(one_web_slot):
+    release, ran = threading.Event(), []
+    scheduler.enqueue("t1", "web", _blocking_run(release, ran, "t1"))
+    _wait_for(lambda: one_web_slot.busy_with == "t1")
+
+    scheduler.enqueue("t2", "web", _blocking_run(release, ran, "t2"))
+    scheduler.enqueue("t3", "web", _blocking_run(release, ran, "t3"))
+    assert not scheduler.has_room()
+    with pytest.raises(scheduler.QueueFull):
+        scheduler.enqueue("t4", "web", _blocking_run(release, ran, "t4"))
+    assert scheduler.get_stats()["queue_depth"]["web"] == 2
+
+    release.set()
+    _wait_for(lambda: len(ran) == 3)
+    assert ran == ["t1", "t2", "t3"]
+    assert scheduler.has_room(2)
+
+
+def test_no_slot_of_a_kind_is_rejected(one_web_slot):
+    with pytest.raises(scheduler.NoCapacity):
+        scheduler.enqueue("m1", "mobile", lambda slot: None)
+
+
+def test_shutdown_puts_waiting_tasks_back_to_ready(one_web_slot):
+    release, ran = threading.Event(), []
+    scheduler.enqueue("busy", "web", _blocking_run(release, ran, "busy"))
+    _wait_for(lambda: one_web_slot.busy_with == "busy")
+    seq_no = uuid.uuid4().hex[:10]
+    state_manager.create_task_state(seq_no, "web", "instructions")
+    state_manager.update_task_state(seq_no, {"status": "scheduled", "run": {"id": 1}})
+    scheduler.enqueue(seq_no, "web", _blocking_run(release, ran, seq_no))
+
+    scheduler.shutdown()
+    release.set()
+
+    state = state_manager.get_task_state(seq_no)
+    assert (state["status"], state["run"]) == ("ready", None)
+    assert seq_no not in ran
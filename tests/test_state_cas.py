@@ -0,0 +1,78 @@
+import uuid
+import threading
+
+import pytest
+
+import state_manager
+from state_store import JsonFileStore, SQLiteStore, StateConflict
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def store(request, tmp_path, monkeypatch):
+    store = JsonFileStore(tmp_path) if request.param == "json" else SQLiteStore(tmp_path / "state.sqlite3")
+    monkeypatch.setattr(state_manager, "ARTIFACTS_DIR", tmp_path)
+    monkeypatch.setattr(state_manager, "_store", store)
+    state_manager._cache.clear()
+    return store
+
+
+def _task(status: str) -> str:
+    seq_no = uuid.uuid4().hex[:10]
+    state_manager.create_task_state(seq_no, "web", "instructions")
+    state_manager.update_task_state(seq_no, {"status": status})
+    return seq_no
+
+
+def test_transition_applies_when_status_matches(store):
+    seq_no = _task("ready")
+
+    state = state_manager.transition_task_state(seq_no, ("ready", "failed"), {"status": "scheduled", "run": 1})
+
+    assert state["status"] == "scheduled"
+    assert state_manager.get_task_state(seq_no)["run"] == 1
+
+
+def test_conflict_leaves_state_unchanged(store):
+    seq_no = _task("running")
+
+    with pytest.raises(StateConflict) as conflict:
+        state_manager.transition_task_state(seq_no, "ready", {"status": "scheduled"})
+
+    assert conflict.value.status == "running"
+    assert state_manager.get_task_state(seq_no)["status"] == "running"
+    assert store.load(seq_no)["status"] == "running"
+
+
+def test_concurrent_transitions_have_one_winner(store):
+    seq_no = _task("ready")
+    outcomes, barrier = [], threading.Barrier(8)
+
+    def contend(worker: int) -> None:
+        barrier.wait()
+        try:
+            state_manager.transition_task_state(seq_no, "ready", {"status": "scheduled", "run": worker})
+            outcomes.append("won")
+        except StateConflict:
+            outcomes.append("conflict")
+
+    threads = [threading.Thread(target=contend, args=(worker,)) for worker in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(outcomes) == ["conflict"] * 7 + ["won"]
+    assert state_manager.get_task_state(seq_no)["status"] == "scheduled"
+
+
+def test_write_from_another_process_is_not_served_stale(store, tmp_path):
+    seq_no = _task("ready")
+    assert state_manager.get_task_state(seq_no)["status"] == "ready"  # now cached
+
+    # A second store instance stands in for another worker process. The new
+    # status has the same length, so a JSON write can keep the file's size
+    # (and, on coarse filesystems, its mtime).
+    other = JsonFileStore(tmp_path) if isinstance(store, JsonFileStore) else SQLiteStore(store.path)
+    other.update(seq_no, lambda state: {**state, "status": "state"})
+
+    assert state_manager.get_task_state(seq_no)["status"] == "state"
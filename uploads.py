@@ -0,0 +1,236 @@
+import os
+import re
+import uuid
+import hashlib
+from pathlib import Path
+from fastapi import HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+from config import UPLOAD_MAX_BYTES, UPLOAD_MAX_PAGES
+
+PDF_MAGIC = b"%PDF-"
+PDF_EOF = b"%%EOF"
+# Readers accept the header anywhere in the first KiB and the trailer in the last one.
+HEADER_WINDOW = 1024
+TRAILER_WINDOW = 1024
+# Bytes of the previous chunk rescanned with the next, so markers split across chunks are found.
+SCAN_OVERLAP = 1024
+WRITE_BUFFER_BYTES = 1024 * 1024
+MAX_FIELD_BYTES = 1024 * 1024
+_FILE_PART = object()
+
+PAGE_OBJECT = re.compile(rb"/Type\s*/Page(?![A-Za-z])")
+PAGE_TREE_COUNT = re.compile(
+    rb"/Type\s*/Pages(?:(?!>>).){0,256}?/Count\s+(\d+)|/Count\s+(\d+)(?:(?!>>).){0,256}?/Type\s*/Pages",
+    re.DOTALL,
+)
+
+
+class PDFStreamValidator:
+    """
+    Hashes an upload and checks it is a plausible PDF as its bytes arrive:
+    size limit, "%PDF-" header, page count and "%%EOF" trailer. Raises
+    HTTPException (413 or 400) as soon as a check fails.
+
+    The page count is the largest /Count of a page tree node, or else the
+    number of /Type /Page objects. It is None for PDFs that keep their page
+    tree in compressed object streams; those are left to the extractor.
+    """
+
+    def __init__(self, max_bytes: int = UPLOAD_MAX_BYTES, max_pages: int = UPLOAD_MAX_PAGES):
+        self.max_bytes = max_bytes
+        self.max_pages = max_pages
+        self.size = 0
+        self._sha256 = hashlib.sha256()
+        self._head = b""
+        self._tail = b""
+        self._page_objects = 0
+        self._tree_count = None
+
+    @property
+    def pages(self):
+        if self._tree_count is not None:
+            return self._tree_count
+        return self._page_objects or None
+
+    def feed(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise HTTPException(status_code=413, detail=f"The PDF is larger than the {self.max_bytes}-byte limit.")
+        self._sha256.update(chunk)
+        if len(self._head) < HEADER_WINDOW:
+            self._head += chunk[:HEADER_WINDOW - len(self._head)]
+            if len(self._head) >= HEADER_WINDOW and PDF_MAGIC not in self._head:
+                raise HTTPException(status_code=400, detail="The upload is not a PDF (no %PDF- header).")
+
+        window = self._tail + chunk
+        # Only count matches ending in the new bytes; the rest were counted with the previous chunk.
+        self._page_objects += sum(1 for m in PAGE_OBJECT.finditer(window) if m.end() > len(self._tail))
+        for match in PAGE_TREE_COUNT.finditer(window):
+            count = int(match.group(1) or match.group(2))
+            self._tree_count = max(self._tree_count or 0, count)
+        self._tail = window[-SCAN_OVERLAP:]
+        if self.max_pages and (self.pages or 0) > self.max_pages:
+            raise HTTPException(status_code=413, detail=f"The PDF has more than {self.max_pages} pages.")
+
+    def finish(self) -> dict:
+        """Final checks once the upload is complete. Returns {"sha256", "size", "pages"}."""
+        if PDF_MAGIC not in self._head:
+            raise HTTPException(status_code=400, detail="The upload is not a PDF (no %PDF- header).")
+        if PDF_EOF not in self._tail[-TRAILER_WINDOW:]:
+            raise HTTPException(status_code=400, detail="The PDF is truncated (no %%EOF trailer).")
+        if self._tree_count == 0:
+            raise HTTPException(status_code=400, detail="The PDF has no pages.")
+        return {"sha256": self._sha256.hexdigest(), "size": self.size, "pages": self.pages}
+
+
+class _TempFileSink:
+    """Buffers upload bytes and writes them to a temp file from the threadpool, off the event loop."""
+
+    def __init__(self, directory: Path):
+        self.path = directory / f".upload-{uuid.uuid4().hex}.part"
+        self._file = None
+        self._buffer = bytearray()
+
+    async def write(self, data: bytes) -> None:
+        self._buffer += data
+        if len(self._buffer) >= WRITE_BUFFER_BYTES:
+            await self.flush()
+
+    def _write(self, data: bytes) -> None:
+        if self._file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = self.path.open("wb")
+        self._file.write(data)
+
+    async def flush(self) -> None:
+        data, self._buffer = bytes(self._buffer), bytearray()
+        await run_in_threadpool(self._write, data)
+
+    async def close(self) -> None:
+        await self.flush()
+        if self._file is not None:
+            await run_in_threadpool(self._file.close)
+
+    def discard(self) -> None:
+        if self._file is not None:
+            self._file.close()
+        self.path.unlink(missing_ok=True)
+
+
+def _disposition(headers: dict) -> tuple:
+    """(field name, filename or None) from a part's Content-Disposition header."""
+    _, options = parse_options_header(headers.get(b"content-disposition", b""))
+    name = options.get(b"name", b"").decode("utf-8", "replace")
+    filename = options.get(b"filename")
+    return name, filename.decode("utf-8", "replace") if filename is not None else None
+
+
+async def receive_pdf_form(request: Request, temp_dir: Path, file_field: str = "pdf") -> tuple:
+    """
+    Reads a multipart/form-data body straight from the request stream. Text
+    fields are collected (up to MAX_FIELD_BYTES each); the `file_field` part
+    is validated with PDFStreamValidator and written to a temp file in
+    `temp_dir` as it arrives, without being spooled or read a second time.
+    Returns (fields, upload) where upload is {"path", "filename", "sha256",
+    "size", "pages"}; move it into place with commit(). Raises HTTPException
+    (400, 413, 415 or 422) and removes the temp file if the body is rejected.
+    """
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in options:
+        raise HTTPException(status_code=415, detail="Expected a multipart/form-data body.")
+
+    events = []
+    part = {}
+
+    def on_part_begin():
+        part.clear()
+        part.update({"headers": {}, "field": b"", "value": b""})
+
+    def on_header_field(data, start, end):
+        part["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        part["value"] += data[start:end]
+
+    def on_header_end():
+        part["headers"][part["field"].lower()] = part["value"]
+        part["field"], part["value"] = b"", b""
+
+    def on_headers_finished():
+        events.append(("part", _disposition(part["headers"])))
+
+    def on_part_data(data, start, end):
+        events.append(("data", data[start:end]))
+
+    parser = MultipartParser(options[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+    })
+
+    fields, sink, validator, filename = {}, None, None, None
+    current = None  # _FILE_PART, a field name, or None for parts we ignore
+    try:
+        async for chunk in request.stream():
+            try:
+                parser.write(chunk)
+            except Exception as e:
+                raise HTTPException(status_code=400, detail=f"Malformed multipart body: {e}")
+            for kind, value in events:
+                if kind == "part":
+                    name, part_filename = value
+                    if name == file_field and sink is None:
+                        current, filename = _FILE_PART, part_filename
+                        sink, validator = _TempFileSink(temp_dir), PDFStreamValidator()
+                    elif part_filename is None and name:
+                        current = name
+                        fields[name] = b""
+                    else:
+                        current = None
+                elif current is _FILE_PART:
+                    validator.feed(value)
+                    await sink.write(value)
+                elif current is not None:
+                    fields[current] += value
+                    if len(fields[current]) > MAX_FIELD_BYTES:
+                        raise HTTPException(status_code=413, detail=f"Form field '{current}' is too large.")
+            events.clear()
+        parser.finalize()
+        if sink is None:
+            raise HTTPException(status_code=422, detail=f"Missing the '{file_field}' file.")
+        info = validator.finish()
+        await sink.close()
+    except BaseException:
+        if sink is not None:
+            sink.discard()
+        raise
+    decoded = {name: value.decode("utf-8", "replace") for name, value in fields.items()}
+    return decoded, {"path": sink.path, "filename": filename, **info}
+
+
+def commit(upload: dict, dest: Path) -> Path:
+    """Atomically renames a received upload to `dest` (on the same filesystem as its temp dir)."""
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(upload["path"], dest)
+    return dest
+
+
+def discard(upload: dict) -> None:
+    Path(upload["path"]).unlink(missing_ok=True)
+
+
+def openapi_form(fields: dict, file_field: str = "pdf") -> dict:
+    """`openapi_extra` documenting a multipart body of required `fields` (name -> JSON schema) and a PDF."""
+    properties = {**fields, file_field: {"type": "string", "format": "binary"}}
+    return {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+        "type": "object", "required": list(properties), "properties": properties,
+    }}}}}